@@ -0,0 +1,276 @@
+from flask import request, jsonify
+from datetime import datetime
+from . import api_bp
+from utils import get_db_connection, parse_date_window
+from cash import CashDayClosedError
+from live_events import latest_event_id
+from orders.service import (OrderError, OrderNotFoundError, create_order, get_order, get_order_lines,
+                            get_order_payments, order_total, add_items, edit_item, remove_item,
+                            close_order, get_order_timeline, replay_order, transfer_order)
+from sales import get_sales_report
+from kitchen_queue import KitchenError, TicketNotFoundError, get_open_tickets, set_status
+from write_queue import run_write
+from table_sessions import TableError, TableNotFoundError, TableConflictError, get_floor
+
+# JSON API for waiters' devices. Each call is one transaction and answers with
+# the order as it is after the change, so the client never has to re-read it.
+
+
+class BadRequest(Exception):
+    """The JSON body is missing fields or has the wrong types"""
+
+
+def _body():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise BadRequest("Request body must be a JSON object")
+    return body
+
+
+def _int_field(data, name, default=None):
+    value = data.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise BadRequest(f"{name} must be an integer")
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest(f"{name} must be an integer")
+
+
+def _number_field(data, name):
+    value = data.get(name)
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise BadRequest(f"{name} must be a number")
+    try:
+        return float(value)
+    except ValueError:
+        raise BadRequest(f"{name} must be a number")
+
+
+def _error(error):
+    if isinstance(error, (OrderNotFoundError, TicketNotFoundError, TableNotFoundError)):
+        return jsonify(error=str(error)), 404
+    if isinstance(error, TableConflictError):
+        return jsonify(error=str(error)), 409
+    return jsonify(error=str(error)), 400
+
+
+def order_json(conn, order_id):
+    """Compact representation of an order with its lines and total"""
+    order = get_order(conn, order_id)
+    lines = get_order_lines(conn, order_id)
+    return {
+        'id': order['id'],
+        'table_id': order['table_id'],
+        'customer_name': order['customer_name'],
+        'status': order['status'],
+        'created_at': order['created_at'],
+        'closed_at': order['closed_at'],
+        'lines': [{
+            'id': line['id'],
+            'menu_item_id': line['menu_item_id'],
+            'name': line['name'],
+            'quantity': line['quantity'],
+            'unit_price': line['unit_price'],
+            'notes': line['notes'],
+            'kitchen_status': line['kitchen_status'],
+        } for line in lines],
+        'total': round(order_total(lines), 2),
+        'payments': [{
+            'payment_method': payment['payment_method'],
+            'amount': payment['amount'],
+        } for payment in get_order_payments(conn, order_id)],
+    }
+
+
+@api_bp.route('/orders', methods=('POST',))
+def api_create_order():
+    conn = get_db_connection()
+    try:
+        body = _body()
+        order_id = create_order(conn, _int_field(body, 'table_id'), body.get('customer_name') or '')
+    except (BadRequest, OrderError, TableError) as error:
+        conn.rollback()
+        return _error(error)
+    conn.commit()
+    result = order_json(conn, order_id)
+    conn.close()
+    return jsonify(result), 201
+
+
+@api_bp.route('/orders/<int:order_id>')
+def api_get_order(order_id):
+    conn = get_db_connection()
+    try:
+        result = order_json(conn, order_id)
+    except OrderError as error:
+        return _error(error)
+    finally:
+        conn.close()
+    return jsonify(result)
+
+
+@api_bp.route('/orders/<int:order_id>/timeline')
+def api_order_timeline(order_id):
+    """Every change to the order's lines, oldest first"""
+    conn = get_db_connection()
+    try:
+        get_order(conn, order_id)
+    except OrderError as error:
+        return _error(error)
+    events = [{name: event[name] for name in event.keys() if event[name] is not None}
+              for event in get_order_timeline(conn, order_id)]
+    conn.close()
+    return jsonify(order_id=order_id, events=events)
+
+
+@api_bp.route('/orders/<int:order_id>/replay')
+def api_replay_order(order_id):
+    """The order's lines as they were at `at` (ISO date or datetime), default now"""
+    conn = get_db_connection()
+    try:
+        get_order(conn, order_id)
+        at = datetime.fromisoformat(request.args['at']) if 'at' in request.args else None
+    except OrderError as error:
+        return _error(error)
+    except ValueError:
+        return jsonify(error='at must be an ISO date or datetime'), 400
+    lines = replay_order(conn, order_id, at)
+    conn.close()
+    return jsonify(order_id=order_id, at=at.isoformat() if at else None, lines=lines,
+                   total=round(order_total(lines), 2))
+
+
+@api_bp.route('/orders/<int:order_id>/items', methods=('POST',))
+def api_add_items(order_id):
+    """Add several lines at once: {"items": [{"menu_item_id", "quantity", "notes"}, ...]}"""
+    try:
+        items = _body().get('items')
+        if not isinstance(items, list):
+            raise BadRequest("items must be a list")
+        parsed = []
+        for item in items:
+            if not isinstance(item, dict):
+                raise BadRequest("Each item must be a JSON object")
+            parsed.append((_int_field(item, 'menu_item_id'), _int_field(item, 'quantity', 1),
+                           item.get('notes') or ''))
+        run_write(lambda conn: add_items(conn, order_id, parsed))
+    except (BadRequest, OrderError) as error:
+        return _error(error)
+    conn = get_db_connection()
+    result = order_json(conn, order_id)
+    conn.close()
+    return jsonify(result)
+
+
+@api_bp.route('/orders/<int:order_id>/items/<int:item_id>', methods=('PATCH',))
+def api_edit_item(order_id, item_id):
+    """Change a line with {"quantity", "notes"}; a field left out keeps its value"""
+    try:
+        body = _body()
+        quantity = _int_field(body, 'quantity') if 'quantity' in body else None
+        notes = (body['notes'] or '') if 'notes' in body else None
+        run_write(lambda conn: edit_item(conn, order_id, item_id, quantity, notes))
+    except (BadRequest, OrderError) as error:
+        return _error(error)
+    conn = get_db_connection()
+    result = order_json(conn, order_id)
+    conn.close()
+    return jsonify(result)
+
+
+@api_bp.route('/orders/<int:order_id>/items/<int:item_id>', methods=('DELETE',))
+def api_remove_item(order_id, item_id):
+    try:
+        run_write(lambda conn: remove_item(conn, order_id, item_id))
+    except OrderError as error:
+        return _error(error)
+    conn = get_db_connection()
+    result = order_json(conn, order_id)
+    conn.close()
+    return jsonify(result)
+
+
+@api_bp.route('/orders/<int:order_id>/close', methods=('POST',))
+def api_close_order(order_id):
+    """Close with {"payments": [{"payment_method", "amount"}, ...]}"""
+    conn = get_db_connection()
+    try:
+        payments = _body().get('payments')
+        if not isinstance(payments, list):
+            raise BadRequest("payments must be a list")
+        parsed = []
+        for payment in payments:
+            if not isinstance(payment, dict) or not payment.get('payment_method'):
+                raise BadRequest("Each payment needs a payment_method and an amount")
+            parsed.append((str(payment['payment_method']), _number_field(payment, 'amount')))
+        close_order(conn, order_id, parsed)
+    except (BadRequest, OrderError, CashDayClosedError, TableError) as error:
+        conn.rollback()
+        return _error(error)
+    conn.commit()
+    result = order_json(conn, order_id)
+    conn.close()
+    return jsonify(result)
+
+
+@api_bp.route('/orders/<int:order_id>/transfer', methods=('POST',))
+def api_transfer_order(order_id):
+    """Move an open order to an available table: {"table_id": 7}"""
+    try:
+        table_id = _int_field(_body(), 'table_id')
+        run_write(lambda conn: transfer_order(conn, order_id, table_id))
+    except (BadRequest, OrderError, TableError) as error:
+        return _error(error)
+    conn = get_db_connection()
+    result = order_json(conn, order_id)
+    conn.close()
+    return jsonify(result)
+
+
+@api_bp.route('/tables')
+def api_tables():
+    """Floor snapshot; follow /events/stream?channels=tables afterwards"""
+    conn = get_db_connection()
+    tables = [dict(table) for table in get_floor(conn)]
+    last_event_id = latest_event_id(conn)
+    conn.close()
+    return jsonify(tables=tables, last_event_id=last_event_id)
+
+
+@api_bp.route('/kitchen/tickets')
+def api_kitchen_tickets():
+    """Lines not served yet; follow /events/stream?channels=kitchen afterwards"""
+    conn = get_db_connection()
+    tickets = get_open_tickets(conn)
+    last_event_id = latest_event_id(conn)
+    conn.close()
+    return jsonify(tickets=tickets, last_event_id=last_event_id)
+
+
+@api_bp.route('/kitchen/items/<int:item_id>', methods=('PATCH',))
+def api_kitchen_status(item_id):
+    """Move a line along the kitchen queue: {"status": "preparing"}"""
+    conn = get_db_connection()
+    try:
+        status = _body().get('status')
+        set_status(conn, item_id, status)
+    except (BadRequest, KitchenError) as error:
+        conn.rollback()
+        return _error(error)
+    conn.commit()
+    conn.close()
+    return jsonify(id=item_id, status=status)
+
+
+@api_bp.route('/reports/sales')
+def api_sales_report():
+    """Sales between date_from and date_to (YYYY-MM-DD, inclusive), last 30 days by default"""
+    try:
+        date_from, date_to, start, end = parse_date_window(request.args, 30)
+    except ValueError:
+        return jsonify(error='Dates must be in YYYY-MM-DD format'), 400
+    conn = get_db_connection()
+    report = get_sales_report(conn, start, end)
+    conn.close()
+    return jsonify(date_from=date_from, date_to=date_to, **report)
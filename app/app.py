@@ -1,5 +1,14 @@
 from flask import Flask, render_template, Blueprint
-from utils import get_db_connection, get_current_stock_for_menu_item, init_database
+from utils import get_db_connection, init_database
+from stock import get_stock_levels, STOCK_DOMAIN
+from menu_cache import MENU_DOMAIN
+from conditional import conditional_get
+from db import close_db_connection
+from live_events import page_versions
+from metrics import register_metrics
+from profiler import register_profiler
+from commands import register_commands
+from write_queue import register_write_queue
 
 # Import blueprints
 from menu import menu_bp
@@ -7,50 +16,83 @@ from orders import orders_bp
 from tables import tables_bp
 from movements import movements_bp
 from caja import caja_bp
-app = Flask(__name__)
-
-# Register blueprints
-app.register_blueprint(menu_bp)
-app.register_blueprint(orders_bp)
-app.register_blueprint(tables_bp)
-app.register_blueprint(movements_bp)
-app.register_blueprint(caja_bp)
+from api import api_bp
+from events import events_bp
+from kitchen import kitchen_bp
+from reports import reports_bp
+from export import export_bp
 
 # Main blueprint for the dashboard
 main_bp = Blueprint('main', __name__)
 
 # Main page: shows stockable menu items and current stock levels
 @main_bp.route('/')
+@conditional_get(STOCK_DOMAIN, MENU_DOMAIN, cache=True)
 def index():
     conn = get_db_connection()
-    stockable_items = conn.execute('SELECT * FROM menu_items WHERE stockable = 1 ORDER BY name').fetchall()
-    
-    # Get current stock for each stockable item
-    items_with_stock = []
-    for item in stockable_items:
-        current_stock = get_current_stock_for_menu_item(item['id'])
-        items_with_stock.append({
-            'id': item['id'],
-            'name': item['name'],
-            'unit': 'units',
-            'current_stock': current_stock
-        })
-    
+    # The page listens for stock changes made after it was rendered
+    versions = page_versions(conn, [STOCK_DOMAIN])
+    # Single read of the materialized stock levels instead of one SUM per item
+    items_with_stock = [{
+        'id': item['id'],
+        'name': item['name'],
+        'unit': 'units',
+        'current_stock': item['current_stock']
+    } for item in get_stock_levels(conn)]
+
     conn.close()
-    return render_template('index.html', items=items_with_stock)
+    return render_template('index.html', items=items_with_stock, versions=versions)
+
+
+def create_app(config=None):
+    """Build the application.
+
+    `config` overrides app.config; DATABASE_PATH and any setting of
+    db.DEFAULT_SETTINGS can be given there instead of in the environment.
+    The database is not touched here: whoever serves the app runs
+    init_database() once first (see serve.py).
+    """
+    app = Flask(__name__)
+    if config:
+        app.config.update(config)
+
+    # Give the per-request database connection back to the pool
+    app.teardown_appcontext(close_db_connection)
+
+    # Per-route request and SQL metrics on /metrics
+    register_metrics(app)
+
+    # Per-request SQL log with N+1 detection on /debug/sql (off by default)
+    register_profiler(app)
+
+    # 503 with Retry-After when a queued write cannot start in time
+    register_write_queue(app)
+
+    # Register blueprints
+    app.register_blueprint(main_bp)
+    app.register_blueprint(menu_bp)
+    app.register_blueprint(orders_bp)
+    app.register_blueprint(tables_bp)
+    app.register_blueprint(movements_bp)
+    app.register_blueprint(caja_bp)
+    app.register_blueprint(api_bp)
+    app.register_blueprint(events_bp)
+    app.register_blueprint(kitchen_bp)
+    app.register_blueprint(reports_bp)
+    app.register_blueprint(export_bp)
+
+    # flask --app app rebuild-stock-levels, export, import-csv, ...
+    register_commands(app)
+    return app
+
+
+# Default instance for `flask --app app` and the tests, configured from the
+# environment
+app = create_app()
 
-# Register main blueprint
-app.register_blueprint(main_bp)
 
 if __name__ == '__main__':
-    import sys
-    
-    # Check for database path argument
-    if len(sys.argv) > 1:
-        import os
-        os.environ['DATABASE_PATH'] = sys.argv[1]
-        print(f"Using database: {sys.argv[1]}")
-    
-    # Initialize database
+    # Development server with the debugger and reloader; production runs
+    # serve.py instead
     init_database()
     app.run(debug=True, port=5000)
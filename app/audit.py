@@ -0,0 +1,143 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+from db import get_db_connection, get_setting
+
+# Audit rows (menu_audit, order_item_events) are written in one of two modes:
+#
+# - synchronous (default): in the caller's transaction, so the audit row and
+#   the change it describes commit or roll back together.
+# - write-behind (AUDIT_WRITE_BEHIND=1): the rows wait on the connection until
+#   the caller commits, then go to a background thread that inserts them in
+#   batches of AUDIT_BATCH_SIZE or every AUDIT_FLUSH_INTERVAL_MS, and once
+#   more when the process exits. Rows of a rolled back transaction are never
+#   written, but rows still queued are lost if the process is killed.
+
+logger = logging.getLogger(__name__)
+
+AUDIT_INSERTS = {
+    'menu_audit': '''
+        INSERT INTO menu_audit (menu_item_id, action, old_values, new_values, timestamp, user_info)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''',
+    'order_item_events': '''
+        INSERT INTO order_item_events (order_id, order_item_id, event, menu_item_id, menu_item_name,
+                                       unit_price, quantity, notes, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''',
+}
+
+
+class AuditWriter:
+    """Background thread that batches audit rows for one database file"""
+
+    def __init__(self, database, batch_size, flush_interval):
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, table, rows):
+        for row in rows:
+            self._queue.put((table, row))
+
+    def flush(self):
+        """Block until every queued row has been written"""
+        # None wakes the thread up and makes it write what it holds now
+        self._queue.put(None)
+        self._queue.join()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+            flush_now = item is None
+            if item:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if batch and (flush_now or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                try:
+                    self._write(batch)
+                finally:
+                    # flush() waits for these rows whether or not they were written
+                    for _ in batch:
+                        self._queue.task_done()
+                batch = []
+                deadline = None
+            if flush_now:
+                self._queue.task_done()
+
+    def _write(self, batch):
+        rows_by_table = {}
+        for table, row in batch:
+            rows_by_table.setdefault(table, []).append(row)
+
+        conn = None
+        try:
+            # Opening the connection can fail too (locked, disk error); the thread must go on
+            conn = get_db_connection(self.database)
+            for table, rows in rows_by_table.items():
+                conn.executemany(AUDIT_INSERTS[table], rows)
+            conn.commit()
+        except Exception:
+            logger.exception("Could not write %d audit rows", len(batch))
+            if conn is not None and conn.in_transaction:
+                conn.rollback()
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(database):
+    writer = _writers.get(database)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(database)
+            if writer is None:
+                writer = AuditWriter(database, get_setting('AUDIT_BATCH_SIZE'),
+                                     get_setting('AUDIT_FLUSH_INTERVAL_MS') / 1000)
+                _writers[database] = writer
+    return writer
+
+
+@atexit.register
+def flush_audit():
+    """Write every row still queued by the write-behind writers"""
+    for writer in list(_writers.values()):
+        writer.flush()
+
+
+def record(conn, table, rows):
+    """Audit `rows` (tuples in AUDIT_INSERTS column order) of `table`.
+
+    Call it before the caller's commit, on the same connection as the change.
+    """
+    if not rows:
+        return
+    if get_setting('AUDIT_WRITE_BEHIND'):
+        writer = get_writer(conn.pool.database)
+        conn.on_commit(lambda: writer.enqueue(table, rows))
+    else:
+        conn.executemany(AUDIT_INSERTS[table], rows)
+
+
+def log_menu_audit(conn, menu_item_id, action, old_values=None, new_values=None):
+    """Log menu item changes for audit trail"""
+    record(conn, 'menu_audit', [(menu_item_id, action, old_values, new_values, datetime.now(), 'system')])
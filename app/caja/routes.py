@@ -1,61 +1,36 @@
-from flask import render_template, request
+from flask import render_template, request, redirect, url_for
 from . import caja_bp
-import sys
-import os
 from datetime import datetime
 from collections import defaultdict
 
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import get_db_connection
+from utils import get_db_connection, parse_date_window
+from cash import record_cash, close_cash_day, get_cash_summary, CashDayClosedError, CASH_DOMAIN
+from conditional import conditional_get
+from write_queue import run_write
 
-caja_query = """
-with table_payments as (
-    select 
-        date("created_at") "date", 
-        "payment_method", 
-        sum("amount") "amount", 
-        null as description,
-        'Orden de mesa' "movement_type"
-                                
-    from order_payments 
-    group by 1,2
-),
+# Days shown by the caja page when no date range is given
+DEFAULT_WINDOW_DAYS = 30
 
-manual_movements as (
-    select 
-        date("date") "date", 
-        "payment_method", 
-        "amount", 
-        "description",
-        "movement_type"
-    from manual_money_movements
-),
-
-both_tables as (
-    select *
-    from table_payments
-    union all 
-    select *
-    from manual_movements
-)        
-
-select *
-from both_tables 
-order by "date" DESC 
-"""
 
 # Caja management routes
 @caja_bp.route('/')
+@conditional_get(CASH_DOMAIN, daily=True, cache=True)
 def caja():
+    try:
+        date_from, date_to, _, _ = parse_date_window(request.args, DEFAULT_WINDOW_DAYS)
+    except ValueError:
+        return "Error: Dates must be in YYYY-MM-DD format", 400
+
     conn = get_db_connection()
-    caja_movements = conn.execute(caja_query).fetchall()
-    # Calculate totals per date
+    caja_movements, closures = get_cash_summary(conn, date_from, date_to)
+    conn.close()
+
+    # Calculate totals per date (over the rollup rows, a handful per day)
     date_totals = defaultdict(float)
     for row in caja_movements:
         date_totals[row['date']] += float(row['amount'])
-    conn.commit()
-    conn.close()
-    return render_template('caja/index.html', caja_movements=caja_movements, date_totals=date_totals)
+    return render_template('caja/index.html', caja_movements=caja_movements, date_totals=date_totals,
+                           closures=closures, date_from=date_from, date_to=date_to)
 
 
 @caja_bp.route('/modify_money', methods=('POST',) )
@@ -65,18 +40,37 @@ def modify_money():
     payment_method = request.form['payment_method']
 
     movement_type = 'Ingreso Manual' if float(amount) > 0 else 'Egreso Manual'
+    now = datetime.now()
 
-    conn = get_db_connection()
-    caja_movements = conn.execute('''
-        insert into manual_money_movements ("date","payment_method","description","amount","movement_type")
-        values (?, ?, ?, ?, ?)
-    ''', (datetime.now(), payment_method, description, amount, movement_type))
+    def write(conn):
+        conn.execute('''
+            insert into manual_money_movements ("date","payment_method","description","amount","movement_type")
+            values (?, ?, ?, ?, ?)
+        ''', (now, payment_method, description, amount, movement_type))
+        record_cash(conn, [(now, payment_method, movement_type, amount)])
 
-    caja_movements = conn.execute(caja_query).fetchall()
-    # Calculate totals per date
-    date_totals = defaultdict(float)
-    for row in caja_movements:
-        date_totals[row['date']] += float(row['amount'])
+    try:
+        run_write(write)
+    except CashDayClosedError as error:
+        return f"Error: {error}", 400
+    return redirect(url_for('caja.caja'))
+
+
+@caja_bp.route('/close_day', methods=('POST',))
+def close_day():
+    day = request.form['date']
+    try:
+        datetime.strptime(day, '%Y-%m-%d')
+    except ValueError:
+        return "Error: Dates must be in YYYY-MM-DD format", 400
+
+    conn = get_db_connection()
+    try:
+        close_cash_day(conn, day)
+    except CashDayClosedError as error:
+        conn.rollback()
+        return f"Error: {error}", 400
     conn.commit()
     conn.close()
-    return render_template('caja/index.html', caja_movements=caja_movements, date_totals=date_totals)
\ No newline at end of file
+    return redirect(url_for('caja.caja', date_from=request.form.get('date_from'),
+                            date_to=request.form.get('date_to')))
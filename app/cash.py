@@ -0,0 +1,121 @@
+from datetime import datetime
+
+from db import bump_change_counter, get_db_connection
+
+# cash_daily_summary holds one row per (date, payment_method, movement_type)
+# with the money in and out that day. It is updated in the same transaction
+# as every order payment and manual money movement, so the caja page never
+# has to aggregate the full history.
+
+ORDER_PAYMENT = 'Orden de mesa'
+
+# Change counter of the cash summary and closures
+CASH_DOMAIN = 'cash'
+
+UPSERT_CASH_SUMMARY = '''
+    INSERT INTO cash_daily_summary (date, payment_method, movement_type, amount, entries)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (date, payment_method, movement_type) DO UPDATE SET
+        amount = amount + excluded.amount,
+        entries = entries + excluded.entries
+'''
+
+
+class CashDayClosedError(Exception):
+    """Raised when writing money movements for a day that was already closed"""
+
+    def __init__(self, day):
+        super().__init__(f"Cash day {day} is already closed")
+        self.day = day
+
+
+def record_cash(conn, entries):
+    """Add (moment, payment_method, movement_type, amount) entries to the rollup.
+
+    Must run in the caller's transaction, before its commit. Raises
+    CashDayClosedError if any entry falls on a closed day; the caller rolls
+    back.
+    """
+    totals = {}
+    for moment, payment_method, movement_type, amount in entries:
+        key = (moment.date().isoformat(), payment_method, movement_type)
+        amount_total, count = totals.get(key, (0, 0))
+        totals[key] = (amount_total + float(amount), count + 1)
+
+    if not totals:
+        return
+
+    conn.executemany(UPSERT_CASH_SUMMARY, [
+        (day, payment_method, movement_type, amount, count)
+        for (day, payment_method, movement_type), (amount, count) in totals.items()
+    ])
+    # Checked after the upsert, which holds the write lock: a day cannot be
+    # closed between this check and the commit
+    days = sorted({day for day, _, _ in totals})
+    closed = conn.execute(
+        f"SELECT date FROM cash_day_closures WHERE date IN ({', '.join('?' * len(days))})", days
+    ).fetchone()
+    if closed is not None:
+        raise CashDayClosedError(closed['date'])
+    bump_change_counter(conn, CASH_DOMAIN)
+
+
+def close_cash_day(conn, day):
+    """Freeze the figures of a day (YYYY-MM-DD); later writes for it are rejected.
+
+    The total is summed by the INSERT itself, under the write lock, so a
+    payment committing at the same moment is either in it or rejected.
+    """
+    cursor = conn.execute('''
+        INSERT INTO cash_day_closures (date, total, closed_at)
+        SELECT ?, COALESCE(SUM(amount), 0), ?
+        FROM cash_daily_summary
+        WHERE date = ?
+        ON CONFLICT (date) DO NOTHING
+    ''', (day, datetime.now(), day))
+    if cursor.rowcount == 0:
+        raise CashDayClosedError(day)
+    bump_change_counter(conn, CASH_DOMAIN)
+    return conn.execute('SELECT total FROM cash_day_closures WHERE date = ?', (day,)).fetchone()['total']
+
+
+def get_cash_summary(conn, date_from, date_to):
+    """Rollup rows and closures for the days from date_from to date_to (inclusive)"""
+    rows = conn.execute('''
+        SELECT date, payment_method, movement_type, amount, entries
+        FROM cash_daily_summary
+        WHERE date >= ? AND date <= ?
+        ORDER BY date DESC, movement_type, payment_method
+    ''', (date_from, date_to)).fetchall()
+    closures = {row['date']: row for row in conn.execute('''
+        SELECT date, total, closed_at
+        FROM cash_day_closures
+        WHERE date >= ? AND date <= ?
+    ''', (date_from, date_to))}
+    return rows, closures
+
+
+def rebuild_cash_summary(DATABASE=None, conn=None):
+    """Recompute cash_daily_summary from order_payments and manual_money_movements"""
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection(DATABASE)
+
+    conn.execute('DELETE FROM cash_daily_summary')
+    cursor = conn.execute('''
+        INSERT INTO cash_daily_summary (date, payment_method, movement_type, amount, entries)
+        SELECT date("created_at"), "payment_method", ?, SUM("amount"), COUNT(*)
+        FROM order_payments
+        GROUP BY 1, 2
+        UNION ALL
+        SELECT date("date"), "payment_method", "movement_type", SUM("amount"), COUNT(*)
+        FROM manual_money_movements
+        GROUP BY 1, 2, 3
+    ''', (ORDER_PAYMENT,))
+    rebuilt = cursor.rowcount
+    bump_change_counter(conn, CASH_DOMAIN)
+
+    if own_connection:
+        conn.commit()
+        conn.close()
+    return rebuilt
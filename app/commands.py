@@ -0,0 +1,88 @@
+import click
+
+from utils import get_db_connection, init_database, parse_date_window
+from stock import rebuild_stock_levels, create_stock_checkpoints
+from cash import rebuild_cash_summary
+from sales import rebuild_sales_rollups
+from exports import EXPORTS, FORMATS, export_chunks
+from imports import CsvImportError, parse_menu_csv, parse_movements_csv, import_menu_items, import_movements
+from menu_cache import menu_cache
+
+# Maintenance commands, run as `flask --app app <command>`. Flask runs them
+# inside an app context, so they use the app's DATABASE_PATH and settings.
+
+
+def register_commands(app):
+    """Add the maintenance commands to app.cli"""
+
+    @app.cli.command('rebuild-stock-levels')
+    def rebuild_stock_levels_command():
+        """Recompute the stock_levels table from the movements history."""
+        init_database()
+        rebuilt = rebuild_stock_levels()
+        print(f"Rebuilt stock levels for {rebuilt} menu items")
+
+    @app.cli.command('rebuild-cash-summary')
+    def rebuild_cash_summary_command():
+        """Recompute the cash_daily_summary table from payments and manual movements."""
+        init_database()
+        rebuilt = rebuild_cash_summary()
+        print(f"Rebuilt {rebuilt} cash summary rows")
+
+    @app.cli.command('rebuild-sales-rollups')
+    def rebuild_sales_rollups_command():
+        """Recompute the hourly sales rollups from closed orders and payments."""
+        init_database()
+        rebuilt = rebuild_sales_rollups()
+        print(f"Rebuilt {rebuilt} sales rollup rows")
+
+    @app.cli.command('checkpoint-stock')
+    def checkpoint_stock_command():
+        """Checkpoint the stock of every item that moved since its last checkpoint.
+
+        Meant to run once a day (e.g. from cron) on top of the automatic
+        checkpoints taken every STOCK_CHECKPOINT_INTERVAL movements.
+        """
+        init_database()
+        conn = get_db_connection()
+        created = create_stock_checkpoints(conn)
+        conn.commit()
+        conn.close()
+        print(f"Created {created} stock checkpoints")
+
+    @app.cli.command('export')
+    @click.argument('name', type=click.Choice(list(EXPORTS)))
+    @click.option('--date-from', help="First day (YYYY-MM-DD), default 30 days ago")
+    @click.option('--date-to', help="Last day (YYYY-MM-DD), default today")
+    @click.option('--format', 'fmt', type=click.Choice(list(FORMATS)), default='csv')
+    @click.option('--output', type=click.File('w', encoding='utf-8'), default='-', help="File to write, default stdout")
+    def export_command(name, date_from, date_to, fmt, output):
+        """Export a table as CSV or JSONL for a range of days."""
+        try:
+            _, _, start, end = parse_date_window({'date_from': date_from, 'date_to': date_to}, 30)
+        except ValueError:
+            raise click.BadParameter("Dates must be in YYYY-MM-DD format")
+        init_database()
+        for chunk in export_chunks(name, fmt, start, end):
+            output.write(chunk)
+
+    @app.cli.command('import-csv')
+    @click.argument('kind', type=click.Choice(['menu', 'movements']))
+    @click.argument('file', type=click.File('r', encoding='utf-8-sig'))
+    def import_csv_command(kind, file):
+        """Import menu items or stock movements from a CSV file, all or nothing."""
+        init_database()
+        conn = get_db_connection()
+        try:
+            if kind == 'menu':
+                imported = import_menu_items(conn, parse_menu_csv(file.read()))
+            else:
+                imported = import_movements(conn, parse_movements_csv(conn, file.read()))
+        except CsvImportError as error:
+            conn.rollback()
+            conn.close()
+            raise click.ClickException('\n'.join(f"line {line}: {message}" for line, message in error.errors))
+        conn.commit()
+        conn.close()
+        menu_cache.invalidate()
+        print(f"Imported {imported} {'menu items' if kind == 'menu' else 'stock movements'}")
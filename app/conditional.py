@@ -0,0 +1,138 @@
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, time, timezone
+
+from flask import current_app, make_response, request
+from werkzeug.http import is_resource_modified
+
+from db import get_change_counters, get_database_path, get_db_connection, get_setting
+
+# Conditional GET for the pages terminals keep reloading. A page declares the
+# change counter domains it is built from; its ETag hashes their versions
+# with the URL (and the day, for pages whose default date window moves), and
+# Last-Modified is the latest changed_at among them. Reading the counters is
+# one primary key lookup per domain, so a page nobody changed answers 304
+# without running its queries or its template.
+#
+# The same ETag keys the optional render cache (RENDER_CACHE=1): the HTML of
+# the heaviest pages is kept per process and served as is to any terminal
+# asking for the same URL while the counters stay put. Writers in other
+# worker processes bump the same counters, so neither can go stale.
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_code_version = None
+
+
+def code_version():
+    """Latest modification time of the app's code and templates.
+
+    Part of every ETag, so a deploy invalidates the pages browsers hold even
+    though no counter moved. The same on every worker serving the same files.
+    """
+    global _code_version
+    if _code_version is None:
+        newest = 0.0
+        for directory, _, files in os.walk(current_app.root_path):
+            for name in files:
+                if name.endswith(('.py', '.html')):
+                    newest = max(newest, os.path.getmtime(os.path.join(directory, name)))
+        _code_version = newest
+    return _code_version
+
+
+class RenderCache:
+    """Per-process LRU of rendered pages keyed by ETag"""
+
+    def __init__(self):
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag):
+        with self._lock:
+            page = self._pages.get(etag)
+            if page is not None:
+                self._pages.move_to_end(etag)
+            return page
+
+    def put(self, etag, page, max_size):
+        with self._lock:
+            self._pages[etag] = page
+            self._pages.move_to_end(etag)
+            while len(self._pages) > max_size:
+                self._pages.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+
+render_cache = RenderCache()
+
+
+def page_validators(domains, daily=False):
+    """(etag, last_modified) of the current request's page.
+
+    last_modified is None while the latest change is in the current second:
+    HTTP dates have one-second resolution, so a client holding it would miss
+    a second write in the same second. The ETag still validates the page.
+    """
+    counters = get_change_counters(get_db_connection(), domains)
+    code = code_version()
+    parts = [get_database_path(), request.full_path, str(code)]
+    parts += [f'{domain}={counters[domain][0]}' for domain in domains]
+    moments = [datetime.fromtimestamp(int(code), timezone.utc)]
+    moments += [datetime.strptime(changed_at, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+                for _, changed_at in counters.values() if changed_at]
+    if daily:
+        today = date.today()
+        parts.append(today.isoformat())
+        moments.append(datetime.combine(today, time()).astimezone(timezone.utc))
+    etag = hashlib.sha1('|'.join(parts).encode()).hexdigest()[:20]
+    last_modified = max(moments)
+    if last_modified >= datetime.now(timezone.utc).replace(microsecond=0):
+        last_modified = None
+    return etag, last_modified
+
+
+def _validated(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Browsers may keep the page but must ask before showing it again
+    response.cache_control.no_cache = True
+    return response
+
+
+def conditional_get(*domains, daily=False, cache=False):
+    """Serve a GET view with ETag/Last-Modified derived from `domains`.
+
+    daily: the page also depends on today's date (a default date window).
+    cache: keep the rendered page in the render cache when RENDER_CACHE=1.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not get_setting('CONDITIONAL_GET'):
+                return view(*args, **kwargs)
+
+            etag, last_modified = page_validators(domains, daily)
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                return _validated(current_app.response_class(status=304), etag, last_modified)
+
+            use_cache = cache and get_setting('RENDER_CACHE')
+            page = render_cache.get(etag) if use_cache else None
+            if page is not None:
+                return _validated(current_app.response_class(page, mimetype='text/html'), etag, last_modified)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            if use_cache:
+                render_cache.put(etag, response.get_data(as_text=True), get_setting('RENDER_CACHE_SIZE'))
+            return _validated(response, etag, last_modified)
+        return wrapper
+    return decorator
@@ -0,0 +1,341 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from flask import current_app, g, has_app_context
+
+# Defaults for the connection tuning knobs. Each one can be overridden in
+# app.config or with an environment variable of the same name.
+DEFAULT_SETTINGS = {
+    'SQLITE_POOL_SIZE': 8,
+    'SQLITE_BUSY_TIMEOUT_MS': 5000,
+    'SQLITE_CACHE_SIZE_KB': 16384,
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+    # Movements of one item between two automatic stock checkpoints
+    'STOCK_CHECKPOINT_INTERVAL': 500,
+    # Audit rows: 0 writes them in the caller's transaction, 1 hands them to
+    # a background writer that inserts them in batches after the commit
+    'AUDIT_WRITE_BEHIND': 0,
+    'AUDIT_BATCH_SIZE': 200,
+    'AUDIT_FLUSH_INTERVAL_MS': 1000,
+    # Per-route request and SQL metrics served on /metrics; with METRICS_DIR
+    # set, how often each worker writes its totals there
+    'METRICS_ENABLED': 1,
+    'METRICS_FLUSH_MS': 1000,
+    # SQL profiler (debug): per-request statement log on /debug/sql, N+1
+    # detection and a log line for slow requests
+    'SQL_PROFILER': 0,
+    'SQL_SLOW_REQUEST_MS': 200,
+    'SQL_SLOW_STATEMENT_MS': 50,
+    'SQL_EXPLAIN_SLOW': 0,
+    'SQL_N_PLUS_ONE_THRESHOLD': 5,
+    'SQL_PROFILER_HISTORY': 50,
+    # Server-Sent Events: events kept in live_events, how often a stream
+    # looks for new ones and how long a stream lasts before the browser
+    # reconnects (which frees the worker thread)
+    'LIVE_EVENTS_KEEP': 5000,
+    'LIVE_EVENTS_POLL_MS': 500,
+    'LIVE_EVENTS_STREAM_SECONDS': 300,
+    # Rows fetched from the cursor per chunk of a CSV/JSONL export
+    'EXPORT_CHUNK_ROWS': 1000,
+    # Conditional GET: the menu, tables, dashboard and caja pages carry an
+    # ETag and Last-Modified from the change counters and answer 304 while
+    # nothing changed; RENDER_CACHE=1 also keeps the rendered HTML of the
+    # heaviest ones per process, for RENDER_CACHE_SIZE pages
+    'CONDITIONAL_GET': 1,
+    'RENDER_CACHE': 0,
+    'RENDER_CACHE_SIZE': 64,
+    # Group commit: 1 sends the short writes of the order, movement and caja
+    # routes to one writer thread per process that commits them in batches;
+    # a request waits at most WRITE_QUEUE_TIMEOUT_MS for its write to start
+    'WRITE_QUEUE': 0,
+    'WRITE_QUEUE_BATCH_SIZE': 50,
+    'WRITE_QUEUE_MAX_SIZE': 1000,
+    'WRITE_QUEUE_TIMEOUT_MS': 5000,
+    # Production server (serve.py): worker processes (0 = one per CPU core),
+    # threads per worker and the port it listens on
+    'SERVER_WORKERS': 0,
+    'SERVER_THREADS': 8,
+    'SERVER_PORT': 5001,
+}
+
+
+def get_setting(name):
+    """Read a database setting from app config, environment or defaults"""
+    if has_app_context() and name in current_app.config:
+        return int(current_app.config[name])
+    return int(os.environ.get(name, DEFAULT_SETTINGS[name]))
+
+
+def get_database_path(DATABASE=None):
+    if DATABASE is None and has_app_context():
+        DATABASE = current_app.config.get('DATABASE_PATH')
+    if DATABASE is None:
+        # Check environment variable first, then fallback to default
+        DATABASE = os.environ.get('DATABASE_PATH',
+                                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'inventory.db'))
+    return DATABASE
+
+
+# Statements that make SQLite take the database write lock when no
+# transaction is open yet
+WRITE_STATEMENT = re.compile(r'\s*(?:INSERT|UPDATE|DELETE|REPLACE|BEGIN\s+IMMEDIATE)\b', re.IGNORECASE)
+
+
+class LockWaitStats:
+    """How long writers waited for the write lock, across all connections.
+
+    Measured as the duration of the statement that opens each write
+    transaction, which is where SQLite's busy handler waits for other
+    writers. The statement's own work is included, so a few microseconds
+    per write is the floor.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def add(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            self.total_seconds = 0.0
+            self.max_seconds = 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return {'count': self.count, 'total_seconds': self.total_seconds, 'max_seconds': self.max_seconds}
+
+
+lock_waits = LockWaitStats()
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection that goes back to its pool when closed"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.request_bound = False
+        self._on_commit = []
+        # Called as statement_observer(sql, seconds, many) after each execute
+        self.statement_observer = None
+        self.reset_statement_stats()
+
+    def reset_statement_stats(self):
+        """Zero the statement count and time, done when a request takes it"""
+        self.statement_count = 0
+        self.statement_seconds = 0.0
+
+    def _timed(self, run, sql, parameters, many=False):
+        # Time spent in execute() itself: the whole statement for writes, up
+        # to the first row for SELECTs (the rest is read by fetchall)
+        opens_write_transaction = not self.in_transaction and WRITE_STATEMENT.match(sql)
+        started = time.perf_counter()
+        try:
+            return run(self, sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.statement_count += 1
+            self.statement_seconds += elapsed
+            if opens_write_transaction:
+                lock_waits.add(elapsed)
+            if self.statement_observer is not None:
+                self.statement_observer(sql, elapsed, many)
+
+    def execute(self, sql, parameters=()):
+        return self._timed(sqlite3.Connection.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(sqlite3.Connection.executemany, sql, seq_of_parameters, many=True)
+
+    def on_commit(self, callback):
+        """Run callback after the current transaction commits; dropped on rollback"""
+        self._on_commit.append(callback)
+
+    def commit(self):
+        super().commit()
+        callbacks, self._on_commit = self._on_commit, []
+        for callback in callbacks:
+            callback()
+
+    def rollback(self):
+        self._on_commit = []
+        super().rollback()
+
+    def close(self):
+        if self.request_bound:
+            # Shared by the whole request, close_db_connection releases it
+            return
+        if self.pool is not None:
+            self.pool.release(self)
+        else:
+            self.discard()
+
+    def discard(self):
+        """Really close the underlying sqlite3 connection"""
+        super().close()
+
+
+class ConnectionPool:
+    """Small thread-safe pool of tuned connections to one database file"""
+
+    def __init__(self, database, max_size):
+        self.database = database
+        self.max_size = max_size
+        self._idle = []
+        self._lock = threading.Lock()
+        self._file_id = self._current_file_id()
+
+    def _current_file_id(self):
+        # Lets us notice when the file was deleted and recreated underneath us
+        try:
+            stat = os.stat(self.database)
+        except OSError:
+            return None
+        return (stat.st_dev, stat.st_ino)
+
+    def _connect(self):
+        busy_timeout_ms = get_setting('SQLITE_BUSY_TIMEOUT_MS')
+        conn = sqlite3.connect(self.database,
+                               timeout=busy_timeout_ms / 1000,
+                               check_same_thread=False,
+                               factory=PooledConnection)
+        conn.row_factory = sqlite3.Row
+        conn.pool = self
+
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA busy_timeout = {busy_timeout_ms:d}')
+        # Negative cache_size is in KiB instead of pages
+        conn.execute(f'PRAGMA cache_size = -{get_setting("SQLITE_CACHE_SIZE_KB"):d}')
+        conn.execute(f'PRAGMA mmap_size = {get_setting("SQLITE_MMAP_SIZE"):d}')
+        return conn
+
+    def acquire(self):
+        file_id = self._current_file_id()
+        with self._lock:
+            if file_id != self._file_id:
+                stale, self._idle = self._idle, []
+                self._file_id = file_id
+            else:
+                stale = []
+            conn = self._idle.pop() if self._idle else None
+
+        for old in stale:
+            old.discard()
+        if conn is None:
+            conn = self._connect()
+        return conn
+
+    def release(self, conn):
+        # Profiling hooks belong to the request that installed them
+        conn.statement_observer = None
+        conn.set_trace_callback(None)
+        if conn.in_transaction:
+            # Whatever was not committed by the caller is thrown away, exactly
+            # like closing a plain sqlite3 connection would do
+            conn.rollback()
+        conn._on_commit = []
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append(conn)
+                return
+        conn.discard()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.discard()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(DATABASE=None):
+    database = get_database_path(DATABASE)
+    pool = _pools.get(database)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(database)
+            if pool is None:
+                pool = ConnectionPool(database, get_setting('SQLITE_POOL_SIZE'))
+                _pools[database] = pool
+    return pool
+
+
+def get_db_connection(DATABASE=None):
+    """Return a pooled connection.
+
+    Inside an app context the same connection is shared by every caller for
+    the rest of the request; calling close() on it is a no-op and it goes back
+    to the pool in close_db_connection(). Outside an app context each call
+    leases its own connection until close() is called.
+    """
+    if DATABASE is None and has_app_context():
+        conn = g.get('db')
+        if conn is None:
+            conn = get_pool().acquire()
+            conn.request_bound = True
+            conn.reset_statement_stats()
+            g.db = conn
+        return conn
+
+    return get_pool(DATABASE).acquire()
+
+
+def inserted_ids(conn, count):
+    """Ids of the `count` rows added by the connection's last executemany INSERT.
+
+    The transaction holds the write lock from its first write, so no other
+    connection inserts in between and the new ids are consecutive.
+    """
+    last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+    return range(last_id - count + 1, last_id + 1)
+
+
+def bump_change_counter(conn, domain):
+    """Bump the version of a domain in change_counters.
+
+    Must run in the same transaction as the write it announces, so other
+    processes never see the new data with the old version.
+    """
+    conn.execute('''
+        INSERT INTO change_counters (domain, version, changed_at) VALUES (?, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT (domain) DO UPDATE SET version = version + 1, changed_at = CURRENT_TIMESTAMP
+    ''', (domain,))
+
+
+def get_change_counter(conn, domain):
+    """Current version of a domain, 0 if it was never written"""
+    row = conn.execute('SELECT version FROM change_counters WHERE domain = ?', (domain,)).fetchone()
+    return row['version'] if row else 0
+
+
+def get_change_counters(conn, domains):
+    """(version, changed_at) of each domain in one query; (0, None) if never written"""
+    rows = conn.execute(f'''
+        SELECT domain, version, changed_at FROM change_counters
+        WHERE domain IN ({', '.join('?' * len(domains))})
+    ''', list(domains)).fetchall()
+    counters = {domain: (0, None) for domain in domains}
+    counters.update((row['domain'], (row['version'], row['changed_at'])) for row in rows)
+    return counters
+
+
+def close_db_connection(exception=None):
+    """Teardown handler: give the request connection back to the pool"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.request_bound = False
+        conn.close()
+
@@ -0,0 +1,89 @@
+import time
+from flask import Response, request
+from . import events_bp
+from db import get_database_path, get_setting
+from utils import get_db_connection
+from live_events import (CHANNELS, latest_event_id, oldest_event_id, read_events, event_generation,
+                         wait_for_events, changed_since)
+
+# Server-Sent Events stream of live_events. Each stream polls the table with
+# a short-lived pooled connection, so an idle stream holds no connection and
+# works the same whichever worker process wrote the events. Between polls a
+# stream sleeps until a commit in this process publishes something, so local
+# changes go out immediately. Streams end after
+# LIVE_EVENTS_STREAM_SECONDS; the browser reconnects by itself and sends the
+# last id it saw in the Last-Event-ID header, so nothing is missed.
+#
+# A page starts its stream either after the event id it was rendered at
+# (after=) or, for pages served from the render cache or with 304, from now
+# with the change counter versions it was rendered at (since=, see
+# live_events.page_versions). Either way the stream sends `reset`, and the
+# page reloads, when it cannot tell the page what it missed.
+
+KEEPALIVE_SECONDS = 15
+BATCH_SIZE = 200
+
+
+@events_bp.route('/stream')
+def stream():
+    channels = [channel for channel in request.args.get('channels', ','.join(CHANNELS)).split(',')
+                if channel in CHANNELS]
+    if not channels:
+        return f"Error: channels must be some of {', '.join(CHANNELS)}", 400
+
+    conn = get_db_connection()
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('after')
+    try:
+        if last_id is None:
+            last_id = latest_event_id(conn)
+            # The page's data changed between its rendering and now
+            since = request.args.get('since')
+            missed = since is not None and changed_since(conn, since)
+        else:
+            last_id = int(last_id)
+            # Events the page never saw were already pruned: it has to reload
+            missed = last_id < oldest_event_id(conn) - 1
+    except ValueError:
+        return "Error: Invalid event id or versions", 400
+    finally:
+        conn.close()
+
+    database = get_database_path()
+    poll_seconds = get_setting('LIVE_EVENTS_POLL_MS') / 1000
+    stream_seconds = get_setting('LIVE_EVENTS_STREAM_SECONDS')
+
+    def events(last_id):
+        deadline = time.monotonic() + stream_seconds
+        last_write = time.monotonic()
+        yield 'retry: 2000\n\n'
+        if missed:
+            yield 'event: reset\ndata: {}\n\n'
+
+        while True:
+            generation = event_generation()
+            conn = get_db_connection(database)
+            try:
+                rows = read_events(conn, last_id, channels, BATCH_SIZE)
+            finally:
+                conn.close()
+
+            for row in rows:
+                last_id = row['id']
+                yield f"id: {row['id']}\nevent: {row['channel']}\ndata: {row['payload']}\n\n"
+            if len(rows) == BATCH_SIZE:
+                continue
+
+            now = time.monotonic()
+            if rows:
+                last_write = now
+            if now >= deadline:
+                return
+            if now - last_write >= KEEPALIVE_SECONDS:
+                # A comment line keeps proxies from closing the connection
+                # and lets us notice clients that went away
+                yield ': keepalive\n\n'
+                last_write = now
+            wait_for_events(generation, poll_seconds)
+
+    return Response(events(last_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
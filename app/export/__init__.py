@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+export_bp = Blueprint('export', __name__, url_prefix='/exports')
+
+from . import routes
@@ -0,0 +1,32 @@
+from flask import Response, render_template, request
+from . import export_bp
+from utils import parse_date_window
+from exports import EXPORTS, FORMATS, export_chunks
+
+# Days exported when no date range is given
+DEFAULT_WINDOW_DAYS = 30
+
+
+@export_bp.route('/')
+def exports():
+    try:
+        date_from, date_to, _, _ = parse_date_window(request.args, DEFAULT_WINDOW_DAYS)
+    except ValueError:
+        return "Error: Dates must be in YYYY-MM-DD format", 400
+    return render_template('exports/index.html', exports=EXPORTS, formats=FORMATS,
+                           date_from=date_from, date_to=date_to)
+
+
+# Streams the rows straight from the cursor; nothing is built in memory
+@export_bp.route('/<name>.<fmt>')
+def export(name, fmt):
+    if name not in EXPORTS or fmt not in FORMATS:
+        return "Error: Unknown export", 404
+    try:
+        date_from, date_to, start, end = parse_date_window(request.args, DEFAULT_WINDOW_DAYS)
+    except ValueError:
+        return "Error: Dates must be in YYYY-MM-DD format", 400
+
+    filename = f"{name}_{date_from}_{date_to}.{fmt}"
+    return Response(export_chunks(name, fmt, start, end), mimetype=FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
@@ -0,0 +1,85 @@
+import csv
+import io
+import json
+
+from db import get_database_path, get_db_connection, get_setting
+
+# CSV and JSONL exports of the history tables for the accountant. Each export
+# is one query over a date range, read through a cursor EXPORT_CHUNK_ROWS rows
+# at a time and turned into text chunk by chunk, so memory stays flat however
+# long the range is. Every query walks a date index in date order.
+
+# name -> query taking the [start, end) datetimes of the range
+EXPORTS = {
+    'orders': '''
+        SELECT * FROM orders
+        WHERE created_at >= ? AND created_at < ?
+        ORDER BY created_at, id
+    ''',
+    # Lines of the orders created in the range
+    'order_items': '''
+        SELECT oi.* FROM orders o
+        JOIN order_items oi ON oi.order_id = o.id
+        WHERE o.created_at >= ? AND o.created_at < ?
+        ORDER BY o.created_at, o.id
+    ''',
+    'order_payments': '''
+        SELECT * FROM order_payments
+        WHERE created_at >= ? AND created_at < ?
+        ORDER BY created_at
+    ''',
+    'movements': '''
+        SELECT * FROM movements
+        WHERE date >= ? AND date < ?
+        ORDER BY date, id
+    ''',
+    'manual_money_movements': '''
+        SELECT * FROM manual_money_movements
+        WHERE date >= ? AND date < ?
+        ORDER BY date, id
+    ''',
+    'menu_audit': '''
+        SELECT * FROM menu_audit
+        WHERE timestamp >= ? AND timestamp < ?
+        ORDER BY timestamp, id
+    ''',
+}
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def _csv_chunk(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def export_chunks(name, fmt, start, end, DATABASE=None):
+    """Generator of an export as text chunks (header first for CSV).
+
+    The database and chunk size are resolved now; the rows are read with a
+    separate pooled connection, released when the generator finishes or is
+    closed, so the response can keep streaming after the request ends.
+    """
+    return _chunks(EXPORTS[name], fmt, start, end, get_database_path(DATABASE),
+                   get_setting('EXPORT_CHUNK_ROWS'))
+
+
+def _chunks(query, fmt, start, end, database, chunk_rows):
+    conn = get_db_connection(database)
+    try:
+        cursor = conn.execute(query, (start, end))
+        columns = [column[0] for column in cursor.description]
+        if fmt == 'csv':
+            yield _csv_chunk([columns])
+
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            if fmt == 'csv':
+                yield _csv_chunk(rows)
+            else:
+                yield ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows)
+    finally:
+        conn.close()
@@ -0,0 +1,136 @@
+import csv
+import io
+
+from audit import log_menu_audit
+from db import bump_change_counter, inserted_ids
+from menu_cache import menu_cache, MENU_DOMAIN
+from stock import insert_movements, movement_type_for
+
+# Bulk CSV imports of menu items and stock movements (a supplier delivery).
+# The whole file is parsed and validated before anything is written; then
+# every row goes in with one executemany in the caller's transaction, with a
+# single menu_audit entry for the batch.
+#
+#   menu:      name,description,category,price,stockable
+#   movements: menu_item_id or menu_item_name,quantity_change,notes
+
+TRUE_VALUES = {'1', 'true', 'yes', 'si', 'sí', 'on', 'x'}
+FALSE_VALUES = {'', '0', 'false', 'no', 'off'}
+
+
+class CsvImportError(Exception):
+    """The file has invalid rows; errors holds (line number, message) pairs"""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(f"line {line}: {message}" for line, message in errors))
+        self.errors = errors
+
+
+def _read_rows(text, required):
+    """(line number, row dict) for every non-empty data row of a CSV text,
+    and the errors of the rows that could not be read"""
+    reader = csv.DictReader(io.StringIO(text))
+    columns = {column.strip() for column in reader.fieldnames or []}
+    missing = [column for column in required if column not in columns]
+    if missing:
+        raise CsvImportError([(1, f"missing column {', '.join(missing)}")])
+    rows, errors = [], []
+    for row in reader:
+        # DictReader puts the fields beyond the header in a list under None,
+        # usually from an unquoted comma in a description
+        if None in row:
+            errors.append((reader.line_num, f"too many fields, expected {len(reader.fieldnames)}"))
+            continue
+        row = {key.strip(): (value or '').strip() for key, value in row.items()}
+        if any(row.values()):
+            rows.append((reader.line_num, row))
+    if not rows and not errors:
+        raise CsvImportError([(1, "no rows to import")])
+    return rows, errors
+
+
+def parse_menu_csv(text):
+    """Validated (name, description, category, price, stockable) tuples"""
+    rows, errors = _read_rows(text, ('name', 'category', 'price'))
+    items = []
+    for line, row in rows:
+        if not row['name']:
+            errors.append((line, "name is required"))
+        if not row['category']:
+            errors.append((line, "category is required"))
+        try:
+            price = float(row['price'])
+            if price < 0:
+                raise ValueError
+        except ValueError:
+            errors.append((line, f"price must be a positive number, got {row['price']!r}"))
+            continue
+        stockable = row.get('stockable', '').lower()
+        if stockable not in TRUE_VALUES | FALSE_VALUES:
+            errors.append((line, f"stockable must be yes or no, got {row['stockable']!r}"))
+            continue
+        items.append((row['name'], row.get('description', ''), row['category'], price,
+                      1 if stockable in TRUE_VALUES else 0))
+    if errors:
+        raise CsvImportError(sorted(errors))
+    return items
+
+
+def parse_movements_csv(conn, text):
+    """Validated (menu_item_id, menu_item_name, quantity_change, movement_type, notes) tuples.
+
+    Items are looked up in the menu cache by id, or else by exact name, and
+    must be stockable.
+    """
+    snapshot = menu_cache.snapshot(conn)
+    by_name = {item['name']: item for item in snapshot.stockable}
+
+    rows, errors = _read_rows(text, ('quantity_change',))
+    movements = []
+    for line, row in rows:
+        item = None
+        if row.get('menu_item_id'):
+            try:
+                item = snapshot.by_id.get(int(row['menu_item_id']))
+            except ValueError:
+                pass
+        elif row.get('menu_item_name'):
+            item = by_name.get(row['menu_item_name'])
+        if item is None or not item['stockable']:
+            reference = row.get('menu_item_id') or row.get('menu_item_name') or ''
+            errors.append((line, f"no stockable menu item {reference!r}"))
+            continue
+        try:
+            quantity_change = int(row['quantity_change'])
+        except ValueError:
+            errors.append((line, f"quantity_change must be an integer, got {row['quantity_change']!r}"))
+            continue
+        movements.append((item['id'], item['name'], quantity_change, movement_type_for(quantity_change),
+                          row.get('notes', '')))
+    if errors:
+        raise CsvImportError(sorted(errors))
+    return movements
+
+
+def import_menu_items(conn, items):
+    """Insert parsed menu items; the caller commits and invalidates the menu cache"""
+    cursor = conn.executemany('''
+        INSERT INTO menu_items (name, description, category, price, stockable)
+        VALUES (?, ?, ?, ?, ?)
+    ''', items)
+    ids = inserted_ids(conn, cursor.rowcount)
+    log_menu_audit(conn, None, 'IMPORT', None,
+                   f"{cursor.rowcount} menu items imported (ids {ids[0]}-{ids[-1]}): "
+                   + ', '.join(name for name, *_ in items))
+    bump_change_counter(conn, MENU_DOMAIN)
+    return cursor.rowcount
+
+
+def import_movements(conn, movements):
+    """Insert parsed movements with running partial_stock; the caller commits"""
+    item_ids = {menu_item_id for menu_item_id, *_ in movements}
+    insert_movements(conn, movements)
+    log_menu_audit(conn, None, 'STOCK IMPORT', None,
+                   f"{len(movements)} stock movements imported for {len(item_ids)} items, "
+                   f"total change {sum(quantity for _, _, quantity, _, _ in movements):+d}")
+    return len(movements)
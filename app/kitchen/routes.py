@@ -0,0 +1,17 @@
+from flask import render_template
+from . import kitchen_bp
+from utils import get_db_connection
+from live_events import latest_event_id
+from kitchen_queue import get_open_tickets, STATUSES
+
+
+# Kitchen screen: the open tickets once, then only the changed lines from the
+# kitchen event channel
+@kitchen_bp.route('/')
+def kitchen():
+    conn = get_db_connection()
+    tickets = get_open_tickets(conn)
+    last_event_id = latest_event_id(conn)
+    conn.close()
+    return render_template('kitchen/index.html', tickets=tickets, statuses=STATUSES,
+                           last_event_id=last_event_id)
@@ -0,0 +1,100 @@
+from live_events import publish, KITCHEN
+
+# Kitchen queue: every order line goes pending -> preparing -> ready -> served.
+# Lines of open tickets (anything not served) are covered by a partial index,
+# so the queue is read without touching the rest of order_items. Screens load
+# the open tickets once and then follow the kitchen channel, which carries one
+# event per added, edited, moved or removed line:
+#
+#   kitchen: {"id": 7, "order_id": 3, "table": 5, "menu_item_name": "Pizza",
+#             "quantity": 2, "notes": "", "status": "pending"}
+#   kitchen: {"id": 7, "order_id": 3, "status": "removed"}
+
+PENDING = 'pending'
+PREPARING = 'preparing'
+READY = 'ready'
+SERVED = 'served'
+STATUSES = (PENDING, PREPARING, READY, SERVED)
+
+# Statuses sent for lines that leave the queue
+REMOVED = 'removed'
+
+
+class KitchenError(Exception):
+    """The status change cannot be applied"""
+
+
+class TicketNotFoundError(KitchenError):
+    """The line does not exist or already left the queue"""
+
+
+def _ticket_json(row):
+    return {
+        'id': row['id'],
+        'order_id': row['order_id'],
+        'table': row['table_id'],
+        'menu_item_name': row['menu_item_name'],
+        'quantity': row['quantity'],
+        'notes': row['notes'],
+        'status': row['kitchen_status'],
+    }
+
+
+def get_open_tickets(conn):
+    """Every line not served yet, oldest first, with its order's table"""
+    rows = conn.execute('''
+        SELECT oi.id, oi.order_id, o.table_id, oi.menu_item_name, oi.quantity, oi.notes, oi.kitchen_status
+        FROM order_items oi
+        JOIN orders o ON o.id = oi.order_id
+        WHERE oi.kitchen_status != 'served'
+        ORDER BY oi.id
+    ''').fetchall()
+    return [_ticket_json(row) for row in rows]
+
+
+def publish_lines(conn, line_ids):
+    """Send the current state of the given lines to the kitchen channel"""
+    if not line_ids:
+        return
+    placeholders = ', '.join('?' * len(line_ids))
+    rows = conn.execute(f'''
+        SELECT oi.id, oi.order_id, o.table_id, oi.menu_item_name, oi.quantity, oi.notes, oi.kitchen_status
+        FROM order_items oi
+        JOIN orders o ON o.id = oi.order_id
+        WHERE oi.id IN ({placeholders})
+        ORDER BY oi.id
+    ''', list(line_ids)).fetchall()
+    publish(conn, KITCHEN, [_ticket_json(row) for row in rows])
+
+
+def publish_removed(conn, order_id, line_ids):
+    publish(conn, KITCHEN, [{'id': line_id, 'order_id': order_id, 'status': REMOVED}
+                            for line_id in line_ids])
+
+
+def set_status(conn, line_id, status):
+    """Move an open line to another kitchen status and announce it"""
+    if status not in STATUSES:
+        raise KitchenError(f"Status must be one of {', '.join(STATUSES)}")
+    cursor = conn.execute('''
+        UPDATE order_items SET kitchen_status = ?
+        WHERE id = ? AND kitchen_status != 'served'
+    ''', (status, line_id))
+    if not cursor.rowcount:
+        raise TicketNotFoundError(f"No open kitchen ticket for item {line_id}")
+    publish_lines(conn, [line_id])
+
+
+def serve_order(conn, order_id):
+    """Mark every open line of an order served (the order was closed)"""
+    line_ids = [row['id'] for row in conn.execute('''
+        SELECT id FROM order_items WHERE order_id = ? AND kitchen_status != 'served'
+    ''', (order_id,))]
+    if not line_ids:
+        return
+    conn.execute('''
+        UPDATE order_items SET kitchen_status = 'served'
+        WHERE order_id = ? AND kitchen_status != 'served'
+    ''', (order_id,))
+    publish(conn, KITCHEN, [{'id': line_id, 'order_id': order_id, 'status': SERVED}
+                            for line_id in line_ids])
@@ -0,0 +1,116 @@
+import json
+import threading
+from datetime import datetime
+
+from db import get_change_counters, get_setting
+
+# Changes pushed to open pages over Server-Sent Events. publish() runs on the
+# caller's connection inside its transaction, so an event is visible to the
+# stream exactly when the change it describes is committed, whichever worker
+# process made it. Streams read the rows after the last id they sent. Commits
+# in this process also wake the streams up at once; events written by other
+# processes are picked up on the next poll.
+#
+#   tables:  {"table": 5, "status": "in use", "customer_name": "Ana", "order_id": 12}
+#   stock:   {"menu_item_id": 3, "current_stock": 42}
+#   kitchen: {"id": 7, "order_id": 12, "table": 5, "status": "pending", ...}
+
+TABLES = 'tables'
+STOCK = 'stock'
+KITCHEN = 'kitchen'
+CHANNELS = (TABLES, STOCK, KITCHEN)
+
+# Bumped after every commit that published events
+_generation = 0
+_new_events = threading.Condition()
+
+
+def _notify_streams():
+    global _generation
+    with _new_events:
+        _generation += 1
+        _new_events.notify_all()
+
+
+def event_generation():
+    """Take this before reading events, then pass it to wait_for_events"""
+    return _generation
+
+
+def wait_for_events(generation, timeout):
+    """Sleep until this process commits new events or timeout seconds pass"""
+    with _new_events:
+        _new_events.wait_for(lambda: _generation != generation, timeout)
+
+
+def publish(conn, channel, payloads):
+    """Add one event per payload dict to a channel; the caller commits"""
+    if not payloads:
+        return
+    now = datetime.now()
+    conn.executemany('INSERT INTO live_events (channel, payload, created_at) VALUES (?, ?, ?)',
+                     [(channel, json.dumps(payload), now) for payload in payloads])
+    conn.on_commit(_notify_streams)
+
+    # Keep the table short: every LIVE_EVENTS_KEEP events, drop the ones
+    # older than the last LIVE_EVENTS_KEEP
+    keep = get_setting('LIVE_EVENTS_KEEP')
+    last_id = latest_event_id(conn)
+    if last_id // keep != (last_id - len(payloads)) // keep:
+        conn.execute('DELETE FROM live_events WHERE id <= ?', (last_id - keep,))
+
+
+def publish_table(conn, table_number, status, customer_name=None, order_id=None):
+    publish(conn, TABLES, [{'table': table_number, 'status': status,
+                            'customer_name': customer_name, 'order_id': order_id}])
+
+
+def publish_stock(conn, menu_item_ids):
+    """Publish the current stock of the given items, as stored in stock_levels"""
+    if not menu_item_ids:
+        return
+    placeholders = ', '.join('?' * len(menu_item_ids))
+    levels = conn.execute(f'''
+        SELECT menu_item_id, current_stock FROM stock_levels
+        WHERE menu_item_id IN ({placeholders})
+    ''', list(menu_item_ids)).fetchall()
+    publish(conn, STOCK, [{'menu_item_id': row['menu_item_id'], 'current_stock': row['current_stock']}
+                          for row in levels])
+
+
+def latest_event_id(conn):
+    """Id of the newest event; pages pass it to the stream they open"""
+    return conn.execute('SELECT COALESCE(MAX(id), 0) FROM live_events').fetchone()[0]
+
+
+def page_versions(conn, domains):
+    """'domain:version,...' of the change counters a page is built from.
+
+    Pages served with 304 or from the render cache open their stream with
+    since=<this> instead of an event id, which would be stale in the cached
+    copy. Read it before the page's data, so the data is never older.
+    """
+    counters = get_change_counters(conn, domains)
+    return ','.join(f'{domain}:{counters[domain][0]}' for domain in domains)
+
+
+def changed_since(conn, since):
+    """Whether any counter in a page_versions() string moved; ValueError if malformed"""
+    versions = dict(pair.split(':') for pair in since.split(','))
+    counters = get_change_counters(conn, list(versions))
+    return any(counters[domain][0] != int(version) for domain, version in versions.items())
+
+
+def oldest_event_id(conn):
+    return conn.execute('SELECT COALESCE(MIN(id), 0) FROM live_events').fetchone()[0]
+
+
+def read_events(conn, after_id, channels, limit=200):
+    """Events newer than after_id on the given channels, oldest first"""
+    placeholders = ', '.join('?' * len(channels))
+    return conn.execute(f'''
+        SELECT id, channel, payload FROM live_events
+        WHERE id > ? AND channel IN ({placeholders})
+        ORDER BY id
+        LIMIT ?
+    ''', [after_id, *channels, limit]).fetchall()
@@ -1,16 +1,19 @@
 from flask import render_template, request, redirect, url_for
 from . import menu_bp
-import sys
-import os
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import get_db_connection, log_menu_audit
+from utils import get_db_connection
+from audit import log_menu_audit
+from db import bump_change_counter
+from menu_cache import menu_cache, MENU_DOMAIN
+from imports import CsvImportError, parse_menu_csv, import_menu_items
+from conditional import conditional_get
 
 # Menu management routes
 @menu_bp.route('/')
+@conditional_get(MENU_DOMAIN, cache=True)
 def menu():
     conn = get_db_connection()
     # Hard delete, all items in this table exists
-    menu_items = conn.execute('SELECT * FROM menu_items ORDER BY category, name').fetchall()
+    menu_items = menu_cache.catalog(conn)
     conn.close()
     return render_template('menu/index.html', menu_items=menu_items)
 
@@ -26,12 +29,15 @@ def add_menu_item():
     cursor = conn.execute('INSERT INTO menu_items (name, description, category, price, stockable) VALUES (?, ?, ?, ?, ?)', 
                 (name, description, category, price, stockable))
     menu_item_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
     
     # Log creation
     new_values = f"name: {name}, description: {description}, category: {category}, price: ${price}, stockable: {stockable}"
-    log_menu_audit(menu_item_id, 'CREATE', None, new_values)
+    log_menu_audit(conn, menu_item_id, 'CREATE', None, new_values)
+
+    bump_change_counter(conn, MENU_DOMAIN)
+    conn.commit()
+    conn.close()
+    menu_cache.invalidate()
     
     return redirect(url_for('menu.menu'))
 
@@ -53,17 +59,20 @@ def edit_menu_item(id):
         
         conn.execute('UPDATE menu_items SET name = ?, description = ?, category = ?, price = ?, stockable = ? WHERE id = ?',
                     (name, description, category, price, stockable, id))
-        conn.commit()
-        conn.close()
         
         # Log update
         new_values = f"name: {name}, description: {description}, category: {category}, price: ${price}, stockable: {stockable}"
-        log_menu_audit(id, 'UPDATE', old_values, new_values)
+        log_menu_audit(conn, id, 'UPDATE', old_values, new_values)
+
+        bump_change_counter(conn, MENU_DOMAIN)
+        conn.commit()
+        conn.close()
+        menu_cache.invalidate()
         
         return redirect(url_for('menu.menu'))
     
     # GET request - show edit form
-    item = conn.execute('SELECT * FROM menu_items WHERE id = ?', (id,)).fetchone()
+    item = menu_cache.get(conn, id)
     conn.close()
     return render_template('menu/edit.html', item=item)
 
@@ -76,14 +85,38 @@ def delete_menu_item(id):
     old_values = f"name: {item['name']}, description: {item['description']}, category: {item['category']}, price: ${item['price']}, stockable: {item['stockable']}"
     
     conn.execute('DELETE FROM menu_items WHERE id = ?', (id,))
-    conn.commit()
-    conn.close()
     
     # Log deletion
-    log_menu_audit(id, 'DELETE', old_values, None)
+    log_menu_audit(conn, id, 'DELETE', old_values, None)
+
+    bump_change_counter(conn, MENU_DOMAIN)
+    conn.commit()
+    conn.close()
+    menu_cache.invalidate()
     
     return redirect(url_for('menu.menu'))
 
+@menu_bp.route('/import', methods=('GET', 'POST'))
+def import_menu():
+    """Add every item of a CSV file (name,description,category,price,stockable) at once"""
+    if request.method == 'GET':
+        return render_template('menu/import.html')
+
+    upload = request.files.get('file')
+    if upload is None:
+        return "Error: No file uploaded", 400
+    try:
+        items = parse_menu_csv(upload.read().decode('utf-8-sig'))
+    except (CsvImportError, UnicodeDecodeError) as error:
+        return render_template('menu/import.html', errors=getattr(error, 'errors', [(1, str(error))])), 400
+
+    conn = get_db_connection()
+    import_menu_items(conn, items)
+    conn.commit()
+    conn.close()
+    menu_cache.invalidate()
+    return redirect(url_for('menu.menu'))
+
 @menu_bp.route('/audit')
 def menu_audit():
     conn = get_db_connection()
@@ -0,0 +1,62 @@
+import threading
+from collections import namedtuple
+
+from db import get_change_counter
+
+# The menu is read on almost every page but changes a few times a week, so
+# each process keeps a copy of it. Menu writes bump the 'menu' change counter
+# in their transaction; readers compare it (one primary key lookup) with the
+# version of their copy and reload when it moved, which also catches writes
+# made by other worker processes.
+MENU_DOMAIN = 'menu'
+
+MenuSnapshot = namedtuple('MenuSnapshot', ['version', 'catalog', 'by_id', 'stockable'])
+
+
+class MenuCache:
+    """Per-process copy of menu_items, one snapshot per database file"""
+
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self, conn):
+        """Current MenuSnapshot, reloading it if the menu changed"""
+        database = getattr(getattr(conn, 'pool', None), 'database', None)
+        # Read the version before the rows: if a write lands in between we
+        # keep newer rows under an older version and just reload next time
+        version = get_change_counter(conn, MENU_DOMAIN)
+        snapshot = self._snapshots.get(database)
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        catalog = tuple(conn.execute('SELECT * FROM menu_items ORDER BY category, name').fetchall())
+        snapshot = MenuSnapshot(
+            version=version,
+            catalog=catalog,
+            by_id={item['id']: item for item in catalog},
+            stockable=tuple(sorted((item for item in catalog if item['stockable']), key=lambda item: item['name'])),
+        )
+        with self._lock:
+            self._snapshots[database] = snapshot
+        return snapshot
+
+    def catalog(self, conn):
+        """Every menu item ordered by category and name"""
+        return self.snapshot(conn).catalog
+
+    def get(self, conn, menu_item_id):
+        """One menu item by id, or None"""
+        return self.snapshot(conn).by_id.get(menu_item_id)
+
+    def stockable(self, conn):
+        """Stockable menu items ordered by name"""
+        return self.snapshot(conn).stockable
+
+    def invalidate(self):
+        """Drop every snapshot held by this process"""
+        with self._lock:
+            self._snapshots.clear()
+
+
+menu_cache = MenuCache()
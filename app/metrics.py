@@ -0,0 +1,288 @@
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+from flask import Response, current_app, g, has_app_context, request
+
+from db import get_setting, lock_waits
+from write_queue import write_queue_stats
+
+# Request and SQL metrics per endpoint, kept in memory by each process and
+# served on /metrics in the Prometheus text format. Recording a request is a
+# few additions under one lock, cheap enough to leave on in production.
+# Statement counts and times come from the request's PooledConnection.
+#
+# With several worker processes (serve.py) any worker may answer a scrape,
+# so METRICS_DIR names a directory the workers share. Each worker writes its
+# totals to its own file there every METRICS_FLUSH_MS, and once more just
+# before answering /metrics; /metrics serves the sum of every file. Every
+# file only grows, so the sum does too, whichever worker answers. The files
+# of workers that exited keep their counts in the sum until serve.py empties
+# the directory on its next start.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+
+class Histogram:
+    """Cumulative-at-export histogram with fixed bucket bounds"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def snapshot(self):
+        return {'counts': list(self.counts), 'sum': self.sum}
+
+    def add(self, snapshot):
+        self.counts = [count + other for count, other in zip(self.counts, snapshot['counts'])]
+        self.sum += snapshot['sum']
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        cumulative += self.counts[-1]
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum:.6f}'
+        yield f'{name}_count{{{labels}}} {cumulative}'
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.requests = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.sql_seconds = 0.0
+
+    def snapshot(self):
+        return {
+            'requests': [[method, status, count] for (method, status), count in self.requests.items()],
+            'latency': self.latency.snapshot(),
+            'statements': self.statements.snapshot(),
+            'sql_seconds': self.sql_seconds,
+        }
+
+    def add(self, snapshot):
+        for method, status, count in snapshot['requests']:
+            self.requests[(method, status)] = self.requests.get((method, status), 0) + count
+        self.latency.add(snapshot['latency'])
+        self.statements.add(snapshot['statements'])
+        self.sql_seconds += snapshot['sql_seconds']
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, method, status, seconds, statements, sql_seconds):
+        with self._lock:
+            metrics = self._endpoints.get(endpoint)
+            if metrics is None:
+                metrics = self._endpoints[endpoint] = EndpointMetrics()
+            key = (method, status)
+            metrics.requests[key] = metrics.requests.get(key, 0) + 1
+            metrics.latency.observe(seconds)
+            metrics.statements.observe(statements)
+            metrics.sql_seconds += sql_seconds
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+    def snapshot(self):
+        """This process's totals, as plain data that can be written to a file"""
+        with self._lock:
+            endpoints = {endpoint: metrics.snapshot() for endpoint, metrics in self._endpoints.items()}
+        waits = lock_waits.snapshot()
+        return {
+            'endpoints': endpoints,
+            'lock_waits': {'count': waits['count'], 'total_seconds': waits['total_seconds']},
+            'write_queue': write_queue_stats.snapshot(),
+        }
+
+
+def render(snapshots):
+    """The sum of process snapshots in the Prometheus text exposition format"""
+    endpoints = {}
+    waits = {'count': 0, 'total_seconds': 0.0}
+    queued = {'batches': 0, 'units': 0, 'wait_seconds': 0.0, 'timeouts': 0, 'busy': 0}
+    for snapshot in snapshots:
+        for endpoint, metrics in snapshot['endpoints'].items():
+            endpoints.setdefault(endpoint, EndpointMetrics()).add(metrics)
+        for name in waits:
+            waits[name] += snapshot['lock_waits'][name]
+        for name in queued:
+            queued[name] += snapshot['write_queue'][name]
+    endpoints = sorted(endpoints.items())
+
+    lines = ['# HELP restaurant_requests_total Requests handled, by endpoint, method and status.',
+             '# TYPE restaurant_requests_total counter']
+    for endpoint, metrics in endpoints:
+        for (method, status), count in sorted(metrics.requests.items()):
+            lines.append(f'restaurant_requests_total{{endpoint="{_escape(endpoint)}",method="{method}",'
+                         f'status="{status}"}} {count}')
+
+    lines += ['# HELP restaurant_request_duration_seconds Time to build each response.',
+              '# TYPE restaurant_request_duration_seconds histogram']
+    for endpoint, metrics in endpoints:
+        lines += metrics.latency.lines('restaurant_request_duration_seconds', f'endpoint="{_escape(endpoint)}"')
+
+    lines += ['# HELP restaurant_sql_statements_per_request SQL statements executed by each request.',
+              '# TYPE restaurant_sql_statements_per_request histogram']
+    for endpoint, metrics in endpoints:
+        lines += metrics.statements.lines('restaurant_sql_statements_per_request', f'endpoint="{_escape(endpoint)}"')
+
+    lines += ['# HELP restaurant_sql_seconds_total Time spent executing SQL statements.',
+              '# TYPE restaurant_sql_seconds_total counter']
+    for endpoint, metrics in endpoints:
+        lines.append(f'restaurant_sql_seconds_total{{endpoint="{_escape(endpoint)}"}} {metrics.sql_seconds:.6f}')
+
+    lines += ['# HELP restaurant_sqlite_write_lock_wait_seconds_total Time spent opening write transactions.',
+              '# TYPE restaurant_sqlite_write_lock_wait_seconds_total counter',
+              f'restaurant_sqlite_write_lock_wait_seconds_total {waits["total_seconds"]:.6f}',
+              '# HELP restaurant_sqlite_write_transactions_total Write transactions opened.',
+              '# TYPE restaurant_sqlite_write_transactions_total counter',
+              f'restaurant_sqlite_write_transactions_total {waits["count"]}']
+
+    lines += ['# HELP restaurant_write_queue_units_total Writes committed through the write queue.',
+              '# TYPE restaurant_write_queue_units_total counter',
+              f'restaurant_write_queue_units_total {queued["units"]}',
+              '# HELP restaurant_write_queue_batches_total Transactions of the write queue (units per batch = units / batches).',
+              '# TYPE restaurant_write_queue_batches_total counter',
+              f'restaurant_write_queue_batches_total {queued["batches"]}',
+              '# HELP restaurant_write_queue_wait_seconds_total Time writes waited in the queue.',
+              '# TYPE restaurant_write_queue_wait_seconds_total counter',
+              f'restaurant_write_queue_wait_seconds_total {queued["wait_seconds"]:.6f}',
+              '# HELP restaurant_write_queue_timeouts_total Writes refused with 503 after WRITE_QUEUE_TIMEOUT_MS.',
+              '# TYPE restaurant_write_queue_timeouts_total counter',
+              f'restaurant_write_queue_timeouts_total {queued["timeouts"]}',
+              '# HELP restaurant_write_queue_busy_total Batches refused because SQLite stayed locked past the busy timeout.',
+              '# TYPE restaurant_write_queue_busy_total counter',
+              f'restaurant_write_queue_busy_total {queued["busy"]}']
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+registry = MetricsRegistry()
+
+
+def get_metrics_dir():
+    """Directory shared by the worker processes' metrics files, or None"""
+    if has_app_context() and current_app.config.get('METRICS_DIR'):
+        return current_app.config['METRICS_DIR']
+    return os.environ.get('METRICS_DIR') or None
+
+
+class MetricsFiles:
+    """This process's file in METRICS_DIR, kept up to date by a background thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._path = None
+
+    def start(self, directory, interval):
+        """Open this process's file, once per process (a forked worker gets its own)"""
+        if self._key == (os.getpid(), directory):
+            return
+        with self._lock:
+            if self._key == (os.getpid(), directory):
+                return
+            self._key = (os.getpid(), directory)
+            # Unique across restarts, so a new worker never reuses a dead one's file
+            self._path = os.path.join(directory, f'{os.getpid()}-{time.time_ns()}.json')
+        threading.Thread(target=self._flush_every, args=(interval,), name='metrics-flush', daemon=True).start()
+
+    def _flush_every(self, interval):
+        while True:
+            time.sleep(interval)
+            self.flush()
+
+    def flush(self):
+        """Write this process's totals, replacing the file in one step"""
+        with self._lock:
+            if self._key is None or self._key[0] != os.getpid():
+                return
+            temporary = f'{self._path}.tmp'
+            with open(temporary, 'w') as file:
+                json.dump(registry.snapshot(), file)
+            os.replace(temporary, self._path)
+
+
+metrics_files = MetricsFiles()
+
+
+def read_snapshots(directory):
+    snapshots = []
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            with open(path) as file:
+                snapshots.append(json.load(file))
+        except FileNotFoundError:
+            # Removed by serve.py starting again
+            continue
+    return snapshots
+
+
+def flush_metrics():
+    """Write this worker's totals to METRICS_DIR, e.g. before it exits"""
+    metrics_files.flush()
+
+
+def start_request_timer():
+    g.metrics_started = time.perf_counter()
+
+
+def record_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None or request.endpoint == 'metrics':
+        return response
+
+    conn = g.get('db')
+    registry.record(
+        request.endpoint or 'unmatched',
+        request.method,
+        response.status_code,
+        time.perf_counter() - started,
+        conn.statement_count if conn is not None else 0,
+        conn.statement_seconds if conn is not None else 0.0,
+    )
+    directory = get_metrics_dir()
+    if directory is not None:
+        metrics_files.start(directory, get_setting('METRICS_FLUSH_MS') / 1000)
+    return response
+
+
+def metrics():
+    directory = get_metrics_dir()
+    if directory is None:
+        snapshots = [registry.snapshot()]
+    else:
+        metrics_files.start(directory, get_setting('METRICS_FLUSH_MS') / 1000)
+        metrics_files.flush()
+        snapshots = read_snapshots(directory)
+    return Response(render(snapshots), mimetype='text/plain; version=0.0.4')
+
+
+def register_metrics(app):
+    """Install the request hooks and the /metrics endpoint on app"""
+    with app.app_context():
+        if not get_setting('METRICS_ENABLED'):
+            return
+    app.before_request(start_request_timer)
+    app.after_request(record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -0,0 +1,505 @@
+import sqlite3
+from datetime import datetime
+
+from db import get_setting
+
+# Schema migrations. Each step runs once, in order, inside its own
+# transaction, and is recorded in the schema_version table. To change the
+# schema append a new (version, description, function) entry to MIGRATIONS;
+# never edit a step that has already shipped.
+
+
+def create_base_schema(conn):
+    # Movements tracking table
+    conn.execute('''CREATE TABLE IF NOT EXISTS movements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        menu_item_id INTEGER,
+        menu_item_name TEXT NOT NULL,
+        quantity_change INTEGER NOT NULL,
+        movement_type TEXT NOT NULL,
+        notes TEXT,
+        partial_stock INTEGER, 
+        date DATETIME NOT NULL
+    )''')
+    
+    # Restaurant tables
+    conn.execute('''CREATE TABLE IF NOT EXISTS restaurant_tables (
+        table_number INTEGER NOT NULL UNIQUE,
+        capacity INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        customer_name TEXT,
+        open_order_number INTEGER
+    )''')
+    
+    # Menu items (food and drinks)
+    conn.execute('''CREATE TABLE IF NOT EXISTS menu_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        description TEXT,
+        category TEXT NOT NULL,
+        price DECIMAL(10,2) NOT NULL,
+        stockable BOOLEAN DEFAULT 0
+    )''')
+    
+    # Customer orders
+    conn.execute('''CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_id INTEGER NOT NULL,
+        customer_name TEXT,
+        status TEXT NOT NULL,
+        created_at DATETIME NOT NULL,
+        closed_at DATETIME,
+        total_amount DECIMAL(10,2)
+    )''')
+    
+    # Individual items in an order
+    conn.execute('''CREATE TABLE IF NOT EXISTS order_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        menu_item_id INTEGER NOT NULL,
+        menu_item_name TEXT NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 1,
+        unit_price DECIMAL(10,2) NOT NULL,
+        notes TEXT,
+        FOREIGN KEY (order_id) REFERENCES orders (id),
+        FOREIGN KEY (menu_item_id) REFERENCES menu_items (id)
+    )''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS manual_money_movements (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payment_method TEXT NOT NULL,
+    description TEXT,
+    amount DECIMAL(10,2),
+    date DATETIME NOT NULL,
+    movement_type TEXT NOT NULL
+    )''')
+    
+    # Order payments - supports split payments
+    conn.execute('''CREATE TABLE IF NOT EXISTS order_payments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        payment_method TEXT NOT NULL,
+        amount DECIMAL(10,2) NOT NULL,
+        notes TEXT,
+        created_at DATETIME NOT NULL,
+        FOREIGN KEY (order_id) REFERENCES orders (id)
+    )''')
+    
+    # Menu audit trail
+    conn.execute('''CREATE TABLE IF NOT EXISTS menu_audit (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        menu_item_id INTEGER,
+        action TEXT NOT NULL,
+        old_values TEXT,
+        new_values TEXT,
+        timestamp DATETIME NOT NULL,
+        user_info TEXT
+    )''')
+    
+    # Order item history - tracks all changes to order items
+    conn.execute('''CREATE TABLE IF NOT EXISTS order_item_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        menu_item_id INTEGER NOT NULL,
+        menu_item_name TEXT NOT NULL,
+        action TEXT NOT NULL,
+        quantity INTEGER,
+        unit_price DECIMAL(10,2),
+        notes TEXT,
+        timestamp DATETIME NOT NULL,
+        FOREIGN KEY (order_id) REFERENCES orders (id),
+        FOREIGN KEY (menu_item_id) REFERENCES menu_items (id)
+    )''')
+
+
+def create_stock_levels(conn):
+    # Current stock per menu item, kept in sync with every movement insert
+    conn.execute('''CREATE TABLE IF NOT EXISTS stock_levels (
+        menu_item_id INTEGER PRIMARY KEY,
+        current_stock INTEGER NOT NULL DEFAULT 0,
+        updated_at DATETIME NOT NULL
+    )''')
+
+    # Databases created before stock_levels existed start from their history
+    conn.execute('DELETE FROM stock_levels')
+    conn.execute('''
+        INSERT INTO stock_levels (menu_item_id, current_stock, updated_at)
+        SELECT menu_item_id, SUM(quantity_change), ?
+        FROM movements
+        WHERE menu_item_id IS NOT NULL
+        GROUP BY menu_item_id
+    ''', (datetime.now(),))
+
+
+def create_hot_path_indexes(conn):
+    # One index per lookup done by the blueprints, see
+    # tests/integration/test_query_plans.py
+    for statement in (
+        'CREATE INDEX IF NOT EXISTS idx_movements_menu_item ON movements (menu_item_id, id)',
+        'CREATE INDEX IF NOT EXISTS idx_movements_date ON movements (date)',
+        'CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)',
+        'CREATE INDEX IF NOT EXISTS idx_order_payments_order ON order_payments (order_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_order_payments_created ON order_payments (created_at, payment_method, amount)',
+        'CREATE INDEX IF NOT EXISTS idx_order_item_history_order ON order_item_history (order_id, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_status_table ON orders (status, table_id)',
+        'CREATE INDEX IF NOT EXISTS idx_restaurant_tables_open_order ON restaurant_tables (open_order_number)',
+        'CREATE INDEX IF NOT EXISTS idx_menu_items_category_name ON menu_items (category, name)',
+        'CREATE INDEX IF NOT EXISTS idx_menu_items_stockable_name ON menu_items (stockable, name)',
+        'CREATE INDEX IF NOT EXISTS idx_menu_audit_timestamp ON menu_audit (timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_menu_audit_menu_item ON menu_audit (menu_item_id)',
+    ):
+        conn.execute(statement)
+
+
+def create_order_list_indexes(conn):
+    # Keyset pagination of the orders list walks these backwards by id
+    # (rowid is the implicit last column of every index)
+    for statement in (
+        'CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_table ON orders (table_id)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at)',
+    ):
+        conn.execute(statement)
+
+
+def create_stock_checkpoints(conn):
+    conn.execute('''ALTER TABLE stock_levels
+        ADD COLUMN movements_since_checkpoint INTEGER NOT NULL DEFAULT 0''')
+
+    # Balance of an item right after one of its movements
+    conn.execute('''CREATE TABLE IF NOT EXISTS stock_checkpoints (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        menu_item_id INTEGER NOT NULL,
+        movement_id INTEGER NOT NULL,
+        checkpoint_date DATETIME NOT NULL,
+        balance INTEGER NOT NULL
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stock_checkpoints_item_date ON stock_checkpoints (menu_item_id, checkpoint_date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_movements_item_date ON movements (menu_item_id, date)')
+
+    # Checkpoint the existing history every STOCK_CHECKPOINT_INTERVAL movements
+    interval = get_setting('STOCK_CHECKPOINT_INTERVAL')
+    conn.execute('''
+        INSERT INTO stock_checkpoints (menu_item_id, movement_id, checkpoint_date, balance)
+        SELECT menu_item_id, id, date, running_stock
+        FROM (
+            SELECT  id,
+                    menu_item_id,
+                    date,
+                    SUM(quantity_change) OVER (PARTITION BY menu_item_id ORDER BY id) AS running_stock,
+                    ROW_NUMBER() OVER (PARTITION BY menu_item_id ORDER BY id) AS position
+            FROM movements
+            WHERE menu_item_id IS NOT NULL
+        )
+        WHERE position % ? = 0
+    ''', (interval,))
+    conn.execute('''
+        UPDATE stock_levels SET movements_since_checkpoint = (
+            SELECT COUNT(*) % ? FROM movements WHERE menu_item_id = stock_levels.menu_item_id
+        )
+    ''', (interval,))
+
+
+def create_cash_daily_summary(conn):
+    # Money in and out per day, payment method and movement type
+    conn.execute('''CREATE TABLE IF NOT EXISTS cash_daily_summary (
+        date TEXT NOT NULL,
+        payment_method TEXT NOT NULL,
+        movement_type TEXT NOT NULL,
+        amount DECIMAL(10,2) NOT NULL DEFAULT 0,
+        entries INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (date, payment_method, movement_type)
+    ) WITHOUT ROWID''')
+
+    # Days whose figures were frozen with "close the day"
+    conn.execute('''CREATE TABLE IF NOT EXISTS cash_day_closures (
+        date TEXT PRIMARY KEY,
+        total DECIMAL(10,2) NOT NULL,
+        closed_at DATETIME NOT NULL
+    )''')
+
+    conn.execute('''
+        INSERT INTO cash_daily_summary (date, payment_method, movement_type, amount, entries)
+        SELECT date("created_at"), "payment_method", 'Orden de mesa', SUM("amount"), COUNT(*)
+        FROM order_payments
+        GROUP BY 1, 2
+        UNION ALL
+        SELECT date("date"), "payment_method", "movement_type", SUM("amount"), COUNT(*)
+        FROM manual_money_movements
+        GROUP BY 1, 2, 3
+    ''')
+
+
+def create_change_counters(conn):
+    # One version number per domain, bumped by every write to it, so caches
+    # in any worker process can tell cheaply that they are stale
+    conn.execute('''CREATE TABLE IF NOT EXISTS change_counters (
+        domain TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID''')
+
+
+def create_order_item_events(conn):
+    # One row per change to an order line, keyed by the order_items id.
+    # 'added' carries every field; 'edited' only the ones that changed (NULL
+    # means unchanged, so empty notes are ''); 'removed' none.
+    conn.execute('''CREATE TABLE IF NOT EXISTS order_item_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        order_item_id INTEGER NOT NULL,
+        event TEXT NOT NULL,
+        menu_item_id INTEGER,
+        menu_item_name TEXT,
+        unit_price DECIMAL(10,2),
+        quantity INTEGER,
+        notes TEXT,
+        timestamp DATETIME NOT NULL,
+        FOREIGN KEY (order_id) REFERENCES orders (id)
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_order_item_events_order ON order_item_events (order_id, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_order_item_events_item ON order_item_events (order_item_id)')
+
+    # order_item_history has no line id, so each order's history is replayed
+    # to tell its lines apart. Lines still in order_items get their real id;
+    # removed lines get -(id of their 'added' history row).
+    history = [dict(row, notes=row['notes'] or '') for row in conn.execute('''
+        SELECT * FROM order_item_history ORDER BY order_id, id
+    ''')]
+    current_lines = {}
+    for row in conn.execute('SELECT * FROM order_items ORDER BY order_id, id'):
+        current_lines.setdefault(row['order_id'], []).append(dict(row, notes=row['notes'] or ''))
+
+    def find_line(lines, row):
+        candidates = [line for line in lines if line['live'] and line['menu_item_id'] == row['menu_item_id']]
+        for line in candidates:
+            if line['quantity'] == row['quantity'] and line['notes'] == row['notes']:
+                return line
+        return candidates[0] if candidates else None
+
+    def new_line(lines, row):
+        line = {'id': -row['id'], 'menu_item_id': row['menu_item_id'], 'quantity': row['quantity'],
+                'notes': row['notes'], 'live': True}
+        lines.append(line)
+        return line
+
+    events = []
+    lines_by_order = {}
+    pending_edit = None
+    for row in history:
+        lines = lines_by_order.setdefault(row['order_id'], [])
+        if row['action'] == 'old_edited':
+            pending_edit = row
+            continue
+
+        if row['action'] == 'added':
+            line = new_line(lines, row)
+            events.append((line, 'added', row, row['menu_item_id'], row['menu_item_name'],
+                           row['unit_price'], row['quantity'], row['notes']))
+        elif row['action'] == 'new_edited':
+            old = pending_edit if pending_edit is not None and pending_edit['order_id'] == row['order_id'] else row
+            line = find_line(lines, old)
+            if line is None:
+                line = new_line(lines, old)
+                events.append((line, 'added', old, old['menu_item_id'], old['menu_item_name'],
+                               old['unit_price'], old['quantity'], old['notes']))
+            quantity = row['quantity'] if row['quantity'] != line['quantity'] else None
+            notes = row['notes'] if row['notes'] != line['notes'] else None
+            line['quantity'], line['notes'] = row['quantity'], row['notes']
+            if quantity is not None or notes is not None:
+                events.append((line, 'edited', row, None, None, None, quantity, notes))
+        elif row['action'] == 'removed':
+            line = find_line(lines, row)
+            if line is not None:
+                line['live'] = False
+                events.append((line, 'removed', row, None, None, None, None, None))
+        pending_edit = None
+
+    # Give the lines that survived the id they have in order_items
+    for order_id, lines in lines_by_order.items():
+        unclaimed = list(current_lines.get(order_id, []))
+        for exact in (True, False):
+            for line in lines:
+                if not line['live'] or line['id'] > 0:
+                    continue
+                for current in unclaimed:
+                    if current['menu_item_id'] == line['menu_item_id'] and (
+                            not exact or (current['quantity'] == line['quantity'] and current['notes'] == line['notes'])):
+                        line['id'] = current['id']
+                        unclaimed.remove(current)
+                        break
+
+    conn.executemany('''
+        INSERT INTO order_item_events (order_id, order_item_id, event, menu_item_id, menu_item_name,
+                                       unit_price, quantity, notes, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(row['order_id'], line['id'], event, menu_item_id, menu_item_name, unit_price, quantity, notes, row['timestamp'])
+          for line, event, row, menu_item_id, menu_item_name, unit_price, quantity, notes in events])
+
+    conn.execute('DROP TABLE order_item_history')
+
+
+def create_live_events(conn):
+    # Small changes (a table opened, a stock level moved) written in the same
+    # transaction as the change, so every worker process can stream them to
+    # browsers by tailing the id. Old rows are pruned as new ones arrive.
+    conn.execute('''CREATE TABLE IF NOT EXISTS live_events (
+        id INTEGER PRIMARY KEY,
+        channel TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        created_at DATETIME NOT NULL
+    )''')
+
+
+def add_kitchen_status(conn):
+    # Where each order line is in the kitchen: pending, preparing, ready or
+    # served. Lines of orders already closed are served; the partial index
+    # holds only the open tickets, so the kitchen queue stays small however
+    # long the history gets.
+    conn.execute("ALTER TABLE order_items ADD COLUMN kitchen_status TEXT NOT NULL DEFAULT 'pending'")
+    conn.execute('''
+        UPDATE order_items SET kitchen_status = 'served'
+        WHERE order_id IN (SELECT id FROM orders WHERE status != 'active')
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_order_items_kitchen_open ON order_items (id)
+        WHERE kitchen_status != 'served'
+    ''')
+
+
+def create_sales_rollups(conn):
+    # Sales per hour of closing ('YYYY-MM-DD HH') by menu item, table and
+    # payment method, updated when an order is closed. Reports add up the
+    # hours of a range instead of reading order_items.
+    conn.execute('''CREATE TABLE IF NOT EXISTS sales_hourly_items (
+        hour TEXT NOT NULL,
+        menu_item_id INTEGER NOT NULL,
+        menu_item_name TEXT NOT NULL,
+        category TEXT NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue DECIMAL(10,2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, menu_item_id)
+    ) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS sales_hourly_tables (
+        hour TEXT NOT NULL,
+        table_id INTEGER NOT NULL,
+        orders INTEGER NOT NULL DEFAULT 0,
+        revenue DECIMAL(10,2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, table_id)
+    ) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS sales_hourly_payments (
+        hour TEXT NOT NULL,
+        payment_method TEXT NOT NULL,
+        payments INTEGER NOT NULL DEFAULT 0,
+        amount DECIMAL(10,2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, payment_method)
+    ) WITHOUT ROWID''')
+
+    conn.execute('''
+        INSERT INTO sales_hourly_items (hour, menu_item_id, menu_item_name, category, quantity, revenue)
+        SELECT strftime('%Y-%m-%d %H', o.closed_at), oi.menu_item_id, MAX(oi.menu_item_name),
+               COALESCE(MAX(mi.category), ''), SUM(oi.quantity), SUM(oi.quantity * oi.unit_price)
+        FROM order_items oi
+        JOIN orders o ON o.id = oi.order_id
+        LEFT JOIN menu_items mi ON mi.id = oi.menu_item_id
+        WHERE o.status = 'closed'
+        GROUP BY 1, 2
+    ''')
+    conn.execute('''
+        INSERT INTO sales_hourly_tables (hour, table_id, orders, revenue)
+        SELECT strftime('%Y-%m-%d %H', o.closed_at), o.table_id, COUNT(*),
+               SUM(COALESCE((SELECT SUM(quantity * unit_price) FROM order_items WHERE order_id = o.id), 0))
+        FROM orders o
+        WHERE o.status = 'closed'
+        GROUP BY 1, 2
+    ''')
+    conn.execute('''
+        INSERT INTO sales_hourly_payments (hour, payment_method, payments, amount)
+        SELECT strftime('%Y-%m-%d %H', created_at), payment_method, COUNT(*), SUM(amount)
+        FROM order_payments
+        GROUP BY 1, 2
+    ''')
+
+
+def create_export_indexes(conn):
+    # Exports read every table by date range; manual money movements were the
+    # only one without a date index
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_manual_money_movements_date ON manual_money_movements (date)')
+
+
+def add_change_counter_timestamps(conn):
+    # When each domain last changed (UTC), sent as Last-Modified by the pages
+    # that depend on it
+    conn.execute('ALTER TABLE change_counters ADD COLUMN changed_at TEXT')
+    conn.execute('UPDATE change_counters SET changed_at = CURRENT_TIMESTAMP')
+
+
+def clear_null_line_notes(conn):
+    # An edit that cleared a line's notes to NULL logged nothing, since NULL
+    # means unchanged in order_item_events; empty notes are '' from now on
+    conn.execute("UPDATE order_items SET notes = '' WHERE notes IS NULL")
+    conn.execute("UPDATE order_item_events SET notes = '' WHERE event = 'added' AND notes IS NULL")
+
+
+MIGRATIONS = [
+    (1, 'Base schema', create_base_schema),
+    (2, 'Materialized stock levels', create_stock_levels),
+    (3, 'Hot path indexes', create_hot_path_indexes),
+    (4, 'Orders list indexes', create_order_list_indexes),
+    (5, 'Stock checkpoints', create_stock_checkpoints),
+    (6, 'Daily cash summary', create_cash_daily_summary),
+    (7, 'Change counters', create_change_counters),
+    (8, 'Compact order item events', create_order_item_events),
+    (9, 'Live events', create_live_events),
+    (10, 'Kitchen status of order lines', add_kitchen_status),
+    (11, 'Hourly sales rollups', create_sales_rollups),
+    (12, 'Export indexes', create_export_indexes),
+    (13, 'Change counter timestamps', add_change_counter_timestamps),
+    (14, 'Order line notes never NULL', clear_null_line_notes),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    """Version of the last applied migration, 0 for an empty database"""
+    try:
+        row = conn.execute('SELECT MAX(version) AS version FROM schema_version').fetchone()
+    except sqlite3.OperationalError:
+        # schema_version does not exist yet
+        return 0
+    return row['version'] or 0
+
+
+def apply_migrations(conn):
+    """Bring the database up to LATEST_VERSION, returns the versions applied"""
+    # Fast path for every startup after the first one
+    if get_schema_version(conn) >= LATEST_VERSION:
+        return []
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at DATETIME NOT NULL
+    )''')
+
+    applied = []
+    for version, description, migration in MIGRATIONS:
+        # BEGIN IMMEDIATE takes the write lock, so when several processes
+        # start together only one of them applies each step
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            migration(conn)
+            conn.execute(
+                'INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                (version, description, datetime.now())
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+
+    return applied
@@ -1,62 +1,129 @@
-from flask import render_template, request, redirect, url_for
+from flask import render_template, request, redirect, url_for, jsonify
 from datetime import datetime
 from . import movements_bp
-import sys
-import os
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import get_db_connection, get_last_stock
+from utils import get_db_connection, parse_date_window
+from stock import insert_movements, get_stock_at, get_stock_range, get_stock_ranges, movement_type_for
+from menu_cache import menu_cache
+from imports import CsvImportError, parse_movements_csv, import_movements
+from write_queue import run_write
+
+# Days shown by the movements page when no date range is given
+DEFAULT_WINDOW_DAYS = 7
+
 
 # Movements management
 @movements_bp.route('/')
 def movements():
+    try:
+        date_from, date_to, start, end = parse_date_window(request.args, DEFAULT_WINDOW_DAYS)
+    except ValueError:
+        return "Error: Dates must be in YYYY-MM-DD format", 400
+    menu_item_id = request.args.get('menu_item_id', type=int)
+
     conn = get_db_connection()
-    movements = conn.execute('''
-        SELECT  m.*,
-                'units' as unit
-        FROM movements m 
-        ORDER BY m.date DESC
-    ''').fetchall()
+    if menu_item_id is None:
+        movements = conn.execute('''
+            SELECT  m.*,
+                    m.menu_item_name as name,
+                    'units' as unit
+            FROM movements m
+            WHERE m.date >= ? AND m.date < ?
+            ORDER BY m.date DESC, m.id DESC
+        ''', (start, end)).fetchall()
+    else:
+        movements = conn.execute('''
+            SELECT  m.*,
+                    m.menu_item_name as name,
+                    'units' as unit
+            FROM movements m
+            WHERE m.menu_item_id = ? AND m.date >= ? AND m.date < ?
+            ORDER BY m.date DESC, m.id DESC
+        ''', (menu_item_id, start, end)).fetchall()
+
+    # Opening and closing stock of every item that moved in the window
+    item_names = {}
+    for movement in movements:
+        item_names.setdefault(movement['menu_item_id'], movement['menu_item_name'])
+    if menu_item_id is not None and menu_item_id not in item_names:
+        item = menu_cache.get(conn, menu_item_id)
+        item_names[menu_item_id] = item['name'] if item else ''
+
+    ranges = get_stock_ranges(conn, list(item_names), start, end)
+    balances = []
+    for item_id, name in sorted(item_names.items(), key=lambda item: item[1] or ''):
+        balance = ranges[item_id]
+        balance['name'] = name
+        balances.append(balance)
+
+    stockable_items = menu_cache.stockable(conn)
     conn.close()
-    return render_template('movements/index.html', movements=movements)
+    return render_template('movements/index.html', movements=movements, balances=balances,
+                           items=stockable_items, menu_item_id=menu_item_id,
+                           date_from=date_from, date_to=date_to)
 
 
+@movements_bp.route('/balance')
+def stock_balance():
+    """Stock of one item at a moment (`at`) or for a date window, as JSON"""
+    menu_item_id = request.args.get('menu_item_id', type=int)
+    if menu_item_id is None:
+        return jsonify(error='menu_item_id is required'), 400
+
+    conn = get_db_connection()
+    try:
+        if 'at' in request.args:
+            at = datetime.fromisoformat(request.args['at'])
+            result = {'menu_item_id': menu_item_id, 'at': at.isoformat(),
+                      'stock': get_stock_at(conn, menu_item_id, at)}
+        else:
+            date_from, date_to, start, end = parse_date_window(request.args, DEFAULT_WINDOW_DAYS)
+            result = get_stock_range(conn, menu_item_id, start, end)
+            result.update(date_from=date_from, date_to=date_to)
+    except ValueError:
+        return jsonify(error='Dates must be in ISO format (YYYY-MM-DD)'), 400
+    finally:
+        conn.close()
+    return jsonify(result)
+
 
 @movements_bp.route('/add', methods=('GET', 'POST'))
 def add_movement():
     if request.method == 'POST':
-        menu_item_id = request.form['menu_item_id']
+        menu_item_id = int(request.form['menu_item_id'])
         quantity_change = int(request.form['quantity_change'])
         notes = request.form.get('notes', '')
         item_name = request.form.get('item_name', '')
-        
-        # Determine movement type based on quantity
-        if quantity_change > 0:
-            movement_type = 'Entrada'
-        elif quantity_change < 0:
-            movement_type = 'Salida'
-        else:
-            movement_type = 'Comentario'
-        
 
-        
-        # If is the first movement return zero
-        # Here I need to be sure that is not None or something strange
+        movement_type = movement_type_for(quantity_change)
 
-
-        last_movement = get_last_stock(menu_item_id)
-        new_stock = last_movement + quantity_change
-
-        conn = get_db_connection()
-        conn.execute('''
-            INSERT INTO movements (menu_item_id, menu_item_name, quantity_change, movement_type, notes, date, partial_stock) 
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (menu_item_id, item_name, quantity_change, movement_type, notes, datetime.now(), new_stock))
-        conn.commit()
-        conn.close()
+        run_write(lambda conn: insert_movements(conn, [(menu_item_id, item_name, quantity_change,
+                                                        movement_type, notes)]))
         return redirect(url_for('movements.movements'))
-    
+
     # Get stockable menu items for dropdown
     conn = get_db_connection()
-    stockable_items = conn.execute('SELECT * FROM menu_items WHERE stockable = 1 ORDER BY name').fetchall()
+    stockable_items = menu_cache.stockable(conn)
+    conn.close()
+    return render_template('movements/add.html', items=stockable_items)
+
+
+
+@movements_bp.route('/import', methods=('GET', 'POST'))
+def import_movements_csv():
+    """Record a whole delivery from a CSV file (menu_item_id or menu_item_name,quantity_change,notes)"""
+    if request.method == 'GET':
+        return render_template('movements/import.html')
+
+    upload = request.files.get('file')
+    if upload is None:
+        return "Error: No file uploaded", 400
+    conn = get_db_connection()
+    try:
+        movements = parse_movements_csv(conn, upload.read().decode('utf-8-sig'))
+    except (CsvImportError, UnicodeDecodeError) as error:
+        conn.close()
+        return render_template('movements/import.html', errors=getattr(error, 'errors', [(1, str(error))])), 400
+    import_movements(conn, movements)
+    conn.commit()
     conn.close()
-    return render_template('movements/add.html', items=stockable_items)
\ No newline at end of file
+    return redirect(url_for('movements.movements'))
@@ -1,60 +1,121 @@
 from flask import render_template, request, redirect, url_for
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from . import orders_bp
-import sys
-import os
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import get_db_connection, get_last_stock
+from utils import get_db_connection
+from write_queue import run_write
+from menu_cache import menu_cache
+from cash import CashDayClosedError
+from table_sessions import TableNotFoundError, TableConflictError, AVAILABLE, get_floor
+from .service import (OrderError, OrderNotFoundError, create_order, get_order, get_order_lines,
+                      get_order_payments, order_total, add_items, edit_item, remove_item)
+from .service import close_order as close_order_service
+from .service import transfer_order as transfer_order_service
+
+ORDERS_PAGE_SIZE = 50
+
+# Keyset cursor for the first page: every real order id is below it
+FIRST_PAGE_CURSOR = 2 ** 63 - 1
 
 # Order management routes
 @orders_bp.route('/')
 def orders():
+    # Filters and keyset cursor (id of the last order on the previous page)
+    filters = {
+        'status': request.args.get('status', ''),
+        'table': request.args.get('table', ''),
+        'date_from': request.args.get('date_from', ''),
+        'date_to': request.args.get('date_to', ''),
+        'customer': request.args.get('customer', ''),
+    }
+    before = request.args.get('before', FIRST_PAGE_CURSOR, type=int)
+
+    conditions = ['orders.id < ?']
+    params = [before]
+    if filters['status']:
+        conditions.append('orders.status = ?')
+        params.append(filters['status'])
+    if filters['table']:
+        try:
+            params.append(int(filters['table']))
+        except ValueError:
+            return "Error: Invalid table number", 400
+        conditions.append('orders.table_id = ?')
+    try:
+        if filters['date_from']:
+            params.append(datetime.strptime(filters['date_from'], '%Y-%m-%d'))
+            conditions.append('orders.created_at >= ?')
+        if filters['date_to']:
+            # Inclusive: everything before the start of the next day
+            params.append(datetime.strptime(filters['date_to'], '%Y-%m-%d') + timedelta(days=1))
+            conditions.append('orders.created_at < ?')
+    except ValueError:
+        return "Error: Dates must be in YYYY-MM-DD format", 400
+    if filters['customer']:
+        conditions.append('orders.customer_name LIKE ?')
+        params.append(f"%{filters['customer']}%")
+
     conn = get_db_connection()
-    
-    # Get all orders in CSV-like format
-    orders = conn.execute('''
-        SELECT  
-            orders.id, 
-            orders.table_id, 
-            orders.customer_name, 
-            orders.status,
-            orders.created_at, 
-            orders.closed_at,
-            order_items.quantity,
-            order_items.unit_price,
-            SUM(order_items.quantity * order_items.unit_price) as calculated_total,
-            GROUP_CONCAT(order_items.menu_item_name || ': ' || order_items.quantity, ', ') as items_list
-                        
-        FROM orders     
-        LEFT JOIN order_items ON orders.id = order_items.order_id
-        GROUP BY 	orders.id, 
-            orders.table_id, 
-            orders.customer_name, 
-            orders.status,
-            orders.created_at, 
-            orders.closed_at
-            
+
+    # One page of orders, newest first. Fetch one extra row to know whether
+    # there is a next page.
+    page = conn.execute(f'''
+        SELECT  orders.id,
+                orders.table_id,
+                orders.customer_name,
+                orders.status,
+                orders.created_at,
+                orders.closed_at
+        FROM orders
+        WHERE {' AND '.join(conditions)}
         ORDER BY orders.id DESC
-    ''').fetchall()
-    
-    # Get payment information for each order
+        LIMIT ?
+    ''', params + [ORDERS_PAGE_SIZE + 1]).fetchall()
+
+    has_next_page = len(page) > ORDERS_PAGE_SIZE
+    page = page[:ORDERS_PAGE_SIZE]
+    order_ids = [order['id'] for order in page]
+    placeholders = ', '.join('?' * len(order_ids))
+
+    # Items and payments for the visible orders only
+    items_by_order = {}
+    payments_by_order = {}
+    if order_ids:
+        for row in conn.execute(f'''
+            SELECT  order_id,
+                    SUM(quantity * unit_price) as calculated_total,
+                    GROUP_CONCAT(menu_item_name || ': ' || quantity, ', ') as items_list
+            FROM order_items
+            WHERE order_id IN ({placeholders})
+            GROUP BY order_id
+        ''', order_ids):
+            items_by_order[row['order_id']] = row
+
+        for payment in conn.execute(f'''
+            SELECT order_id, payment_method, amount
+            FROM order_payments
+            WHERE order_id IN ({placeholders})
+            ORDER BY order_id, created_at
+        ''', order_ids):
+            payments_by_order.setdefault(payment['order_id'], []).append(payment)
+
+    conn.close()
+
     orders_with_payments = []
-    for order in orders:
-        payments = conn.execute('''
-            SELECT payment_method, amount 
-            FROM order_payments 
-            WHERE order_id = ?
-            ORDER BY created_at
-        ''', (order['id'],)).fetchall()
-        
-        # Convert order to dict and add payments
+    for order in page:
         order_dict = dict(order)
-        order_dict['payments'] = payments
+        items = items_by_order.get(order['id'])
+        order_dict['calculated_total'] = items['calculated_total'] if items else None
+        order_dict['items_list'] = items['items_list'] if items else None
+        order_dict['payments'] = payments_by_order.get(order['id'], [])
         orders_with_payments.append(order_dict)
-    
-    conn.close()
-    return render_template('orders/index.html', orders=orders_with_payments)
+
+    next_cursor = order_ids[-1] if has_next_page else None
+    # Only the filters in use are carried over to the pagination links
+    active_filters = {name: value for name, value in filters.items() if value}
+    return render_template('orders/index.html', orders=orders_with_payments, filters=filters,
+                           active_filters=active_filters, next_cursor=next_cursor,
+                           is_first_page=before == FIRST_PAGE_CURSOR)
 
 @orders_bp.route('/new/<int:table_id>', methods=('GET', 'POST'))
 def new_order(table_id):
@@ -62,38 +123,12 @@ def new_order(table_id):
         customer_name = request.form.get('customer_name', '')
         
         conn = get_db_connection()
-        cursor = conn.execute('''
-            INSERT INTO orders (table_id, customer_name, created_at, status) 
-            VALUES (?, ?, ?, ?)
-        ''', (table_id, customer_name, datetime.now(), 'active'))
-
-        conn.commit()
-
-        order_id = conn.execute('''
-                    select "id"
-                    from orders
-                    where table_id = ? and status = ?
-                ''', (table_id, 'active')).fetchone()["id"]
-
-        conn.execute('''
-            update restaurant_tables
-            set "status" = 'in use'
-            where table_number = ?
-        ''', (table_id,))
-
-        conn.execute('''
-            update restaurant_tables
-            set "customer_name" = ?
-            where table_number = ?
-        ''', (customer_name, table_id))
-
-        conn.execute('''
-            update restaurant_tables
-            set "open_order_number" = ?
-            where table_number = ?
-        ''', (order_id, table_id))
-
-        order_id = cursor.lastrowid
+        try:
+            order_id = create_order(conn, table_id, customer_name)
+        except TableNotFoundError as error:
+            return f"Error: {error}", 404
+        except TableConflictError as error:
+            return f"Error: {error}", 409
         conn.commit()
         conn.close()
         return redirect(url_for('orders.order_detail', order_id=order_id))
@@ -107,39 +142,27 @@ def new_order(table_id):
 @orders_bp.route('/<int:order_id>')
 def order_detail(order_id):
     conn = get_db_connection()
-    
-    # Get order info
-    order = conn.execute('''
-        SELECT *
-        FROM orders
-        WHERE orders.id = ?
-    ''', (order_id,)).fetchone()
-    
-    # Get order items
-    order_items = conn.execute('''
-        SELECT oi.*, mi.name, mi.category 
-        FROM order_items oi 
-        JOIN menu_items mi ON oi.menu_item_id = mi.id 
-        WHERE oi.order_id = ?
-    ''', (order_id,)).fetchall()
+    try:
+        order = get_order(conn, order_id)
+    except OrderNotFoundError as error:
+        return f"Error: {error}", 404
+    order_items = get_order_lines(conn, order_id)
     
     # Get available menu items for adding
-    menu_items = conn.execute('SELECT * FROM menu_items ORDER BY category, name').fetchall()
+    menu_items = menu_cache.catalog(conn)
     
     # Get payment history for this order
-    payments = conn.execute('''
-        SELECT payment_method, amount, created_at
-        FROM order_payments 
-        WHERE order_id = ?
-        ORDER BY created_at
-    ''', (order_id,)).fetchall()
-    
+    payments = get_order_payments(conn, order_id)
+
+    # Tables an open order can move to
+    free_tables = []
+    if order['status'] == 'active':
+        free_tables = [table for table in get_floor(conn) if table['status'] == AVAILABLE]
     conn.close()
     
-    # Calculate total in Python (more reliable than Jinja2 loop)
-    total = sum(item['quantity'] * item['unit_price'] for item in order_items)
-    
-    return render_template('orders/detail.html', order=order, order_items=order_items, menu_items=menu_items, total=total, payments=payments)
+    total = order_total(order_items)
+    return render_template('orders/detail.html', order=order, order_items=order_items, menu_items=menu_items, total=total, payments=payments,
+                           free_tables=free_tables)
 
 @orders_bp.route('/<int:order_id>/add_item', methods=('POST',))
 def add_order_item(order_id):
@@ -147,28 +170,12 @@ def add_order_item(order_id):
     quantity = int(request.form['quantity'])
     notes = request.form.get('notes', '')
     
-    conn = get_db_connection()
-    
-    # Get menu item details (price and stockable status)
-    menu_item = conn.execute('SELECT price, name FROM menu_items WHERE id = ?', (menu_item_id,)).fetchone()
-    
-    # Add order item
-    cursor = conn.execute('''
-        INSERT INTO order_items (order_id, menu_item_id, quantity, unit_price, notes, menu_item_name) 
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (order_id, menu_item_id, quantity, menu_item['price'], notes, menu_item['name']))
-    
-    # Get the auto-incremental ID of the just inserted order item
-    order_item_id = cursor.lastrowid
-    
-    # Log the action in order item history
-    conn.execute('''
-        INSERT INTO order_item_history (order_id, menu_item_id, action, quantity, unit_price, notes, timestamp, menu_item_name)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (order_id, menu_item_id, 'added', quantity, menu_item['price'], notes, datetime.now(), menu_item['name']))
-    
-    conn.commit()
-    conn.close()
+    try:
+        run_write(lambda conn: add_items(conn, order_id, [(menu_item_id, quantity, notes)]))
+    except OrderNotFoundError as error:
+        return f"Error: {error}", 404
+    except OrderError as error:
+        return f"Error: {error}", 400
     return redirect(url_for('orders.order_detail', order_id=order_id))
 
 @orders_bp.route('/<int:order_id>/items/<int:item_id>/edit', methods=('POST',))
@@ -176,53 +183,35 @@ def edit_order_item(order_id, item_id):
     quantity = int(request.form['quantity'])
     notes = request.form.get('notes', '')
     
-    conn = get_db_connection()
-    
-    # Get current item details for history
-    current_item = conn.execute('SELECT * FROM order_items WHERE id = ?', (item_id,)).fetchone()
-    
-    # Update the order item
-    conn.execute('''
-        UPDATE order_items SET quantity = ?, notes = ? WHERE id = ?
-    ''', (quantity, notes, item_id))
-    
-
-    # Log the edit action in order item history
-    conn.execute('''
-        INSERT INTO order_item_history (order_id, menu_item_id, action, quantity, unit_price, notes, timestamp, menu_item_name)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (order_id, current_item['menu_item_id'], 'old_edited', current_item['quantity'], current_item['unit_price'], current_item['notes'], datetime.now(), current_item["menu_item_name"]))
-    
-
-    # Log the edit action in order item history
-    conn.execute('''
-        INSERT INTO order_item_history (order_id, menu_item_id, action, quantity, unit_price, notes, timestamp, menu_item_name)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (order_id, current_item['menu_item_id'], 'new_edited', quantity, current_item['unit_price'], notes, datetime.now(), current_item["menu_item_name"]))
-    
-    conn.commit()
-    conn.close()
+    try:
+        run_write(lambda conn: edit_item(conn, order_id, item_id, quantity, notes))
+    except OrderNotFoundError as error:
+        return f"Error: {error}", 404
+    except OrderError as error:
+        return f"Error: {error}", 400
     return redirect(url_for('orders.order_detail', order_id=order_id))
 
 @orders_bp.route('/<int:order_id>/items/<int:item_id>/remove', methods=('POST',))
 def remove_order_item(order_id, item_id):
-    conn = get_db_connection()
-    
-    # Get current item details for history before deleting
-    current_item = conn.execute('SELECT * FROM order_items WHERE id = ?', (item_id,)).fetchone()
-
-    # Log the edit action in order item history
-    conn.execute('''
-        INSERT INTO order_item_history (order_id, menu_item_id, action, quantity, unit_price, notes, timestamp, menu_item_name)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (order_id, current_item['menu_item_id'], 'removed', current_item["quantity"], current_item['unit_price'], current_item["notes"], datetime.now(), current_item["menu_item_name"]))
-    
+    try:
+        run_write(lambda conn: remove_item(conn, order_id, item_id))
+    except OrderNotFoundError as error:
+        return f"Error: {error}", 404
+    except OrderError as error:
+        return f"Error: {error}", 400
+    return redirect(url_for('orders.order_detail', order_id=order_id))
 
-    # Remove the order item
-    conn.execute('DELETE FROM order_items WHERE id = ?', (item_id,))
-    
-    conn.commit()
-    conn.close()
+@orders_bp.route('/<int:order_id>/transfer', methods=('POST',))
+def transfer_order(order_id):
+    table_id = int(request.form['table_id'])
+    try:
+        run_write(lambda conn: transfer_order_service(conn, order_id, table_id))
+    except (OrderNotFoundError, TableNotFoundError) as error:
+        return f"Error: {error}", 404
+    except TableConflictError as error:
+        return f"Error: {error}", 409
+    except OrderError as error:
+        return f"Error: {error}", 400
     return redirect(url_for('orders.order_detail', order_id=order_id))
 
 @orders_bp.route('/<int:order_id>/close', methods=('POST',))
@@ -241,68 +230,16 @@ def close_order(order_id):
         return "Error: Mismatch between payment methods and amounts", 400
     
     conn = get_db_connection()
-    
-    # Calculate order total
-    order_total_result = conn.execute('''
-        SELECT SUM(oi.quantity * oi.unit_price) as total
-        FROM order_items oi
-        WHERE oi.order_id = ?
-    ''', (order_id,)).fetchone()
-    order_total = order_total_result['total'] or 0
-    
-    # Validate payment total matches order total
-    payment_total = sum(amounts)
-    if abs(order_total - payment_total) > 0.01:  # Allow 1 cent rounding difference
-        return f"Error: Payment total ${payment_total:.2f} doesn't match order total ${order_total:.2f}", 400
-    
-    # Get all current order items for stock movements
-    order_items = conn.execute('''
-        SELECT oi.menu_item_id, oi.quantity, menu_item_name, mi.stockable
-        FROM order_items oi
-        JOIN menu_items mi ON oi.menu_item_id = mi.id
-        WHERE oi.order_id = ?
-    ''', (order_id,)).fetchall()
-    
-    # Create stock movements for all stockable items when order is closed
-    for item in order_items:
-        if item['stockable']:
-            last_movement = get_last_stock(item["menu_item_id"])
-            new_stock = last_movement - item['quantity']
-            movement_notes = f"Auto: Order #{order_id} closed - {item['menu_item_name']} x{item['quantity']}"
-            conn.execute('''
-                INSERT INTO movements (menu_item_id, quantity_change, movement_type, notes, date, menu_item_name, partial_stock) 
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (item['menu_item_id'], -item['quantity'], 'out', movement_notes, datetime.now(), item['menu_item_name'], new_stock))
-    
-    # Save all payments
-    for method, amount in zip(payment_methods, amounts):
-        if amount > 0:  # Only save payments with positive amounts
-            conn.execute('''
-                INSERT INTO order_payments (order_id, payment_method, amount, created_at)
-                VALUES (?, ?, ?, ?)
-            ''', (order_id, method, amount, datetime.now()))
-    
-    # Close the order
-    conn.execute('UPDATE orders SET status = ?, closed_at = ? WHERE id = ?', 
-                ('closed', datetime.now(), order_id))
-    
-    table_number = conn.execute('''
-        SELECT table_number
-        FROM restaurant_tables
-        WHERE open_order_number = ?
-        and status = ?
-    ''', (order_id, 'in use')).fetchone()["table_number"]
-
-    conn.execute(
-        'UPDATE restaurant_tables SET open_order_number = null WHERE table_number = ? and status = ?',
-        (table_number, 'in use')
-    )
-
-    conn.execute(
-        'UPDATE restaurant_tables SET status = ? WHERE table_number = ? and status = ?',
-        ('available', table_number, 'in use')
-    )
-    
+    try:
+        close_order_service(conn, order_id, list(zip(payment_methods, amounts)))
+    except OrderNotFoundError as error:
+        return f"Error: {error}", 404
+    except TableConflictError as error:
+        conn.rollback()
+        return f"Error: {error}", 409
+    except (OrderError, CashDayClosedError) as error:
+        conn.rollback()
+        return f"Error: {error}", 400
     conn.commit()
     conn.close()
-    return redirect(url_for('orders.orders'))
\ No newline at end of file
+    return redirect(url_for('orders.orders'))
@@ -0,0 +1,271 @@
+from datetime import datetime
+from db import inserted_ids
+from stock import insert_movements
+from menu_cache import menu_cache
+from cash import record_cash, ORDER_PAYMENT
+from kitchen_queue import publish_lines, publish_removed, serve_order
+from sales import record_sale
+from table_sessions import open_table, close_table, transfer_table
+import audit
+
+# Order operations shared by the HTML routes and the JSON API. Every function
+# works on the caller's connection and never commits, so a route can combine
+# several of them in one transaction. Invalid requests raise OrderError
+# before anything is written; a cash day closed (CashDayClosedError from
+# record_cash) or a table or order taken by someone else meanwhile
+# (table_sessions' TableConflictError) is found under the write lock, and the
+# caller rolls back.
+
+
+class OrderError(Exception):
+    """The request cannot be applied to the order"""
+
+
+class OrderNotFoundError(OrderError):
+    """The order, line or table does not exist"""
+
+
+def create_order(conn, table_id, customer_name=''):
+    """Open an order on an available table and mark it as in use; returns its id"""
+    return open_table(conn, table_id, customer_name, datetime.now())
+
+
+def transfer_order(conn, order_id, table_id):
+    """Move an open order, and its kitchen tickets, to an available table"""
+    order = get_active_order(conn, order_id)
+    if order['table_id'] == table_id:
+        raise OrderError(f"Order {order_id} is already on table {table_id}")
+    transfer_table(conn, order_id, order['customer_name'], order['table_id'], table_id)
+
+    open_lines = conn.execute('''
+        SELECT id FROM order_items WHERE order_id = ? AND kitchen_status != 'served'
+    ''', (order_id,)).fetchall()
+    publish_lines(conn, [line['id'] for line in open_lines])
+
+
+def get_order(conn, order_id):
+    """The order row, or raise OrderNotFoundError"""
+    order = conn.execute('SELECT * FROM orders WHERE orders.id = ?', (order_id,)).fetchone()
+    if order is None:
+        raise OrderNotFoundError(f"Order {order_id} not found")
+    return order
+
+
+def get_active_order(conn, order_id):
+    """Like get_order, but the order must still be open"""
+    order = get_order(conn, order_id)
+    if order['status'] != 'active':
+        raise OrderError(f"Order {order_id} is {order['status']}")
+    return order
+
+
+def get_order_lines(conn, order_id):
+    """Lines of an order with the menu item name and category"""
+    return conn.execute('''
+        SELECT oi.*, mi.name, mi.category
+        FROM order_items oi
+        JOIN menu_items mi ON oi.menu_item_id = mi.id
+        WHERE oi.order_id = ?
+    ''', (order_id,)).fetchall()
+
+
+def get_order_payments(conn, order_id):
+    return conn.execute('''
+        SELECT payment_method, amount, created_at
+        FROM order_payments
+        WHERE order_id = ?
+        ORDER BY created_at
+    ''', (order_id,)).fetchall()
+
+
+def order_total(lines):
+    return sum(line['quantity'] * line['unit_price'] for line in lines)
+
+
+def _get_line(conn, order_id, item_id):
+    line = conn.execute('SELECT * FROM order_items WHERE id = ? AND order_id = ?',
+                        (item_id, order_id)).fetchone()
+    if line is None:
+        raise OrderNotFoundError(f"Item {item_id} not found in order {order_id}")
+    return line
+
+
+def add_items(conn, order_id, items):
+    """Add (menu_item_id, quantity, notes) lines to an order in one batch.
+
+    Prices and names come from the menu cache. Every item is validated before
+    the first INSERT, so a bad item leaves the order untouched.
+    """
+    get_active_order(conn, order_id)
+
+    rows = []
+    for menu_item_id, quantity, notes in items:
+        menu_item = menu_cache.get(conn, menu_item_id)
+        if menu_item is None:
+            raise OrderError(f"Menu item {menu_item_id} not found")
+        if quantity <= 0:
+            raise OrderError(f"Quantity must be positive, got {quantity}")
+        rows.append((order_id, menu_item_id, quantity, menu_item['price'], notes or '', menu_item['name']))
+    if not rows:
+        raise OrderError("No items to add")
+
+    conn.executemany('''
+        INSERT INTO order_items (order_id, menu_item_id, quantity, unit_price, notes, menu_item_name)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+    # Log the action in the order item events, keyed by the new line ids
+    now = datetime.now()
+    events = [(order_id, line_id, 'added', menu_item_id, name, unit_price, quantity, notes, now)
+              for line_id, (order_id, menu_item_id, quantity, unit_price, notes, name)
+              in zip(inserted_ids(conn, len(rows)), rows)]
+    audit.record(conn, 'order_item_events', events)
+    publish_lines(conn, [event[1] for event in events])
+
+
+def edit_item(conn, order_id, item_id, quantity=None, notes=None):
+    """Change the quantity and notes of a line, logging only what changed.
+
+    A quantity or notes of None keeps the line's current value. Notes are
+    never stored as NULL: in the event log NULL means "unchanged".
+    """
+    get_active_order(conn, order_id)
+    if quantity is not None and quantity <= 0:
+        raise OrderError(f"Quantity must be positive, got {quantity}")
+    current_item = _get_line(conn, order_id, item_id)
+    if quantity is None:
+        quantity = current_item['quantity']
+    if notes is None:
+        notes = current_item['notes'] or ''
+
+    changed_quantity = quantity if quantity != current_item['quantity'] else None
+    changed_notes = notes if notes != current_item['notes'] else None
+    if changed_quantity is None and changed_notes is None:
+        return
+
+    conn.execute('UPDATE order_items SET quantity = ?, notes = ? WHERE id = ?',
+                 (quantity, notes, item_id))
+    audit.record(conn, 'order_item_events', [
+        (order_id, item_id, 'edited', None, None, None, changed_quantity, changed_notes, datetime.now()),
+    ])
+    publish_lines(conn, [item_id])
+
+
+def remove_item(conn, order_id, item_id):
+    """Delete a line, logging its removal"""
+    get_active_order(conn, order_id)
+    _get_line(conn, order_id, item_id)
+
+    conn.execute('DELETE FROM order_items WHERE id = ?', (item_id,))
+    audit.record(conn, 'order_item_events', [
+        (order_id, item_id, 'removed', None, None, None, None, None, datetime.now()),
+    ])
+    publish_removed(conn, order_id, [item_id])
+
+
+def get_order_timeline(conn, order_id):
+    """Every event of an order's lines, oldest first"""
+    return conn.execute('''
+        SELECT id, order_item_id, event, menu_item_id, menu_item_name, unit_price, quantity, notes, timestamp
+        FROM order_item_events
+        WHERE order_id = ?
+        ORDER BY timestamp, id
+    ''', (order_id,)).fetchall()
+
+
+def replay_order(conn, order_id, at=None):
+    """Lines of an order as they were at `at` (a datetime), or now.
+
+    Folds the order's events in order: 'added' creates a line, 'edited'
+    overwrites the fields it carries and 'removed' drops the line. Lines
+    removed before the history was converted have negative ids.
+    """
+    params = [order_id]
+    at_filter = ''
+    if at is not None:
+        at_filter = 'AND timestamp <= ?'
+        params.append(at)
+
+    lines = {}
+    for event in conn.execute(f'''
+        SELECT order_item_id, event, menu_item_id, menu_item_name, unit_price, quantity, notes
+        FROM order_item_events
+        WHERE order_id = ? {at_filter}
+        ORDER BY timestamp, id
+    ''', params):
+        line_id = event['order_item_id']
+        if event['event'] == 'added':
+            lines[line_id] = {
+                'id': line_id,
+                'menu_item_id': event['menu_item_id'],
+                'name': event['menu_item_name'],
+                'unit_price': event['unit_price'],
+                'quantity': event['quantity'],
+                'notes': event['notes'],
+            }
+        elif event['event'] == 'edited' and line_id in lines:
+            if event['quantity'] is not None:
+                lines[line_id]['quantity'] = event['quantity']
+            if event['notes'] is not None:
+                lines[line_id]['notes'] = event['notes']
+        elif event['event'] == 'removed':
+            lines.pop(line_id, None)
+    return list(lines.values())
+
+
+def close_order(conn, order_id, payments):
+    """Close an order paid with (payment_method, amount) pairs.
+
+    Closes the order and frees its table first: that write takes the write
+    lock, so a concurrent close of the same order fails with
+    TableConflictError and no line can be added under us. Then deducts stock
+    for the stockable lines, records the payments in order_payments, the cash
+    summary and the sales rollups and takes its lines off the kitchen queue.
+    A payment error raised after the close is undone by the caller's
+    rollback.
+    """
+    get_active_order(conn, order_id)
+    closed_at = datetime.now()
+    table_id = close_table(conn, order_id, closed_at)
+
+    # Get all current order items, in one query
+    order_items = conn.execute('''
+        SELECT  oi.menu_item_id,
+                oi.quantity,
+                oi.unit_price,
+                oi.menu_item_name,
+                mi.stockable,
+                mi.category
+        FROM order_items oi
+        LEFT JOIN menu_items mi ON oi.menu_item_id = mi.id
+        WHERE oi.order_id = ?
+    ''', (order_id,)).fetchall()
+    total = order_total(order_items)
+
+    # Validate payment total matches order total
+    payment_total = sum(amount for _, amount in payments)
+    if abs(total - payment_total) > 0.01:  # Allow 1 cent rounding difference
+        raise OrderError(f"Payment total ${payment_total:.2f} doesn't match order total ${total:.2f}")
+
+    # Only the payments with positive amounts are saved
+    payments = [(method, amount) for method, amount in payments if amount > 0]
+    record_cash(conn, [(closed_at, method, ORDER_PAYMENT, amount) for method, amount in payments])
+    conn.executemany('''
+        INSERT INTO order_payments (order_id, payment_method, amount, created_at)
+        VALUES (?, ?, ?, ?)
+    ''', [(order_id, method, amount, closed_at) for method, amount in payments])
+    record_sale(conn, closed_at, table_id, order_items, payments)
+
+    # Create stock movements for all stockable items when order is closed
+    stockable_items = [item for item in order_items if item['stockable']]
+    insert_movements(
+        conn,
+        [(item['menu_item_id'], item['menu_item_name'], -item['quantity'], 'out',
+          f"Auto: Order #{order_id} closed - {item['menu_item_name']} x{item['quantity']}")
+         for item in stockable_items],
+        closed_at
+    )
+
+    # Clear its kitchen tickets
+    serve_order(conn, order_id)
+    return total
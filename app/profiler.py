@@ -0,0 +1,154 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+
+from flask import g, render_template, request
+
+from db import get_db_connection, get_setting
+
+# Per-request SQL profiler for development and for chasing a slow page in
+# production. When SQL_PROFILER is on, every request gets its connection up
+# front with a trace callback, so each statement SQLite runs (including the
+# implicit BEGIN/COMMIT and every row of an executemany) is recorded with its
+# bound values. PooledConnection reports how long each execute took, which is
+# spread over the statements it traced. Statements are grouped by shape
+# (literals replaced by ?) and a shape repeated SQL_N_PLUS_ONE_THRESHOLD
+# times outside an executemany is an N+1 candidate: a query in a loop.
+#
+# Requests slower than SQL_SLOW_REQUEST_MS get a warning in the log, and the
+# last SQL_PROFILER_HISTORY requests are listed on /debug/sql. With
+# SQL_EXPLAIN_SLOW, statements slower than SQL_SLOW_STATEMENT_MS get their
+# EXPLAIN QUERY PLAN captured after the response is built.
+
+logger = logging.getLogger(__name__)
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(sql):
+    """Shape of a statement: literals become ?, IN lists collapse, one line"""
+    shape = STRING_LITERAL.sub('?', sql)
+    shape = NUMBER_LITERAL.sub('?', shape)
+    shape = IN_LIST.sub('IN (...)', shape)
+    return WHITESPACE.sub(' ', shape).strip()
+
+
+class RequestProfile:
+    """Statements run while building one response"""
+
+    def __init__(self, method, path, endpoint):
+        self.method = method
+        self.path = path
+        self.endpoint = endpoint
+        self.started_at = time.time()
+        self.statements = []
+        self.duration_ms = 0.0
+        self.status = None
+        self.n_plus_one = []
+        self._untimed = 0
+
+    def trace(self, sql):
+        self.statements.append({'sql': sql, 'shape': normalize(sql), 'ms': None,
+                                'batched': False, 'plan': None})
+
+    def timed(self, sql, seconds, many):
+        """Spread an execute's time over the statements it traced"""
+        traced = self.statements[self._untimed:]
+        self._untimed = len(self.statements)
+        for statement in traced:
+            statement['ms'] = seconds * 1000 / len(traced)
+            statement['batched'] = many
+
+    @property
+    def sql_ms(self):
+        return sum(statement['ms'] or 0 for statement in self.statements)
+
+    def finish(self, status, threshold):
+        self.status = status
+        self.duration_ms = (time.time() - self.started_at) * 1000
+        shapes = Counter(statement['shape'] for statement in self.statements if not statement['batched'])
+        self.n_plus_one = [(shape, count) for shape, count in shapes.most_common() if count >= threshold]
+
+
+class ProfileHistory:
+    """The most recent profiles, newest first"""
+
+    def __init__(self, size):
+        self._lock = threading.Lock()
+        self._profiles = deque(maxlen=size)
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles.appendleft(profile)
+
+    def list(self):
+        with self._lock:
+            return list(self._profiles)
+
+
+history = ProfileHistory(50)
+
+
+def start_profile():
+    if request.endpoint in ('static', 'debug_sql'):
+        return
+    profile = g.sql_profile = RequestProfile(request.method, request.full_path.rstrip('?'), request.endpoint)
+    conn = get_db_connection()
+    conn.set_trace_callback(profile.trace)
+    conn.statement_observer = profile.timed
+
+
+def finish_profile(response):
+    profile = g.pop('sql_profile', None)
+    if profile is None:
+        return response
+    conn = g.get('db')
+    if conn is not None:
+        conn.set_trace_callback(None)
+        conn.statement_observer = None
+
+    profile.finish(response.status_code, get_setting('SQL_N_PLUS_ONE_THRESHOLD'))
+    if conn is not None and get_setting('SQL_EXPLAIN_SLOW'):
+        explain_slow_statements(conn, profile, get_setting('SQL_SLOW_STATEMENT_MS'))
+    history.add(profile)
+
+    if profile.duration_ms >= get_setting('SQL_SLOW_REQUEST_MS'):
+        logger.warning("Slow request %s %s: %.1f ms, %d statements, %.1f ms in SQL%s",
+                       profile.method, profile.path, profile.duration_ms, len(profile.statements),
+                       profile.sql_ms,
+                       ''.join(f"; N+1 candidate x{count}: {shape}" for shape, count in profile.n_plus_one))
+    return response
+
+
+def explain_slow_statements(conn, profile, threshold_ms):
+    for statement in profile.statements:
+        if statement['ms'] is None or statement['ms'] < threshold_ms:
+            continue
+        try:
+            rows = conn.execute('EXPLAIN QUERY PLAN ' + statement['sql']).fetchall()
+        except Exception as error:
+            statement['plan'] = [f"(no plan: {error})"]
+        else:
+            statement['plan'] = [row['detail'] for row in rows]
+
+
+def debug_sql():
+    return render_template('debug/sql.html', profiles=history.list(),
+                           slow_statement_ms=get_setting('SQL_SLOW_STATEMENT_MS'))
+
+
+def register_profiler(app):
+    """Install the profiling hooks and the /debug/sql page on app"""
+    global history
+    with app.app_context():
+        if not get_setting('SQL_PROFILER'):
+            return
+        history = ProfileHistory(get_setting('SQL_PROFILER_HISTORY'))
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.add_url_rule('/debug/sql', 'debug_sql', debug_sql)
@@ -0,0 +1,22 @@
+from flask import render_template, request
+from . import reports_bp
+from utils import get_db_connection, parse_date_window
+from sales import get_sales_report
+
+# Days shown by the sales report when no date range is given
+DEFAULT_WINDOW_DAYS = 30
+
+
+# Sales by item, category, hour of day, table and payment method, read from
+# the hourly rollups
+@reports_bp.route('/sales')
+def sales():
+    try:
+        date_from, date_to, start, end = parse_date_window(request.args, DEFAULT_WINDOW_DAYS)
+    except ValueError:
+        return "Error: Dates must be in YYYY-MM-DD format", 400
+
+    conn = get_db_connection()
+    report = get_sales_report(conn, start, end)
+    conn.close()
+    return render_template('reports/sales.html', report=report, date_from=date_from, date_to=date_to)
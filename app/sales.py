@@ -0,0 +1,194 @@
+import numpy as np
+
+from db import get_db_connection
+
+# Hourly sales rollups. close_order adds each closed order to three tables
+# keyed by the hour it was closed ('YYYY-MM-DD HH'): per menu item, per table
+# and per payment method. A report over any range sums those rows instead of
+# joining order_items, orders and order_payments over the whole history.
+
+HOUR_FORMAT = '%Y-%m-%d %H'
+
+UPSERT_ITEM_SALES = '''
+    INSERT INTO sales_hourly_items (hour, menu_item_id, menu_item_name, category, quantity, revenue)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (hour, menu_item_id) DO UPDATE SET
+        menu_item_name = excluded.menu_item_name,
+        category = excluded.category,
+        quantity = quantity + excluded.quantity,
+        revenue = revenue + excluded.revenue
+'''
+
+UPSERT_TABLE_SALES = '''
+    INSERT INTO sales_hourly_tables (hour, table_id, orders, revenue)
+    VALUES (?, ?, 1, ?)
+    ON CONFLICT (hour, table_id) DO UPDATE SET
+        orders = orders + 1,
+        revenue = revenue + excluded.revenue
+'''
+
+UPSERT_PAYMENT_SALES = '''
+    INSERT INTO sales_hourly_payments (hour, payment_method, payments, amount)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (hour, payment_method) DO UPDATE SET
+        payments = payments + excluded.payments,
+        amount = amount + excluded.amount
+'''
+
+
+def record_sale(conn, closed_at, table_id, lines, payments):
+    """Add a closed order to the rollups; runs in close_order's transaction.
+
+    lines are rows with menu_item_id, menu_item_name, category, quantity and
+    unit_price; payments are (payment_method, amount) pairs.
+    """
+    hour = closed_at.strftime(HOUR_FORMAT)
+
+    items = {}
+    for line in lines:
+        name, category, quantity, revenue = items.get(line['menu_item_id'], (None, None, 0, 0.0))
+        items[line['menu_item_id']] = (line['menu_item_name'], line['category'] or '',
+                                       quantity + line['quantity'],
+                                       revenue + line['quantity'] * float(line['unit_price']))
+    conn.executemany(UPSERT_ITEM_SALES, [
+        (hour, menu_item_id, name, category, quantity, revenue)
+        for menu_item_id, (name, category, quantity, revenue) in items.items()
+    ])
+    conn.execute(UPSERT_TABLE_SALES, (hour, table_id, sum(revenue for _, _, _, revenue in items.values())))
+
+    methods = {}
+    for method, amount in payments:
+        count, total = methods.get(method, (0, 0.0))
+        methods[method] = (count + 1, total + float(amount))
+    conn.executemany(UPSERT_PAYMENT_SALES, [
+        (hour, method, count, total) for method, (count, total) in methods.items()
+    ])
+
+
+def _sum_by(keys, *columns):
+    """Distinct keys and the sum of each column per key; counts stay integers"""
+    labels, inverse = np.unique(np.asarray(keys), return_inverse=True)
+    sums = []
+    for column in columns:
+        column = np.asarray(column)
+        total = np.bincount(inverse, weights=column.astype(float), minlength=len(labels))
+        sums.append(total.round().astype(int) if column.dtype.kind == 'i' else total.round(2))
+    return labels, sums
+
+
+def _report_rows(labels, names, sums):
+    """[{key: label, name: value, ...}] sorted by the last column, largest first"""
+    order = np.argsort(-sums[-1], kind='stable')
+    return [dict(zip(names, (labels[i].item(), *(column[i].item() for column in sums))))
+            for i in order]
+
+
+def get_sales_report(conn, start, end):
+    """Sales closed in [start, end) (datetimes, rounded down to the hour).
+
+    Returns rows by menu item, category, hour of day, table and payment
+    method, each sorted by revenue (or amount), and the overall totals.
+    """
+    bounds = (start.strftime(HOUR_FORMAT), end.strftime(HOUR_FORMAT))
+
+    # SQLite folds the range into one row per hour of day, item and category
+    # (at most 24 per item); NumPy merges those into the item, category and
+    # hour of day breakdowns. The bare menu_item_name comes from the row with
+    # MAX(hour), so the newest name wins.
+    items = conn.execute('''
+        SELECT CAST(substr(hour, 12, 2) AS INTEGER) AS hour_of_day, menu_item_id, category,
+               MAX(hour) AS last_hour, menu_item_name, SUM(quantity) AS quantity, SUM(revenue) AS revenue
+        FROM sales_hourly_items
+        WHERE hour >= ? AND hour < ?
+        GROUP BY hour_of_day, menu_item_id, category
+        ORDER BY last_hour
+    ''', bounds).fetchall()
+    names = {row['menu_item_id']: row['menu_item_name'] for row in items}
+    quantity = np.asarray([row['quantity'] for row in items], dtype=int)
+    revenue = np.asarray([row['revenue'] for row in items], dtype=float)
+
+    labels, sums = _sum_by([row['menu_item_id'] for row in items], quantity, revenue)
+    by_item = _report_rows(labels, ('menu_item_id', 'quantity', 'revenue'), sums)
+    for row in by_item:
+        row['name'] = names[row['menu_item_id']]
+
+    labels, sums = _sum_by([row['category'] for row in items], quantity, revenue)
+    by_category = _report_rows(labels, ('category', 'quantity', 'revenue'), sums)
+
+    # Every hour of the day, sold or not, in clock order
+    hour_of_day = np.asarray([row['hour_of_day'] for row in items], dtype=int)
+    hourly_quantity = np.bincount(hour_of_day, weights=quantity, minlength=24)
+    hourly_revenue = np.bincount(hour_of_day, weights=revenue, minlength=24)
+    by_hour = [{'hour': hour, 'quantity': int(hourly_quantity[hour]), 'revenue': round(float(hourly_revenue[hour]), 2)}
+               for hour in range(24)]
+
+    by_table = [{'table_id': row['table_id'], 'orders': row['orders'], 'revenue': round(row['revenue'], 2)}
+                for row in conn.execute('''
+        SELECT table_id, SUM(orders) AS orders, SUM(revenue) AS revenue
+        FROM sales_hourly_tables
+        WHERE hour >= ? AND hour < ?
+        GROUP BY table_id
+        ORDER BY revenue DESC
+    ''', bounds)]
+    by_payment = [{'payment_method': row['payment_method'], 'payments': row['payments'],
+                   'amount': round(row['amount'], 2)}
+                  for row in conn.execute('''
+        SELECT payment_method, SUM(payments) AS payments, SUM(amount) AS amount
+        FROM sales_hourly_payments
+        WHERE hour >= ? AND hour < ?
+        GROUP BY payment_method
+        ORDER BY amount DESC
+    ''', bounds)]
+
+    return {
+        'by_item': by_item,
+        'by_category': by_category,
+        'by_hour': by_hour,
+        'by_table': by_table,
+        'by_payment_method': by_payment,
+        'totals': {
+            'orders': sum(row['orders'] for row in by_table),
+            'quantity': int(quantity.sum()),
+            'revenue': round(float(revenue.sum()), 2),
+        },
+    }
+
+
+def rebuild_sales_rollups(DATABASE=None, conn=None):
+    """Recompute the hourly sales rollups from closed orders and their payments"""
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection(DATABASE)
+
+    conn.execute('DELETE FROM sales_hourly_items')
+    conn.execute('DELETE FROM sales_hourly_tables')
+    conn.execute('DELETE FROM sales_hourly_payments')
+    rebuilt = conn.execute('''
+        INSERT INTO sales_hourly_items (hour, menu_item_id, menu_item_name, category, quantity, revenue)
+        SELECT strftime('%Y-%m-%d %H', o.closed_at), oi.menu_item_id, MAX(oi.menu_item_name),
+               COALESCE(MAX(mi.category), ''), SUM(oi.quantity), SUM(oi.quantity * oi.unit_price)
+        FROM order_items oi
+        JOIN orders o ON o.id = oi.order_id
+        LEFT JOIN menu_items mi ON mi.id = oi.menu_item_id
+        WHERE o.status = 'closed'
+        GROUP BY 1, 2
+    ''').rowcount
+    rebuilt += conn.execute('''
+        INSERT INTO sales_hourly_tables (hour, table_id, orders, revenue)
+        SELECT strftime('%Y-%m-%d %H', o.closed_at), o.table_id, COUNT(*),
+               SUM(COALESCE((SELECT SUM(quantity * unit_price) FROM order_items WHERE order_id = o.id), 0))
+        FROM orders o
+        WHERE o.status = 'closed'
+        GROUP BY 1, 2
+    ''').rowcount
+    rebuilt += conn.execute('''
+        INSERT INTO sales_hourly_payments (hour, payment_method, payments, amount)
+        SELECT strftime('%Y-%m-%d %H', created_at), payment_method, COUNT(*), SUM(amount)
+        FROM order_payments
+        GROUP BY 1, 2
+    ''').rowcount
+
+    if own_connection:
+        conn.commit()
+        conn.close()
+    return rebuilt
@@ -0,0 +1,100 @@
+import argparse
+import glob
+import logging
+import os
+import tempfile
+
+from db import get_database_path, get_pool, get_setting
+from utils import init_database
+from audit import flush_audit
+from metrics import flush_metrics
+from app import create_app
+
+# Production entry point:
+#
+#   cd app && python serve.py [--workers N] [--threads N] [--database FILE]
+#
+# Serves the app with gunicorn: SERVER_WORKERS forked processes (one per CPU
+# core by default), each handling SERVER_THREADS requests at a time. The
+# migrations run once in the master before the workers fork, and the master
+# gives its connections back before forking so no worker inherits an open
+# SQLite handle. Every other setting (pool size, pragmas, audit mode, ...)
+# comes from the environment as usual and applies to every worker. The
+# workers share a METRICS_DIR (a fresh temporary directory unless set), so
+# /metrics answers with the totals of all of them.
+
+logger = logging.getLogger(__name__)
+
+
+def prepare_database(database):
+    """Apply pending migrations, then close the connections used for it"""
+    init_database(database)
+    get_pool(database).close_all()
+
+
+def prepare_metrics_dir(directory=None):
+    """The workers' shared metrics directory, emptied of a previous run's files"""
+    if directory is None:
+        return tempfile.mkdtemp(prefix='restaurant-metrics-')
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        os.remove(path)
+    return directory
+
+
+def gunicorn_application(app, options):
+    """A gunicorn application serving an already built Flask app"""
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for name, value in options.items():
+                self.cfg.set(name, value)
+
+        def load(self):
+            return app
+
+    return Application()
+
+
+def serve(host, port, workers, threads, database):
+    database = get_database_path(database)
+    prepare_database(database)
+    metrics_dir = prepare_metrics_dir(os.environ.get('METRICS_DIR'))
+    app = create_app({'DATABASE_PATH': database, 'METRICS_DIR': metrics_dir})
+
+    try:
+        application = gunicorn_application(app, {
+            'bind': f'{host}:{port}',
+            'workers': workers,
+            'threads': threads,
+            'worker_class': 'gthread',
+            'preload_app': True,
+            # Queued write-behind audit rows and the latest metrics are written before a worker exits
+            'worker_exit': lambda arbiter, worker: (flush_audit(), flush_metrics()),
+        })
+    except ImportError:
+        # gunicorn needs fork(); elsewhere (Windows) fall back to one threaded process
+        from werkzeug.serving import run_simple
+        logger.warning("gunicorn is not installed, serving from a single process with threads")
+        run_simple(host, port, app, threaded=True)
+        return
+    application.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the restaurant app with several worker processes")
+    parser.add_argument('--host', default=os.environ.get('SERVER_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=get_setting('SERVER_PORT'))
+    parser.add_argument('--workers', type=int, default=get_setting('SERVER_WORKERS') or os.cpu_count() or 1,
+                        help="Worker processes, default one per CPU core")
+    parser.add_argument('--threads', type=int, default=get_setting('SERVER_THREADS'),
+                        help="Threads per worker")
+    parser.add_argument('--database', help="Database file, default DATABASE_PATH or inventory.db")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    serve(args.host, args.port, args.workers, args.threads, args.database)
+
+
+if __name__ == '__main__':
+    main()
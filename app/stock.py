@@ -0,0 +1,260 @@
+from datetime import datetime
+
+from db import bump_change_counter, get_db_connection, get_setting
+from menu_cache import menu_cache
+from live_events import publish_stock
+
+# stock_levels keeps one row per menu item with the sum of all its movements,
+# so reading current stock never has to scan the movements history. Every
+# write to it bumps the 'stock' change counter.
+STOCK_DOMAIN = 'stock'
+
+UPSERT_STOCK_LEVEL = '''
+    INSERT INTO stock_levels (menu_item_id, current_stock, movements_since_checkpoint, updated_at)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (menu_item_id) DO UPDATE SET
+        current_stock = current_stock + excluded.current_stock,
+        movements_since_checkpoint = movements_since_checkpoint + excluded.movements_since_checkpoint,
+        updated_at = excluded.updated_at
+'''
+
+# stock_checkpoints stores the balance of an item right after one of its
+# movements. They are written every STOCK_CHECKPOINT_INTERVAL movements of an
+# item and by the daily checkpoint-stock command, so the balance at any moment
+# is the closest earlier checkpoint plus a short tail of movements.
+CREATE_DUE_CHECKPOINTS = '''
+    INSERT INTO stock_checkpoints (menu_item_id, movement_id, checkpoint_date, balance)
+    SELECT  sl.menu_item_id,
+            last_movement.id,
+            last_movement.date,
+            sl.current_stock
+    FROM stock_levels sl
+    JOIN movements last_movement ON last_movement.id = (
+        SELECT MAX(id) FROM movements WHERE menu_item_id = sl.menu_item_id
+    )
+    WHERE sl.movements_since_checkpoint >= ?{items}
+'''
+
+
+def update_stock_levels(conn, changes):
+    """Apply (menu_item_id, quantity_change, movement_count) to stock_levels.
+
+    Must be called on the same connection, and before the commit, as the
+    movements INSERT so both land in one transaction.
+    """
+    now = datetime.now()
+    conn.executemany(UPSERT_STOCK_LEVEL,
+                     [(menu_item_id, quantity_change, movement_count, now)
+                      for menu_item_id, quantity_change, movement_count in changes])
+
+
+def create_stock_checkpoints(conn, min_movements=1, menu_item_ids=None):
+    """Checkpoint every item with at least min_movements since its last one.
+
+    menu_item_ids limits it to those items, so a write only looks up the
+    stock_levels rows of the items it moved.
+    """
+    items, parameters = '', [min_movements]
+    if menu_item_ids is not None:
+        items = f" AND sl.menu_item_id IN ({', '.join('?' * len(menu_item_ids))})"
+        parameters += menu_item_ids
+    cursor = conn.execute(CREATE_DUE_CHECKPOINTS.format(items=items), parameters)
+    if cursor.rowcount:
+        conn.execute(f'''
+            UPDATE stock_levels AS sl SET movements_since_checkpoint = 0
+            WHERE sl.movements_since_checkpoint >= ?{items}
+        ''', parameters)
+    return cursor.rowcount
+
+
+def movement_type_for(quantity_change):
+    """Type of a manual movement, from the sign of its quantity"""
+    if quantity_change > 0:
+        return 'Entrada'
+    if quantity_change < 0:
+        return 'Salida'
+    return 'Comentario'
+
+
+def insert_movements(conn, movements, date=None):
+    """Insert movements with their running partial_stock in one executemany.
+
+    movements is a list of (menu_item_id, menu_item_name, quantity_change,
+    movement_type, notes) tuples; several movements for the same item keep a
+    correct running total. stock_levels is updated first: that write takes
+    the database write lock, so the levels read back right after it cannot
+    change under us until the caller commits, whichever process or thread
+    writes next. partial_stock is counted back from them. Checkpoints and the
+    live stock events are updated in the same transaction.
+    """
+    date = date or datetime.now()
+    changes = {}
+    movement_counts = {}
+    for menu_item_id, _, quantity_change, _, _ in movements:
+        changes[menu_item_id] = changes.get(menu_item_id, 0) + quantity_change
+        movement_counts[menu_item_id] = movement_counts.get(menu_item_id, 0) + 1
+    if not movements:
+        return
+
+    update_stock_levels(conn, [(menu_item_id, changes[menu_item_id], count)
+                               for menu_item_id, count in movement_counts.items()])
+    item_ids = list(movement_counts)
+    placeholders = ', '.join('?' * len(item_ids))
+    levels = dict(conn.execute(f'''
+        SELECT menu_item_id, current_stock FROM stock_levels
+        WHERE menu_item_id IN ({placeholders})
+    ''', item_ids).fetchall())
+
+    # Stock before this batch, then the running total through it
+    running_stock = {menu_item_id: levels[menu_item_id] - change for menu_item_id, change in changes.items()}
+    rows = []
+    for menu_item_id, menu_item_name, quantity_change, movement_type, notes in movements:
+        running_stock[menu_item_id] += quantity_change
+        rows.append((menu_item_id, menu_item_name, quantity_change, movement_type, notes, date,
+                     running_stock[menu_item_id]))
+    conn.executemany('''
+        INSERT INTO movements (menu_item_id, menu_item_name, quantity_change, movement_type, notes, date, partial_stock)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    create_stock_checkpoints(conn, get_setting('STOCK_CHECKPOINT_INTERVAL'), item_ids)
+    publish_stock(conn, item_ids)
+    bump_change_counter(conn, STOCK_DOMAIN)
+
+
+def get_stock_at(conn, menu_item_id, at):
+    """Stock of an item counting every movement dated strictly before `at`.
+
+    Starts from the latest checkpoint before `at` and adds the movements
+    between it and the next checkpoint, so at most one checkpoint interval of
+    movements is read.
+    """
+    previous = conn.execute('''
+        SELECT movement_id, balance
+        FROM stock_checkpoints
+        WHERE menu_item_id = ? AND checkpoint_date < ?
+        ORDER BY checkpoint_date DESC, movement_id DESC
+        LIMIT 1
+    ''', (menu_item_id, at)).fetchone()
+    following = conn.execute('''
+        SELECT movement_id
+        FROM stock_checkpoints
+        WHERE menu_item_id = ? AND checkpoint_date >= ?
+        ORDER BY checkpoint_date, movement_id
+        LIMIT 1
+    ''', (menu_item_id, at)).fetchone()
+
+    tail = conn.execute('''
+        SELECT COALESCE(SUM(quantity_change), 0) AS total
+        FROM movements
+        WHERE menu_item_id = ? AND id > ? AND id <= ? AND date < ?
+    ''', (menu_item_id,
+          previous['movement_id'] if previous else 0,
+          following['movement_id'] if following else 2 ** 63 - 1,
+          at)).fetchone()
+
+    return (previous['balance'] if previous else 0) + tail['total']
+
+
+def get_stock_ranges(conn, menu_item_ids, start, end):
+    """Opening and closing stock of several items for the window [start, end).
+
+    The same checkpoint-plus-tail sum as get_stock_at, done for every item
+    and both ends of the window in one statement. Returns a dict keyed by
+    menu_item_id.
+    """
+    ranges = {menu_item_id: {'menu_item_id': menu_item_id, 'opening_stock': 0, 'closing_stock': 0}
+              for menu_item_id in menu_item_ids}
+    if not ranges:
+        return ranges
+    items = ', '.join(['(?)'] * len(ranges))
+    rows = conn.execute(f'''
+        WITH items(menu_item_id) AS (VALUES {items}),
+        moments(kind, at) AS (VALUES ('opening_stock', ?), ('closing_stock', ?)),
+        bounds AS (
+            SELECT  i.menu_item_id,
+                    m.kind,
+                    m.at,
+                    (SELECT c.id FROM stock_checkpoints c
+                     WHERE c.menu_item_id = i.menu_item_id AND c.checkpoint_date < m.at
+                     ORDER BY c.checkpoint_date DESC, c.movement_id DESC
+                     LIMIT 1) AS previous_checkpoint,
+                    (SELECT c.movement_id FROM stock_checkpoints c
+                     WHERE c.menu_item_id = i.menu_item_id AND c.checkpoint_date >= m.at
+                     ORDER BY c.checkpoint_date, c.movement_id
+                     LIMIT 1) AS following_movement
+            FROM items i CROSS JOIN moments m
+        )
+        SELECT  b.menu_item_id,
+                b.kind,
+                COALESCE(p.balance, 0) + (
+                    SELECT COALESCE(SUM(mv.quantity_change), 0)
+                    FROM movements mv
+                    WHERE mv.menu_item_id = b.menu_item_id
+                      AND mv.id > COALESCE(p.movement_id, 0)
+                      AND mv.id <= COALESCE(b.following_movement, 9223372036854775807)
+                      AND mv.date < b.at
+                ) AS stock
+        FROM bounds b
+        LEFT JOIN stock_checkpoints p ON p.id = b.previous_checkpoint
+    ''', [*ranges, start, end]).fetchall()
+    for row in rows:
+        ranges[row['menu_item_id']][row['kind']] = row['stock']
+    return ranges
+
+
+def get_stock_range(conn, menu_item_id, start, end):
+    """Opening and closing stock of an item for the window [start, end)"""
+    return get_stock_ranges(conn, [menu_item_id], start, end)[menu_item_id]
+
+
+def get_stock_levels(conn):
+    """Current stock of every stockable menu item, ordered by name"""
+    levels = dict(conn.execute('SELECT menu_item_id, current_stock FROM stock_levels').fetchall())
+    return [{
+        'id': item['id'],
+        'name': item['name'],
+        'current_stock': levels.get(item['id'], 0),
+    } for item in menu_cache.stockable(conn)]
+
+
+def rebuild_stock_levels(DATABASE=None, conn=None):
+    """Recompute stock_levels and stock_checkpoints from the movements history"""
+    own_connection = conn is None
+    if own_connection:
+        conn = get_db_connection(DATABASE)
+
+    interval = get_setting('STOCK_CHECKPOINT_INTERVAL')
+    now = datetime.now()
+
+    conn.execute('DELETE FROM stock_levels')
+    cursor = conn.execute('''
+        INSERT INTO stock_levels (menu_item_id, current_stock, movements_since_checkpoint, updated_at)
+        SELECT menu_item_id, SUM(quantity_change), COUNT(*) % ?, ?
+        FROM movements
+        WHERE menu_item_id IS NOT NULL
+        GROUP BY menu_item_id
+    ''', (interval, now))
+    rebuilt = cursor.rowcount
+
+    # One checkpoint every `interval` movements of each item
+    conn.execute('DELETE FROM stock_checkpoints')
+    conn.execute('''
+        INSERT INTO stock_checkpoints (menu_item_id, movement_id, checkpoint_date, balance)
+        SELECT menu_item_id, id, date, running_stock
+        FROM (
+            SELECT  id,
+                    menu_item_id,
+                    date,
+                    SUM(quantity_change) OVER (PARTITION BY menu_item_id ORDER BY id) AS running_stock,
+                    ROW_NUMBER() OVER (PARTITION BY menu_item_id ORDER BY id) AS position
+            FROM movements
+            WHERE menu_item_id IS NOT NULL
+        )
+        WHERE position % ? = 0
+    ''', (interval,))
+    bump_change_counter(conn, STOCK_DOMAIN)
+
+    if own_connection:
+        conn.commit()
+        conn.close()
+    return rebuilt
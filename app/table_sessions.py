@@ -0,0 +1,133 @@
+from db import bump_change_counter
+from live_events import publish_table
+
+# A table session is an open order sitting on a restaurant table. The table
+# row moves between two states:
+#
+#   available --open--> in use (open_order_number = the order)
+#   in use --close--> available
+#   in use on A --transfer to B--> A available, B in use
+#
+# Each transition is a conditional statement whose WHERE clause requires the
+# state it starts from, and its rowcount says whether it happened: of two
+# waiters opening the same table, or closing the same order, exactly one
+# wins and the other gets TableConflictError. The first of those statements
+# is the transaction's first write, which takes SQLite's write lock, so the
+# statements after it in the same transaction cannot be raced either.
+# Every transition is announced on the tables channel and bumps the tables
+# change counter; the caller commits.
+
+TABLES_DOMAIN = 'tables'
+
+AVAILABLE = 'available'
+IN_USE = 'in use'
+
+
+class TableError(Exception):
+    """The transition cannot be applied"""
+
+
+class TableNotFoundError(TableError):
+    """The table does not exist"""
+
+
+class TableConflictError(TableError):
+    """The table or order is not in the state the transition starts from"""
+
+
+def _changed(conn, table_number, status, customer_name=None, order_id=None):
+    publish_table(conn, table_number, status, customer_name, order_id)
+    bump_change_counter(conn, TABLES_DOMAIN)
+
+
+def _unavailable(conn, table_number):
+    """The error for a table that could not be taken"""
+    table = conn.execute('SELECT open_order_number FROM restaurant_tables WHERE table_number = ?',
+                         (table_number,)).fetchone()
+    if table is None:
+        return TableNotFoundError(f"Table {table_number} not found")
+    return TableConflictError(f"Table {table_number} is in use by order {table['open_order_number']}")
+
+
+def open_table(conn, table_number, customer_name, opened_at):
+    """Open an order on an available table; returns the order id"""
+    cursor = conn.execute('''
+        INSERT INTO orders (table_id, customer_name, created_at, status)
+        SELECT table_number, ?, ?, 'active'
+        FROM restaurant_tables
+        WHERE table_number = ? AND status = 'available'
+    ''', (customer_name, opened_at, table_number))
+    if cursor.rowcount == 0:
+        raise _unavailable(conn, table_number)
+    order_id = cursor.lastrowid
+
+    conn.execute('''
+        UPDATE restaurant_tables
+        SET status = 'in use', customer_name = ?, open_order_number = ?
+        WHERE table_number = ? AND status = 'available'
+    ''', (customer_name, order_id, table_number))
+    _changed(conn, table_number, IN_USE, customer_name, order_id)
+    return order_id
+
+
+def close_table(conn, order_id, closed_at):
+    """Mark an active order closed and free its table; returns the table number"""
+    cursor = conn.execute('''
+        UPDATE orders SET status = 'closed', closed_at = ?
+        WHERE id = ? AND status = 'active'
+    ''', (closed_at, order_id))
+    if cursor.rowcount == 0:
+        raise TableConflictError(f"Order {order_id} is already closed")
+    # Read under the write lock: a transfer cannot move the order any more
+    table_number = conn.execute('SELECT table_id FROM orders WHERE id = ?', (order_id,)).fetchone()['table_id']
+
+    cursor = conn.execute('''
+        UPDATE restaurant_tables
+        SET status = 'available', open_order_number = NULL
+        WHERE table_number = ? AND open_order_number = ? AND status = 'in use'
+    ''', (table_number, order_id))
+    if cursor.rowcount:
+        _changed(conn, table_number, AVAILABLE)
+    return table_number
+
+
+def transfer_table(conn, order_id, customer_name, from_table, to_table):
+    """Move an active order from one table to an available one"""
+    cursor = conn.execute('''
+        UPDATE restaurant_tables
+        SET status = 'in use', customer_name = ?, open_order_number = ?
+        WHERE table_number = ? AND status = 'available'
+    ''', (customer_name, order_id, to_table))
+    if cursor.rowcount == 0:
+        raise _unavailable(conn, to_table)
+
+    cursor = conn.execute('''
+        UPDATE orders SET table_id = ?
+        WHERE id = ? AND table_id = ? AND status = 'active'
+    ''', (to_table, order_id, from_table))
+    if cursor.rowcount == 0:
+        raise TableConflictError(f"Order {order_id} is no longer open on table {from_table}")
+
+    cursor = conn.execute('''
+        UPDATE restaurant_tables
+        SET status = 'available', open_order_number = NULL
+        WHERE table_number = ? AND open_order_number = ? AND status = 'in use'
+    ''', (from_table, order_id))
+    if cursor.rowcount:
+        _changed(conn, from_table, AVAILABLE)
+    _changed(conn, to_table, IN_USE, customer_name, order_id)
+
+
+def get_floor(conn):
+    """Every table with its open order and when it was opened, in one query"""
+    return conn.execute('''
+        SELECT  t.table_number,
+                t.capacity,
+                t.status,
+                t.customer_name,
+                t.open_order_number,
+                o.created_at AS opened_at
+        FROM restaurant_tables t
+        LEFT JOIN orders o ON o.id = t.open_order_number
+        ORDER BY t.table_number
+    ''').fetchall()
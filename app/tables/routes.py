@@ -1,24 +1,21 @@
 from flask import render_template, request, redirect, url_for
 from . import tables_bp
-import sys
-import os
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils import get_db_connection
+from db import bump_change_counter
+from live_events import page_versions
+from conditional import conditional_get
+from table_sessions import TABLES_DOMAIN, get_floor
 
 # Table management routes
 @tables_bp.route('/')
+@conditional_get(TABLES_DOMAIN)
 def tables():
     conn = get_db_connection()
-    tables = conn.execute('''
-        SELECT  table_number,
-                capacity,
-                status,
-                customer_name,
-                open_order_number
-        FROM restaurant_tables
-    ''').fetchall()
+    # The floor view updates itself from the changes made after this version
+    versions = page_versions(conn, [TABLES_DOMAIN])
+    tables = get_floor(conn)
     conn.close()
-    return render_template('tables/index.html', tables=tables)
+    return render_template('tables/index.html', tables=tables, versions=versions)
 
 @tables_bp.route('/add', methods=('GET', 'POST'))
 def add_table():
@@ -29,6 +26,7 @@ def add_table():
         conn = get_db_connection()
         conn.execute('INSERT INTO restaurant_tables (table_number, capacity, status) VALUES (?, ?, ?)', 
                     (table_number, capacity, 'available'))
+        bump_change_counter(conn, TABLES_DOMAIN)
         conn.commit()
         conn.close()
         return redirect(url_for('tables.tables'))
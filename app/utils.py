@@ -1,164 +1,37 @@
-import sqlite3
-import os
-from datetime import datetime
+from datetime import datetime, timedelta
 
+from db import get_db_connection
+from migrations import apply_migrations
 
 
 
-def get_last_stock(menu_item_id: str):
-        conn = get_db_connection()
 
-        last_movement = conn.execute('''
-            select "partial_stock"
-            from movements
-            where "id" in (
-                SELECT max("id") "id"
-                FROM movements
-                where menu_item_id = ?
-            )''', (menu_item_id,)).fetchone()
-        
-        conn.close()
-        
-        if last_movement is None:
-            return 0
-        
-        return last_movement["partial_stock"] or 0 #TODO check why is giving None sometimes
-
-def get_db_connection(DATABASE = None):
-    if DATABASE is None:
-        # Check environment variable first, then fallback to default
-        DATABASE = os.environ.get('DATABASE_PATH', 
-                                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'inventory.db'))
-
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-# TODO: this logic should be updated, I need to save the partial changes
 def get_current_stock_for_menu_item(menu_item_id):
-    """Calculate current stock for a menu item based on movements"""
+    """Read current stock for a menu item from the stock_levels table"""
     conn = get_db_connection()
     result = conn.execute(
-        'SELECT SUM(quantity_change) as total FROM movements WHERE menu_item_id = ?', 
+        'SELECT current_stock FROM stock_levels WHERE menu_item_id = ?', 
         (menu_item_id,)
     ).fetchone()
     conn.close()
-    return result['total'] if result['total'] else 0
-
-def log_menu_audit(menu_item_id, action, old_values=None, new_values=None):
-    """Log menu item changes for audit trail"""
-    conn = get_db_connection()
-    conn.execute('''
-        INSERT INTO menu_audit (menu_item_id, action, old_values, new_values, timestamp, user_info)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (menu_item_id, action, old_values, new_values, datetime.now(), 'system'))
-    conn.commit()
-    conn.close()
+    return result['current_stock'] if result else 0
+
+def parse_date_window(args, default_days):
+    """Read date_from/date_to (YYYY-MM-DD, both inclusive) from a query string.
+
+    Defaults to the last `default_days` days. Returns the strings to show in
+    the form and the [start, end) datetimes. Raises ValueError for malformed
+    dates.
+    """
+    today = datetime.now().date()
+    date_from = args.get('date_from') or (today - timedelta(days=default_days - 1)).isoformat()
+    date_to = args.get('date_to') or today.isoformat()
+    start = datetime.strptime(date_from, '%Y-%m-%d')
+    end = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+    return date_from, date_to, start, end
 
 def init_database(DATABASE = None):
-    """Initialize database tables"""
+    """Initialize database tables, applying any pending migrations"""
     conn = get_db_connection(DATABASE)
-
-    # Movements tracking table
-    conn.execute('''CREATE TABLE IF NOT EXISTS movements (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        menu_item_id INTEGER,
-        menu_item_name TEXT NOT NULL,
-        quantity_change INTEGER NOT NULL,
-        movement_type TEXT NOT NULL,
-        notes TEXT,
-        partial_stock INTEGER, 
-        date DATETIME NOT NULL
-    )''')
-    
-    # Restaurant tables
-    conn.execute('''CREATE TABLE IF NOT EXISTS restaurant_tables (
-        table_number INTEGER NOT NULL UNIQUE,
-        capacity INTEGER NOT NULL,
-        status TEXT NOT NULL,
-        customer_name TEXT,
-        open_order_number INTEGER
-    )''')
-    
-    # Menu items (food and drinks)
-    conn.execute('''CREATE TABLE IF NOT EXISTS menu_items (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        description TEXT,
-        category TEXT NOT NULL,
-        price DECIMAL(10,2) NOT NULL,
-        stockable BOOLEAN DEFAULT 0
-    )''')
-    
-    # Customer orders
-    conn.execute('''CREATE TABLE IF NOT EXISTS orders (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        table_id INTEGER NOT NULL,
-        customer_name TEXT,
-        status TEXT NOT NULL,
-        created_at DATETIME NOT NULL,
-        closed_at DATETIME,
-        total_amount DECIMAL(10,2)
-    )''')
-    
-    # Individual items in an order
-    conn.execute('''CREATE TABLE IF NOT EXISTS order_items (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        order_id INTEGER NOT NULL,
-        menu_item_id INTEGER NOT NULL,
-        menu_item_name TEXT NOT NULL,
-        quantity INTEGER NOT NULL DEFAULT 1,
-        unit_price DECIMAL(10,2) NOT NULL,
-        notes TEXT,
-        FOREIGN KEY (order_id) REFERENCES orders (id),
-        FOREIGN KEY (menu_item_id) REFERENCES menu_items (id)
-    )''')
-
-    conn.execute('''CREATE TABLE IF NOT EXISTS manual_money_movements (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    payment_method TEXT NOT NULL,
-    description TEXT,
-    amount DECIMAL(10,2),
-    date DATETIME NOT NULL,
-    movement_type TEXT NOT NULL
-    )''')
-    
-    # Order payments - supports split payments
-    conn.execute('''CREATE TABLE IF NOT EXISTS order_payments (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        order_id INTEGER NOT NULL,
-        payment_method TEXT NOT NULL,
-        amount DECIMAL(10,2) NOT NULL,
-        notes TEXT,
-        created_at DATETIME NOT NULL,
-        FOREIGN KEY (order_id) REFERENCES orders (id)
-    )''')
-    
-    # Menu audit trail
-    conn.execute('''CREATE TABLE IF NOT EXISTS menu_audit (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        menu_item_id INTEGER,
-        action TEXT NOT NULL,
-        old_values TEXT,
-        new_values TEXT,
-        timestamp DATETIME NOT NULL,
-        user_info TEXT
-    )''')
-    
-    # Order item history - tracks all changes to order items
-    conn.execute('''CREATE TABLE IF NOT EXISTS order_item_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        order_id INTEGER NOT NULL,
-        menu_item_id INTEGER NOT NULL,
-        menu_item_name TEXT NOT NULL,
-        action TEXT NOT NULL,
-        quantity INTEGER,
-        unit_price DECIMAL(10,2),
-        notes TEXT,
-        timestamp DATETIME NOT NULL,
-        FOREIGN KEY (order_id) REFERENCES orders (id),
-        FOREIGN KEY (menu_item_id) REFERENCES menu_items (id)
-    )''')
-    
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    apply_migrations(conn)
+    conn.close()
@@ -0,0 +1,242 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from flask import current_app, jsonify, request
+
+from db import get_database_path, get_db_connection, get_setting
+
+# Short write transactions (adding or editing order lines, stock movements,
+# manual cash movements) can go through a single writer thread per database
+# instead of each request taking SQLite's write lock on its own:
+#
+# - WRITE_QUEUE=0 (default): run_write() runs the unit on the request
+#   connection and commits it, exactly like the routes used to.
+# - WRITE_QUEUE=1: run_write() queues the unit and waits. The writer takes
+#   whatever is queued (up to WRITE_QUEUE_BATCH_SIZE units), runs it all in
+#   one BEGIN IMMEDIATE transaction with a savepoint per unit, commits once
+#   and hands every caller its own result or exception. A unit that raises
+#   is rolled back to its savepoint (its on_commit callbacks too) without
+#   touching the others.
+#
+# A unit is a function taking the writer's connection; it must not commit.
+# A caller waits at most WRITE_QUEUE_TIMEOUT_MS for its unit to start; after
+# that the unit is cancelled and WriteQueueBusyError answers 503 with
+# Retry-After, instead of a "database is locked" error. Each worker process
+# has its own writer, so with several workers the writers still share the
+# lock, but one transaction per batch instead of one per request.
+
+logger = logging.getLogger(__name__)
+
+
+class WriteQueueBusyError(Exception):
+    """The write could not be started in time; nothing was written.
+
+    Also raised, with a different message, for a write that started but
+    whose batch did not finish in time: that one may still be committed.
+    """
+
+
+class WriteQueueStats:
+    """Units, batches and waits of the writer threads of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def add_batch(self, units, wait_seconds):
+        with self._lock:
+            self.batches += 1
+            self.units += units
+            self.wait_seconds += wait_seconds
+
+    def add_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def add_busy(self):
+        with self._lock:
+            self.busy += 1
+
+    def reset(self):
+        with self._lock:
+            self.batches = 0
+            self.units = 0
+            self.wait_seconds = 0.0
+            self.timeouts = 0
+            self.busy = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {'batches': self.batches, 'units': self.units, 'wait_seconds': self.wait_seconds,
+                    'timeouts': self.timeouts, 'busy': self.busy}
+
+
+write_queue_stats = WriteQueueStats()
+
+
+class WriteUnit:
+    def __init__(self, function):
+        self.function = function
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+
+class DatabaseWriter:
+    """Background thread that group-commits write units for one database file"""
+
+    def __init__(self, app, database, batch_size, max_size):
+        self.app = app
+        self.database = database
+        self.batch_size = batch_size
+        self._queue = queue.Queue(max_size)
+        self._thread = threading.Thread(target=self._run, name='database-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, function, timeout, running_timeout):
+        """Run function(conn) in the next batch and return its result.
+
+        Waits `timeout` seconds for the unit to start, then at most
+        `running_timeout` more for its batch to finish.
+        """
+        unit = WriteUnit(function)
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(unit, timeout=timeout)
+        except queue.Full:
+            write_queue_stats.add_timeout()
+            raise WriteQueueBusyError("Too many writes waiting, try again")
+        try:
+            return unit.future.result(max(deadline - time.monotonic(), 0))
+        except FutureTimeoutError:
+            if unit.future.cancel():
+                write_queue_stats.add_timeout()
+                raise WriteQueueBusyError("The write could not be started in time, try again")
+        # Already running: its batch finishes within the busy timeout
+        try:
+            return unit.future.result(running_timeout)
+        except FutureTimeoutError:
+            write_queue_stats.add_timeout()
+            logger.error("Write unit still running after %.1f s", running_timeout)
+            raise WriteQueueBusyError("The write did not finish in time, check before retrying")
+
+    def _run(self):
+        while True:
+            units = [self._queue.get()]
+            while len(units) < self.batch_size:
+                try:
+                    units.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Callers that gave up are skipped
+            units = [unit for unit in units if unit.future.set_running_or_notify_cancel()]
+            if not units:
+                continue
+            try:
+                # The units see the app's settings, as they would in the request
+                with self.app.app_context():
+                    self._write(units)
+            except Exception as error:
+                # Keep the thread alive for the next batch; nobody may be left waiting
+                logger.exception("Write batch of %d units failed", len(units))
+                for unit in units:
+                    if not unit.future.done():
+                        unit.future.set_exception(error)
+
+    def _write(self, units):
+        started = time.perf_counter()
+        write_queue_stats.add_batch(len(units), sum(started - unit.queued_at for unit in units))
+
+        results = []
+        conn = None
+        try:
+            conn = get_db_connection(self.database)
+            conn.execute('BEGIN IMMEDIATE')
+            for unit in units:
+                callbacks = len(conn._on_commit)
+                conn.execute('SAVEPOINT write_unit')
+                try:
+                    results.append((unit, unit.function(conn), None))
+                except Exception as error:
+                    conn.execute('ROLLBACK TO write_unit')
+                    del conn._on_commit[callbacks:]
+                    results.append((unit, None, error))
+                conn.execute('RELEASE write_unit')
+            conn.commit()
+        except Exception as error:
+            if conn is not None and conn.in_transaction:
+                conn.rollback()
+            if isinstance(error, sqlite3.OperationalError) and 'locked' in str(error):
+                write_queue_stats.add_busy()
+                error = WriteQueueBusyError("The database is busy, try again")
+            else:
+                logger.exception("Write batch of %d units failed", len(units))
+            for unit in units:
+                unit.future.set_exception(error)
+            return
+        finally:
+            if conn is not None:
+                conn.close()
+
+        for unit, result, error in results:
+            if error is None:
+                unit.future.set_result(result)
+            else:
+                unit.future.set_exception(error)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(database):
+    writer = _writers.get(database)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(database)
+            if writer is None:
+                writer = DatabaseWriter(current_app._get_current_object(), database,
+                                        get_setting('WRITE_QUEUE_BATCH_SIZE'), get_setting('WRITE_QUEUE_MAX_SIZE'))
+                _writers[database] = writer
+    return writer
+
+
+def run_write(function):
+    """Run function(conn) in a committed write transaction and return its result.
+
+    Call it from a request with no write of its own pending. If the unit
+    raises, nothing it wrote is kept and the exception reaches the caller.
+    """
+    if get_setting('WRITE_QUEUE'):
+        timeout = get_setting('WRITE_QUEUE_TIMEOUT_MS') / 1000
+        # A started batch waits at most the busy timeout for the lock, then runs short units
+        running_timeout = timeout + get_setting('SQLITE_BUSY_TIMEOUT_MS') / 1000
+        return get_writer(get_database_path()).submit(function, timeout, running_timeout)
+
+    conn = get_db_connection()
+    try:
+        result = function(conn)
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+    return result
+
+
+def write_queue_busy(error):
+    """Error handler: 503 with Retry-After, JSON for the API"""
+    if request.blueprint == 'api':
+        response = jsonify(error=str(error))
+    else:
+        response = current_app.make_response(f"Error: {error}")
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+def register_write_queue(app):
+    """Answer WriteQueueBusyError with 503 on app"""
+    app.register_error_handler(WriteQueueBusyError, write_queue_busy)
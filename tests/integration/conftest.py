@@ -0,0 +1,52 @@
+"""
+Fixtures shared by the integration tests: a fresh database file per test,
+the small restaurant most tests start from, and apps built on it.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from utils import get_db_connection, init_database
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Path of a fresh, migrated database.
+
+    Also set as DATABASE_PATH, so the module-level app and worker processes
+    started by a test use it too.
+    """
+    database = str(tmp_path / 'restaurant.db')
+    monkeypatch.setenv('DATABASE_PATH', database)
+    init_database(database)
+    return database
+
+
+@pytest.fixture
+def restaurant(database):
+    """The database with a stockable Pizza (menu item 1) and tables 1 to 3"""
+    conn = get_db_connection(database)
+    conn.execute("INSERT INTO menu_items (name, description, category, price, stockable) VALUES ('Pizza', '', 'food', 10, 1)")
+    conn.executemany("INSERT INTO restaurant_tables (table_number, capacity, status) VALUES (?, 4, 'available')",
+                     [(1,), (2,), (3,)])
+    conn.commit()
+    conn.close()
+    return database
+
+
+@pytest.fixture
+def make_app(restaurant):
+    """Build an app on the restaurant database with extra config settings"""
+    from app import create_app
+
+    def make(**config):
+        return create_app({'DATABASE_PATH': restaurant, **config})
+    return make
+
+
+@pytest.fixture
+def client(make_app):
+    return make_app().test_client()
@@ -34,11 +34,13 @@ def delete_database():
     if not DATABASE:
         assert False, "DATABASE_PATH environment variable not set"
 
-    if os.path.exists(DATABASE):
-        try:
-            os.remove(DATABASE)
-        except OSError as e:
-            pass
+    # WAL mode leaves -wal and -shm files next to the database
+    for path in (DATABASE, DATABASE + "-wal", DATABASE + "-shm"):
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                pass
         
 
 
@@ -431,20 +433,20 @@ class RestaurantTester:
         
         conn = get_db_connection()
         history = conn.execute("""
-            SELECT oih.*, mi.name
-            FROM order_item_history oih
-            JOIN menu_items mi ON oih.menu_item_id = mi.id
-            WHERE oih.order_id = ?
-            ORDER BY oih.timestamp
+            SELECT oie.*, mi.name
+            FROM order_item_events oie
+            JOIN menu_items mi ON oie.menu_item_id = mi.id
+            WHERE oie.order_id = ?
+            ORDER BY oie.timestamp
         """, (self.database_status['order_id'],)).fetchall()
         
         assert len(history) == 2, f"Expected 2 history entries, got {len(history)}"
         self.log(f"   Order history has {len(history)} entries:")
         for entry in history:
-            self.log(f"   - {entry['timestamp'][:19]}: {entry['action']} {entry['name']} (qty: {entry['quantity']})")
+            self.log(f"   - {entry['timestamp'][:19]}: {entry['event']} {entry['name']} (qty: {entry['quantity']})")
             
         # Should have 2 'added' entries (pizza and service)
-        added_entries = [h for h in history if h['action'] == 'added']
+        added_entries = [h for h in history if h['event'] == 'added']
         assert len(added_entries) == 2, f"Expected 2 'added' entries, found {len(added_entries)}"
         
         # Verify specific entries
@@ -455,8 +457,8 @@ class RestaurantTester:
         assert service_entry is not None, "Service history entry not found"
         assert pizza_entry['quantity'] == 3, f"Expected pizza history quantity 3, got {pizza_entry['quantity']}"
         assert service_entry['quantity'] == 1, f"Expected service history quantity 1, got {service_entry['quantity']}"
-        assert pizza_entry['action'] == 'added', f"Expected pizza action 'added', got {pizza_entry['action']}"
-        assert service_entry['action'] == 'added', f"Expected service action 'added', got {service_entry['action']}"
+        assert pizza_entry['event'] == 'added', f"Expected pizza event 'added', got {pizza_entry['event']}"
+        assert service_entry['event'] == 'added', f"Expected service event 'added', got {service_entry['event']}"
         
         self.log("✅ Correct number of 'added' history entries")
         self.log("✅ History entries contain correct data")
@@ -536,10 +538,12 @@ class RestaurantTester:
         
         # Check order history for edit
         edit_history = conn.execute(
-            "SELECT * FROM order_item_history WHERE order_id = ? AND action IN ('old_edited', 'new_edited')", 
-            (second_order_id,)
+            "SELECT * FROM order_item_events WHERE order_item_id = ? AND event = 'edited'", 
+            (item_id,)
         ).fetchall()
-        assert len(edit_history) >= 2, "Expected old_edited and new_edited history entries"
+        assert len(edit_history) == 1, "Expected one edited history entry"
+        assert edit_history[0]['quantity'] == 3, "Edited quantity was not recorded"
+        assert edit_history[0]['notes'] == 'Changed to extra cheese', "Edited notes were not recorded"
         self.log("✅ Order item edit verified with history tracking")
         
         # Test POST /orders/<order_id>/items/<item_id>/remove
@@ -553,8 +557,8 @@ class RestaurantTester:
         
         # Check removal history
         removal_history = conn.execute(
-            "SELECT * FROM order_item_history WHERE order_id = ? AND action = 'removed'", 
-            (second_order_id,)
+            "SELECT * FROM order_item_events WHERE order_item_id = ? AND event = 'removed'", 
+            (item_id,)
         ).fetchall()
         assert len(removal_history) == 1, "Expected removal history entry"
         self.log("✅ Order item removal verified with history tracking")
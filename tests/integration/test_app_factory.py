@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+App factory tests: create_app(config) builds an app that serves its own
+DATABASE_PATH and whose settings come from `config`, not from the
+environment or the module-level app.
+
+    python -m pytest tests/integration/test_app_factory.py
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from utils import get_db_connection, init_database
+from db import get_database_path, get_setting
+from app import create_app
+
+
+def menu_names(database):
+    conn = get_db_connection(database)
+    names = [row['name'] for row in conn.execute('SELECT name FROM menu_items ORDER BY id')]
+    conn.close()
+    return names
+
+
+def test_each_app_serves_its_own_database(restaurant, tmp_path):
+    # restaurant is also DATABASE_PATH in the environment
+    other = str(tmp_path / 'other.db')
+    init_database(other)
+    app = create_app({'DATABASE_PATH': other})
+
+    import app as app_module
+    assert app is not app_module.app
+    with app.app_context():
+        assert get_database_path() == other
+
+    client = app.test_client()
+    assert client.post('/menu/add', data={'name': 'Cafe', 'category': 'drinks', 'price': '2'}).status_code == 302
+    assert 'Cafe' in client.get('/menu/').get_data(as_text=True)
+    assert menu_names(other) == ['Cafe']
+    assert menu_names(restaurant) == ['Pizza']
+
+
+def test_config_overrides_reach_get_setting(restaurant, monkeypatch):
+    monkeypatch.setenv('LIVE_EVENTS_KEEP', '7')
+    app = create_app({'DATABASE_PATH': restaurant, 'LIVE_EVENTS_KEEP': 3, 'CONDITIONAL_GET': 0})
+    plain = create_app({'DATABASE_PATH': restaurant})
+
+    with app.app_context():
+        assert get_setting('LIVE_EVENTS_KEEP') == 3
+        assert get_setting('CONDITIONAL_GET') == 0
+    with plain.app_context():
+        assert get_setting('LIVE_EVENTS_KEEP') == 7
+        assert get_setting('CONDITIONAL_GET') == 1
+
+    # And inside the app's requests: no ETag with CONDITIONAL_GET=0
+    assert 'ETag' not in app.test_client().get('/menu/').headers
+    assert 'ETag' in plain.test_client().get('/menu/').headers
+
+
+def test_disabled_metrics_are_not_served(restaurant):
+    app = create_app({'DATABASE_PATH': restaurant, 'METRICS_ENABLED': 0})
+    assert app.test_client().get('/metrics').status_code == 404
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Write-behind audit tests: the background writer outlives a batch it cannot
+write, and flush_audit() still returns instead of waiting for it forever.
+
+    python -m pytest tests/integration/test_audit.py
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+import audit
+from utils import get_db_connection
+
+
+def menu_audit_names(database):
+    conn = get_db_connection(database)
+    names = [row['new_values'] for row in conn.execute("SELECT new_values FROM menu_audit WHERE action = 'CREATE'")]
+    conn.close()
+    return names
+
+
+def flush_in_time():
+    flusher = threading.Thread(target=audit.flush_audit, daemon=True)
+    flusher.start()
+    flusher.join(3)
+    assert not flusher.is_alive(), "flush_audit() is still waiting for the writer"
+
+
+def test_writer_survives_a_failing_connection(make_app, restaurant, monkeypatch):
+    client = make_app(AUDIT_WRITE_BEHIND=1).test_client()
+    connect = audit.get_db_connection
+    failures = ['database is locked']
+
+    def flaky_connection(database):
+        if failures:
+            raise sqlite3.OperationalError(failures.pop())
+        return connect(database)
+
+    monkeypatch.setattr(audit, 'get_db_connection', flaky_connection)
+    client.post('/menu/add', data={'name': 'Lost', 'category': 'drinks', 'price': '2'})
+    flush_in_time()
+    assert not failures
+
+    client.post('/menu/add', data={'name': 'Kept', 'category': 'drinks', 'price': '2'})
+    flush_in_time()
+    [written] = menu_audit_names(restaurant)
+    assert 'Kept' in written
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-v"]))
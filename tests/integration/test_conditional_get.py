@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Conditional GET tests: the menu, tables, dashboard and caja pages answer 304
+to a matching If-None-Match or If-Modified-Since until a write bumps one of
+their change counters, and the render cache serves the same HTML without
+running the view.
+
+    python -m pytest tests/integration/test_conditional_get.py
+"""
+
+import os
+import re
+import sys
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from utils import get_db_connection
+
+PAGES = ['/', '/menu/', '/tables/', '/caja/']
+
+
+@pytest.fixture
+def client(make_app):
+    return make_app(RENDER_CACHE=1).test_client()
+
+
+def age_change_counters(database):
+    """Move every change a minute back, out of the current second"""
+    conn = get_db_connection(database)
+    conn.execute("UPDATE change_counters SET changed_at = datetime('now', '-1 minute')")
+    conn.commit()
+    conn.close()
+
+
+@pytest.mark.parametrize('page', PAGES)
+def test_unchanged_page_answers_304(client, restaurant, page):
+    age_change_counters(restaurant)
+    response = client.get(page)
+    assert response.status_code == 200
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    response = client.get(page, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+    response = client.get(page, headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+
+
+@pytest.mark.parametrize('page, write', [
+    ('/', lambda client: client.post('/movements/add', data={'menu_item_id': '1', 'item_name': 'Pizza',
+                                                             'quantity_change': '5', 'notes': ''})),
+    ('/', lambda client: client.post('/menu/edit/1', data={'name': 'Pizza grande', 'category': 'food',
+                                                           'price': '12', 'stockable': 'on'})),
+    ('/menu/', lambda client: client.post('/menu/add', data={'name': 'Cafe', 'category': 'drinks', 'price': '2'})),
+    ('/tables/', lambda client: client.post('/api/orders', json={'table_id': 1})),
+    ('/tables/', lambda client: client.post('/tables/add', data={'table_number': '4', 'capacity': '2'})),
+    ('/caja/', lambda client: client.post('/caja/modify_money', data={'amount': '100', 'description': 'Fondo',
+                                                                     'payment_method': 'Efectivo'})),
+])
+def test_write_changes_the_etag(client, page, write):
+    etag = client.get(page).headers['ETag']
+    assert write(client).status_code in (201, 302)
+
+    response = client.get(page, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_render_cache_serves_the_page_without_the_view(client):
+    first = client.get('/menu/')
+    conn = get_db_connection(client.application.config['DATABASE_PATH'])
+    # Behind the app's back: no counter bump, so the cached page is served
+    conn.execute("UPDATE menu_items SET name = 'Changed' WHERE id = 1")
+    conn.commit()
+    conn.close()
+
+    second = client.get('/menu/')
+    assert second.status_code == 200
+    assert second.data == first.data
+    assert second.headers['ETag'] == first.headers['ETag']
+
+
+def test_last_modified_never_hides_a_write_in_the_same_second(client, restaurant):
+    age_change_counters(restaurant)
+    assert 'Last-Modified' in client.get('/menu/').headers
+
+    for number in range(5):
+        client.post('/menu/add', data={'name': f'Cafe {number}', 'category': 'drinks', 'price': '2'})
+        last_modified = client.get('/menu/').headers.get('Last-Modified')
+        # Only sent once its second is over, so no later write can share it
+        assert last_modified is None or parsedate_to_datetime(last_modified) < datetime.now(timezone.utc).replace(microsecond=0)
+        client.post('/menu/add', data={'name': f'Te {number}', 'category': 'drinks', 'price': '2'})
+        if last_modified is not None:
+            assert client.get('/menu/', headers={'If-Modified-Since': last_modified}).status_code == 200
+
+
+def stream_url(client, page):
+    """URL of the event stream the page opens"""
+    html = client.get(page).get_data(as_text=True)
+    return re.search(r'new EventSource\("([^"]+)"\)', html).group(1).replace('&amp;', '&')
+
+
+def first_message(client, url):
+    """First message after the retry line; the app must end streams at once"""
+    return client.get(url).get_data(as_text=True).split('\n\n')[1]
+
+
+def test_cached_page_stream_survives_pruned_events(make_app):
+    client = make_app(RENDER_CACHE=1, LIVE_EVENTS_KEEP=10, LIVE_EVENTS_STREAM_SECONDS=0).test_client()
+    etag = client.get('/').headers['ETag']
+    # Kitchen events push the event id the page was rendered at out of live_events
+    order_id = client.post('/api/orders', json={'table_id': 3}).get_json()['id']
+    for _ in range(25):
+        client.post(f'/api/orders/{order_id}/items', json={'items': [{'menu_item_id': 1}]})
+
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+    assert not first_message(client, stream_url(client, '/')).startswith('event: reset')
+
+
+def test_stream_resets_a_page_older_than_its_data(make_app):
+    client = make_app(LIVE_EVENTS_STREAM_SECONDS=0).test_client()
+    url = stream_url(client, '/')
+    # A stock change lands between the page and its stream
+    client.post('/movements/add', data={'menu_item_id': '1', 'item_name': 'Pizza', 'quantity_change': '5', 'notes': ''})
+    assert first_message(client, url).startswith('event: reset')
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Live event stream tests: a stream resumed after an event id (after= or the
+browser's Last-Event-ID header) sends exactly the later events of the
+channels it asked for, in order.
+
+    python -m pytest tests/integration/test_events.py
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from utils import get_db_connection
+from live_events import latest_event_id
+
+
+@pytest.fixture
+def client(make_app):
+    # Streams answer with what is there and end instead of waiting
+    return make_app(LIVE_EVENTS_STREAM_SECONDS=0).test_client()
+
+
+def messages(response):
+    """(id, event, data) of every message of an ended stream"""
+    parsed = []
+    for block in response.get_data(as_text=True).split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if ': ' in line)
+        if 'id' in fields:
+            parsed.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+    return parsed
+
+
+def make_changes(client, table_id):
+    """A tables, kitchen and stock event each"""
+    order_id = client.post('/api/orders', json={'table_id': table_id}).get_json()['id']
+    client.post(f'/api/orders/{order_id}/items', json={'items': [{'menu_item_id': 1}]})
+    client.post('/movements/add', data={'menu_item_id': '1', 'item_name': 'Pizza', 'quantity_change': '5', 'notes': ''})
+    return order_id
+
+
+def last_event_id(database):
+    conn = get_db_connection(database)
+    last_id = latest_event_id(conn)
+    conn.close()
+    return last_id
+
+
+@pytest.mark.parametrize('channels', [['tables', 'stock'], ['kitchen'], ['tables', 'stock', 'kitchen']])
+def test_resumed_stream_sends_only_later_events_of_its_channels(client, restaurant, channels):
+    make_changes(client, 1)
+    after = last_event_id(restaurant)
+    order_id = make_changes(client, 2)
+
+    sent = messages(client.get(f'/events/stream?channels={",".join(channels)}&after={after}'))
+    conn = get_db_connection(restaurant)
+    expected = [(row['id'], row['channel'], json.loads(row['payload'])) for row in conn.execute(f'''
+        SELECT id, channel, payload FROM live_events
+        WHERE id > ? AND channel IN ({", ".join("?" * len(channels))})
+        ORDER BY id
+    ''', (after, *channels))]
+    conn.close()
+
+    assert sent == expected
+    assert {event for _, event, _ in sent} == set(channels)
+    assert all(data.get('order_id', order_id) == order_id for _, event, data in sent if event != 'stock')
+
+
+def test_last_event_id_header_resumes_the_stream(client, restaurant):
+    make_changes(client, 1)
+    after = last_event_id(restaurant)
+    make_changes(client, 2)
+
+    # The browser's reconnect wins over the after= the page was opened with
+    sent = messages(client.get('/events/stream?channels=tables&after=0', headers={'Last-Event-ID': str(after)}))
+    assert [data['table'] for _, _, data in sent] == [2]
+    assert all(event_id > after for event_id, _, _ in sent)
+
+    assert messages(client.get(f'/events/stream?channels=tables&after={last_event_id(restaurant)}')) == []
+
+
+def test_stream_refuses_unknown_channels_and_ids(client):
+    assert client.get('/events/stream?channels=nope').status_code == 400
+    assert client.get('/events/stream?after=abc').status_code == 400
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-v"]))
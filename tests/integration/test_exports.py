@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Export tests: the CSV and JSONL exports carry a header (CSV) or one object
+per line (JSONL) with the table's columns, hold exactly the rows of the
+date window (both days inclusive) in date order, and are streamed in
+EXPORT_CHUNK_ROWS chunks rather than built in memory.
+
+    python -m pytest tests/integration/test_exports.py
+"""
+
+import csv
+import io
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from utils import get_db_connection
+
+ORDER_COLUMNS = ['id', 'table_id', 'customer_name', 'status', 'created_at', 'closed_at', 'total_amount']
+# (created_at, customer_name); the window below is May 2nd to May 4th
+ORDERS = [
+    ('2024-05-01 23:59:59', 'Before'),
+    ('2024-05-02 00:00:00', 'First'),
+    ('2024-05-02 13:30:00', 'Ana, "la de siempre"'),
+    ('2024-05-03 20:00:00', 'Niño'),
+    ('2024-05-04 12:00:00', 'Luis'),
+    ('2024-05-04 23:59:59', 'Last'),
+    ('2024-05-05 00:00:00', 'After'),
+]
+WINDOW = 'date_from=2024-05-02&date_to=2024-05-04'
+IN_WINDOW = ['First', 'Ana, "la de siempre"', 'Niño', 'Luis', 'Last']
+
+
+@pytest.fixture
+def client(make_app, restaurant):
+    conn = get_db_connection(restaurant)
+    # Inserted out of date order, so the export has to sort them
+    for created_at, customer_name in reversed(ORDERS):
+        order_id = conn.execute('''
+            INSERT INTO orders (table_id, customer_name, status, created_at) VALUES (1, ?, 'closed', ?)
+        ''', (customer_name, created_at)).lastrowid
+        conn.execute('''
+            INSERT INTO order_items (order_id, menu_item_id, menu_item_name, quantity, unit_price, notes)
+            VALUES (?, 1, 'Pizza', 1, 10, ?)
+        ''', (order_id, customer_name))
+    conn.commit()
+    conn.close()
+    return make_app(EXPORT_CHUNK_ROWS=2).test_client()
+
+
+def test_csv_export_has_the_window_in_date_order(client):
+    response = client.get(f'/exports/orders.csv?{WINDOW}')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'] == 'attachment; filename="orders_2024-05-02_2024-05-04.csv"'
+
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == ORDER_COLUMNS
+    assert [row[ORDER_COLUMNS.index('customer_name')] for row in rows[1:]] == IN_WINDOW
+
+
+def test_jsonl_export_has_one_object_per_row(client):
+    response = client.get(f'/exports/order_items.jsonl?{WINDOW}')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+
+    lines = response.get_data(as_text=True).splitlines()
+    items = [json.loads(line) for line in lines]
+    assert [item['notes'] for item in items] == IN_WINDOW
+    assert set(items[0]) >= {'id', 'order_id', 'menu_item_id', 'quantity', 'unit_price', 'notes'}
+    assert items[0]['quantity'] == 1
+
+
+def test_export_is_streamed_in_chunks(client):
+    response = client.get(f'/exports/orders.csv?{WINDOW}', buffered=False)
+    assert response.is_streamed
+    chunks = [chunk.decode() for chunk in response.response]
+    response.close()
+    # The header, then EXPORT_CHUNK_ROWS rows at a time
+    assert [len(list(csv.reader(io.StringIO(chunk)))) for chunk in chunks] == [1, 2, 2, 1]
+
+
+def test_unknown_export_or_dates_are_refused(client):
+    assert client.get('/exports/orders.xml').status_code == 404
+    assert client.get('/exports/secrets.csv').status_code == 404
+    assert client.get('/exports/orders.csv?date_from=2024-13-01').status_code == 400
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-v"]))
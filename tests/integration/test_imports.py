@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+CSV import tests: a file with any bad row is rejected as a whole with one
+error per bad line, and a delivery that repeats items records a running
+partial_stock for each of them.
+
+    python -m pytest tests/integration/test_imports.py
+"""
+
+import io
+import os
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from utils import get_db_connection
+from imports import CsvImportError, parse_menu_csv
+
+
+def upload(client, url, text):
+    return client.post(url, data={'file': (io.BytesIO(text.encode()), 'import.csv')})
+
+
+def count(database, table):
+    conn = get_db_connection(database)
+    rows = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    conn.close()
+    return rows
+
+
+def test_row_with_too_many_fields_is_a_line_error():
+    with pytest.raises(CsvImportError) as error:
+        parse_menu_csv('name,category,price\nTea,drink,2,extra\nCafe,drink,1.5\n')
+    assert error.value.errors == [(2, 'too many fields, expected 3')]
+
+
+@pytest.mark.parametrize('text, bad_lines', [
+    ('name,description,category,price,stockable\n'
+     'Tea,Black, with milk,drink,2,no\n'
+     'Cafe,,drink,abc,no\n'
+     'Agua,,drink,1,maybe\n'
+     'Jugo,,drink,3,yes\n', [2, 3, 4]),
+    ('name,category,price\n,food,3\nSopa,,4\n', [2, 3]),
+])
+def test_menu_import_is_all_or_nothing(client, restaurant, text, bad_lines):
+    response = upload(client, '/menu/import', text)
+    assert response.status_code == 400
+    assert [int(line) for line in re.findall(r'Línea (\d+):', response.get_data(as_text=True))] == bad_lines
+    assert count(restaurant, 'menu_items') == 1
+
+
+def test_movements_import_is_all_or_nothing(client, restaurant):
+    response = upload(client, '/movements/import',
+                      'menu_item_id,quantity_change,notes\n1,10,caja\n99,5,\n1,x,\n1,2,a,b\n')
+    assert response.status_code == 400
+    assert [int(line) for line in re.findall(r'Línea (\d+):', response.get_data(as_text=True))] == [3, 4, 5]
+    assert count(restaurant, 'movements') == 0
+
+
+def test_delivery_keeps_a_running_partial_stock(client, restaurant):
+    assert upload(client, '/menu/import', 'name,category,price,stockable\nCafe,drink,2,yes\n').status_code == 302
+    client.post('/movements/add', data={'menu_item_id': '1', 'item_name': 'Pizza', 'quantity_change': '4', 'notes': ''})
+
+    response = upload(client, '/movements/import', 'menu_item_id,menu_item_name,quantity_change,notes\n'
+                                                   '1,,10,a\n,Cafe,6,b\n1,,-3,c\n2,,2,d\n1,,5,e\n')
+    assert response.status_code == 302
+
+    conn = get_db_connection(restaurant)
+    movements = [(row['menu_item_id'], row['quantity_change'], row['partial_stock'])
+                 for row in conn.execute('SELECT * FROM movements ORDER BY id')]
+    levels = dict(conn.execute('SELECT menu_item_id, current_stock FROM stock_levels').fetchall())
+    conn.close()
+    assert movements == [(1, 4, 4), (1, 10, 14), (2, 6, 6), (1, -3, 11), (2, 2, 8), (1, 5, 16)]
+    assert levels == {1: 16, 2: 8}
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-v"]))
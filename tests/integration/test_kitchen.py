@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Kitchen queue tests: status changes along pending -> preparing -> ready ->
+served, refusal of unknown statuses and of lines that left the queue, and
+the tickets (and kitchen events) moved by closing or transferring an order.
+
+    python -m pytest tests/integration/test_kitchen.py
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from utils import get_db_connection
+
+
+def open_order(client, table_id=1, lines=2):
+    order_id = client.post('/api/orders', json={'table_id': table_id}).get_json()['id']
+    client.post(f'/api/orders/{order_id}/items', json={'items': [{'menu_item_id': 1}] * lines})
+    return order_id
+
+
+def tickets(client):
+    return {ticket['id']: ticket for ticket in client.get('/api/kitchen/tickets').get_json()['tickets']}
+
+
+def kitchen_events(database, after=0):
+    conn = get_db_connection(database)
+    events = [json.loads(row['payload']) for row in conn.execute(
+        "SELECT payload FROM live_events WHERE channel = 'kitchen' AND id > ? ORDER BY id", (after,))]
+    conn.close()
+    return events
+
+
+def last_event_id(client):
+    return client.get('/api/kitchen/tickets').get_json()['last_event_id']
+
+
+def kitchen_status(database, line_id):
+    conn = get_db_connection(database)
+    status = conn.execute('SELECT kitchen_status FROM order_items WHERE id = ?', (line_id,)).fetchone()[0]
+    conn.close()
+    return status
+
+
+def test_line_moves_along_the_queue(client, restaurant):
+    open_order(client)
+    assert [ticket['status'] for ticket in tickets(client).values()] == ['pending', 'pending']
+
+    after = last_event_id(client)
+    for status in ('preparing', 'ready'):
+        response = client.patch('/api/kitchen/items/1', json={'status': status})
+        assert response.get_json() == {'id': 1, 'status': status}
+        assert tickets(client)[1]['status'] == status
+    assert client.patch('/api/kitchen/items/1', json={'status': 'served'}).status_code == 200
+
+    assert list(tickets(client)) == [2]
+    assert [(event['id'], event['status']) for event in kitchen_events(restaurant, after)] == [
+        (1, 'preparing'), (1, 'ready'), (1, 'served')]
+
+
+@pytest.mark.parametrize('body, code', [
+    ({'status': 'burnt'}, 400),
+    ({'status': None}, 400),
+    ({}, 400),
+    ({'status': 'REMOVED'}, 400),
+])
+def test_unknown_status_is_refused(client, restaurant, body, code):
+    open_order(client)
+    after = last_event_id(client)
+    assert client.patch('/api/kitchen/items/1', json=body).status_code == code
+    assert kitchen_status(restaurant, 1) == 'pending'
+    assert kitchen_events(restaurant, after) == []
+
+
+def test_lines_out_of_the_queue_are_not_found(client, restaurant):
+    open_order(client)
+    client.patch('/api/kitchen/items/1', json={'status': 'served'})
+    assert client.patch('/api/kitchen/items/1', json={'status': 'preparing'}).status_code == 404
+    assert client.patch('/api/kitchen/items/99', json={'status': 'preparing'}).status_code == 404
+    assert kitchen_status(restaurant, 1) == 'served'
+
+
+def test_closing_an_order_serves_its_tickets(client, restaurant):
+    order_id = open_order(client, lines=3)
+    other = open_order(client, table_id=2, lines=1)
+    client.patch('/api/kitchen/items/1', json={'status': 'served'})
+    client.patch('/api/kitchen/items/2', json={'status': 'ready'})
+    after = last_event_id(client)
+
+    response = client.post(f'/api/orders/{order_id}/close', json={'payments': [{'payment_method': 'efectivo', 'amount': 30}]})
+    assert response.status_code == 200
+
+    assert [ticket['order_id'] for ticket in tickets(client).values()] == [other]
+    assert [kitchen_status(restaurant, line_id) for line_id in (1, 2, 3)] == ['served'] * 3
+    # Only the lines still open are announced
+    assert kitchen_events(restaurant, after) == [{'id': 2, 'order_id': order_id, 'status': 'served'},
+                                                 {'id': 3, 'order_id': order_id, 'status': 'served'}]
+
+
+def test_transfer_moves_the_open_tickets(client, restaurant):
+    order_id = open_order(client, lines=3)
+    client.patch('/api/kitchen/items/1', json={'status': 'served'})
+    client.patch('/api/kitchen/items/2', json={'status': 'preparing'})
+    after = last_event_id(client)
+
+    assert client.post(f'/api/orders/{order_id}/transfer', json={'table_id': 3}).status_code == 200
+
+    assert {line_id: (ticket['table'], ticket['status']) for line_id, ticket in tickets(client).items()} == {
+        2: (3, 'preparing'), 3: (3, 'pending')}
+    assert [(event['id'], event['table'], event['status']) for event in kitchen_events(restaurant, after)] == [
+        (2, 3, 'preparing'), (3, 3, 'pending')]
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Metrics tests: with METRICS_DIR shared by several worker processes, /metrics
+answers with the totals of all of them, whichever worker answers the scrape.
+
+    python -m pytest tests/integration/test_metrics.py
+"""
+
+import multiprocessing
+import os
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from db import get_pool
+from metrics import flush_metrics, registry
+
+
+def requests_total(text, endpoint):
+    return sum(int(count) for count in re.findall(
+        rf'^restaurant_requests_total{{endpoint="{re.escape(endpoint)}",[^}}]*}} (\d+)$', text, re.MULTILINE))
+
+
+def worker(make_app, metrics_dir, requests):
+    client = make_app(METRICS_DIR=metrics_dir).test_client()
+    for _ in range(requests):
+        assert client.get('/api/tables').status_code == 200
+    # What gunicorn's worker_exit does in serve.py
+    flush_metrics()
+
+
+def test_metrics_add_up_every_worker(make_app, restaurant, tmp_path):
+    metrics_dir = str(tmp_path / 'metrics')
+    os.mkdir(metrics_dir)
+    registry.reset()
+    # Like serve.py, no connection crosses the fork
+    get_pool(restaurant).close_all()
+
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=worker, args=(make_app, metrics_dir, requests)) for requests in (3, 4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(30)
+        assert process.exitcode == 0
+    assert len(os.listdir(metrics_dir)) == 2
+
+    client = make_app(METRICS_DIR=metrics_dir).test_client()
+    first = client.get('/metrics').get_data(as_text=True)
+    assert requests_total(first, 'api.api_tables') == 7
+    client.get('/api/tables')
+    second = client.get('/metrics').get_data(as_text=True)
+    assert requests_total(second, 'api.api_tables') == 8
+    assert len(os.listdir(metrics_dir)) == 3
+
+
+def test_metrics_without_a_directory_report_this_process(client):
+    registry.reset()
+    client.get('/api/tables')
+    assert requests_total(client.get('/metrics').get_data(as_text=True), 'api.api_tables') == 1
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-v"]))
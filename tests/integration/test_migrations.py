@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Migration tests: a database left at schema version 7, with order changes
+logged the old way in order_item_history, is upgraded to the latest version.
+The converted order_item_events must replay to exactly the lines still in
+order_items, even for identical duplicate lines and lines edited and then
+removed.
+
+    python -m pytest tests/integration/test_migrations.py
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from utils import get_db_connection, init_database
+import migrations
+from orders.service import replay_order
+
+OLD_VERSION = 7
+
+PIZZA, CAFE, AGUA = 1, 2, 3
+MENU = {PIZZA: ('Pizza', 10), CAFE: ('Cafe', 2), AGUA: ('Agua', 1)}
+
+
+class OldOrders:
+    """Writes order lines and their history the way the app did before version 8"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.moment = datetime(2024, 5, 1, 20, 0)
+
+    def _log(self, order_id, menu_item_id, action, quantity, notes):
+        self.moment += timedelta(minutes=1)
+        name, price = MENU[menu_item_id]
+        self.conn.execute('''
+            INSERT INTO order_item_history (order_id, menu_item_id, menu_item_name, action, quantity,
+                                            unit_price, notes, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (order_id, menu_item_id, name, action, quantity, price, notes, self.moment))
+
+    def add(self, order_id, menu_item_id, quantity=1, notes=''):
+        name, price = MENU[menu_item_id]
+        line_id = self.conn.execute('''
+            INSERT INTO order_items (order_id, menu_item_id, menu_item_name, quantity, unit_price, notes)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (order_id, menu_item_id, name, quantity, price, notes)).lastrowid
+        self._log(order_id, menu_item_id, 'added', quantity, notes)
+        return line_id
+
+    def edit(self, line_id, quantity, notes):
+        line = self.conn.execute('SELECT * FROM order_items WHERE id = ?', (line_id,)).fetchone()
+        self.conn.execute('UPDATE order_items SET quantity = ?, notes = ? WHERE id = ?', (quantity, notes, line_id))
+        self._log(line['order_id'], line['menu_item_id'], 'old_edited', line['quantity'], line['notes'])
+        self._log(line['order_id'], line['menu_item_id'], 'new_edited', quantity, notes)
+
+    def remove(self, line_id):
+        line = self.conn.execute('SELECT * FROM order_items WHERE id = ?', (line_id,)).fetchone()
+        self.conn.execute('DELETE FROM order_items WHERE id = ?', (line_id,))
+        self._log(line['order_id'], line['menu_item_id'], 'removed', line['quantity'], line['notes'])
+
+
+def test_order_item_history_converts_to_replayable_events(tmp_path, monkeypatch):
+    database = str(tmp_path / 'old.db')
+    monkeypatch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS[:OLD_VERSION])
+    monkeypatch.setattr(migrations, 'LATEST_VERSION', OLD_VERSION)
+    init_database(database)
+    monkeypatch.undo()
+
+    conn = get_db_connection(database)
+    conn.executemany('INSERT INTO menu_items (id, name, description, category, price, stockable) VALUES (?, ?, ?, ?, ?, 0)',
+                     [(item_id, name, '', 'food', price) for item_id, (name, price) in MENU.items()])
+    conn.executemany("INSERT INTO orders (id, table_id, customer_name, created_at, status) VALUES (?, 1, '', ?, 'active')",
+                     [(1, datetime(2024, 5, 1, 20)), (2, datetime(2024, 5, 1, 20)), (3, datetime(2024, 5, 1, 20))])
+    old = OldOrders(conn)
+
+    # Two identical lines; the second is edited and the first removed
+    first = old.add(1, PIZZA)
+    second = old.add(1, PIZZA)
+    old.edit(second, 3, 'extra queso')
+    old.remove(first)
+    # Edited, then removed
+    cafe = old.add(1, CAFE, 2)
+    old.edit(cafe, 2, 'sin azucar')
+    old.remove(cafe)
+
+    # One of two identical lines removed, the survivor edited twice
+    old.add(2, AGUA)
+    survivor = old.add(2, AGUA)
+    old.remove(survivor - 1)
+    old.edit(survivor, 2, '')
+    old.edit(survivor, 2, 'con hielo')
+    old.add(2, CAFE)
+
+    # Interleaved with another order's edits
+    pizza = old.add(3, PIZZA, 2)
+    old.add(1, CAFE)
+    old.edit(pizza, 1, 'mitad')
+    # Notes cleared to NULL
+    old.edit(pizza, 1, None)
+    conn.commit()
+    conn.close()
+
+    init_database(database)
+
+    conn = get_db_connection(database)
+    assert migrations.get_schema_version(conn) == migrations.LATEST_VERSION
+    tables = {row['name'] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert 'order_item_history' not in tables
+    for order_id in (1, 2, 3):
+        current = sorted((line['id'], line['menu_item_id'], line['quantity'], line['notes'])
+                         for line in conn.execute('SELECT * FROM order_items WHERE order_id = ?', (order_id,)))
+        replayed = sorted((line['id'], line['menu_item_id'], line['quantity'], line['notes'])
+                          for line in replay_order(conn, order_id))
+        assert replayed == current, f"order {order_id}"
+    # Removed lines keep their history under negative ids
+    removed = conn.execute("SELECT COUNT(*) FROM order_item_events WHERE event = 'removed' AND order_item_id < 0").fetchone()[0]
+    conn.close()
+    assert removed == 3
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-v"]))
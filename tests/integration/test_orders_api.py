@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Orders API tests: a PATCH of an order line changes only the fields it sends,
+and the order_item_events log replays to exactly the lines in order_items.
+
+    python -m pytest tests/integration/test_orders_api.py
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from utils import get_db_connection
+from orders.service import replay_order
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+
+
+def open_order(client, table_id=1, items=({'menu_item_id': 1, 'quantity': 2, 'notes': 'no cheese'},)):
+    order_id = client.post('/api/orders', json={'table_id': table_id}).get_json()['id']
+    client.post(f'/api/orders/{order_id}/items', json={'items': list(items)})
+    return order_id
+
+
+def timeline(client, order_id):
+    return client.get(f'/api/orders/{order_id}/timeline').get_json()['events']
+
+
+@pytest.mark.parametrize('patch, line', [
+    ({'quantity': 3}, (3, 'no cheese')),
+    ({'notes': 'well done'}, (2, 'well done')),
+    ({'notes': ''}, (2, '')),
+])
+def test_patch_keeps_the_fields_it_leaves_out(client, patch, line):
+    order_id = open_order(client)
+    response = client.patch(f'/api/orders/{order_id}/items/1', json=patch)
+    assert response.status_code == 200
+    [changed] = response.get_json()['lines']
+    assert (changed['quantity'], changed['notes']) == line
+
+    edit = timeline(client, order_id)[-1]
+    assert edit['event'] == 'edited'
+    assert {name: edit[name] for name in ('quantity', 'notes') if name in edit} == patch
+
+
+def test_patch_of_nothing_logs_nothing(client):
+    order_id = open_order(client)
+    assert client.patch(f'/api/orders/{order_id}/items/1', json={}).status_code == 200
+    assert [event['event'] for event in timeline(client, order_id)] == ['added']
+
+
+def test_replay_matches_the_order_lines(client, restaurant):
+    order_id = open_order(client, items=[{'menu_item_id': 1, 'quantity': 2, 'notes': 'no cheese'},
+                                         {'menu_item_id': 1, 'quantity': 2, 'notes': 'no cheese'},
+                                         {'menu_item_id': 1, 'notes': None},
+                                         {'menu_item_id': 1}])
+    client.patch(f'/api/orders/{order_id}/items/1', json={'notes': None})
+    client.patch(f'/api/orders/{order_id}/items/2', json={'quantity': 5})
+    client.post(f'/orders/{order_id}/items/3/edit', data={'quantity': '4', 'notes': 'extra'})
+    client.delete(f'/api/orders/{order_id}/items/4')
+    assert client.post(f'/api/orders/{order_id}/transfer', json={'table_id': 2}).status_code == 200
+    client.post(f'/api/orders/{order_id}/items', json={'items': [{'menu_item_id': 1, 'quantity': 3}]})
+    client.patch(f'/api/orders/{order_id}/items/5', json={'notes': 'late'})
+    client.patch(f'/api/orders/{order_id}/items/5', json={'notes': ''})
+
+    conn = get_db_connection(restaurant)
+    current = sorted((line['id'], line['menu_item_id'], line['quantity'], line['unit_price'], line['notes'])
+                     for line in conn.execute('SELECT * FROM order_items WHERE order_id = ?', (order_id,)))
+    replayed = sorted((line['id'], line['menu_item_id'], line['quantity'], line['unit_price'], line['notes'])
+                      for line in replay_order(conn, order_id))
+    conn.close()
+    assert replayed == current
+    assert [line[4] for line in current] == ['', 'no cheese', 'extra', '']
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Query plan check for every route.
+
+Drives the whole app through Flask's test client, captures each SQL
+statement with a trace callback and runs EXPLAIN QUERY PLAN on it. The test
+fails when a statement does a full table scan of one of the tables that grow
+with the restaurant's history, or when a request repeats the same statement
+shape often enough to be a query in a loop (N+1).
+
+    python -m pytest tests/integration/test_query_plans.py
+"""
+
+import io
+import os
+import re
+import sys
+
+import pytest
+from flask import request, request_finished, request_started
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from utils import get_db_connection
+from profiler import RequestProfile
+from exports import EXPORTS
+
+
+# Tables that grow with every order, movement or edit
+LARGE_TABLES = {
+    'movements',
+    'orders',
+    'order_items',
+    'order_payments',
+    'order_item_events',
+    'menu_audit',
+    'manual_money_movements',
+    'sales_hourly_items',
+    'sales_hourly_tables',
+    'sales_hourly_payments',
+}
+
+# Pages that still read a whole table on purpose, with the reason
+UNBOUNDED_ENDPOINTS = {
+    'menu.menu_audit': 'shows the whole menu change history, newest first through idx_menu_audit_timestamp',
+}
+
+# Repeats of one statement shape in a request that count as N+1
+N_PLUS_ONE_THRESHOLD = 5
+
+TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN)\s+"?(\w+)"?(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+# A bare scan, or a walk of a whole index, which reads every row all the same
+FULL_SCAN = re.compile(r'^(?:SCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?|SEARCH (\w+))$')
+SQL_KEYWORDS = {'where', 'on', 'left', 'inner', 'join', 'order', 'group', 'limit', 'union', 'using'}
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    import app as app_module
+    # Event streams answer with what is there and end instead of waiting
+    monkeypatch.setitem(app_module.app.config, 'LIVE_EVENTS_STREAM_SECONDS', 0)
+    return app_module.app.test_client()
+
+
+def table_aliases(sql):
+    """Map every name a statement uses for a table (the table or its alias)"""
+    aliases = {}
+    for table, alias in TABLE_REFERENCE.findall(sql):
+        aliases[table] = table
+        if alias and alias.lower() not in SQL_KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+
+def full_scans(conn, sql, parameters=()):
+    """Large tables that EXPLAIN QUERY PLAN says are read whole, bare or walking an index"""
+    aliases = table_aliases(sql)
+    # A partial index only holds the rows its WHERE selects (e.g. open kitchen lines)
+    partial = {row['name'] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                                   "AND sql LIKE '%WHERE%'")}
+    scanned = []
+    for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall():
+        match = FULL_SCAN.match(row['detail'])
+        if not match or match.group(2) in partial:
+            continue
+        table = aliases.get(match.group(1) or match.group(3))
+        if table in LARGE_TABLES:
+            scanned.append(table)
+    return scanned
+
+
+# Stockable items beyond Pizza, more than N_PLUS_ONE_THRESHOLD, so a page
+# that queries once per item shows up as N+1
+STOCKED_ITEMS = [f'Stocked {number}' for number in range(N_PLUS_ONE_THRESHOLD + 2)]
+
+
+def exercise_routes(client):
+    """Walk the app like the E2E flow does, hitting every route"""
+    requests_to_make = [
+        ('post', '/menu/add', {'name': 'Pizza', 'description': 'Test', 'category': 'food', 'price': '15.99', 'stockable': 'on'}),
+        ('post', '/menu/add', {'name': 'Service', 'description': 'Test', 'category': 'food', 'price': '5.00'}),
+        ('get', '/menu/edit/1', None),
+        ('post', '/menu/edit/1', {'name': 'Pizza 2', 'description': 'Test', 'category': 'food', 'price': '16.99', 'stockable': 'on'}),
+        ('post', '/menu/add', {'name': 'Gone', 'description': '', 'category': 'food', 'price': '1'}),
+        ('post', '/menu/delete/3', None),
+    ]
+    # Menu items 4 onwards, each with a delivery and a sale
+    for item_id, name in enumerate(STOCKED_ITEMS, 4):
+        requests_to_make += [
+            ('post', '/menu/add', {'name': name, 'description': '', 'category': 'drinks', 'price': '2', 'stockable': 'on'}),
+            ('post', '/movements/add', {'menu_item_id': str(item_id), 'quantity_change': '20', 'notes': '', 'item_name': name}),
+            ('post', '/movements/add', {'menu_item_id': str(item_id), 'quantity_change': '-3', 'notes': '', 'item_name': name}),
+        ]
+    requests_to_make += [
+        ('post', '/tables/add', {'table_number': '99', 'capacity': '4'}),
+        ('post', '/tables/add', {'table_number': '88', 'capacity': '6'}),
+        ('post', '/tables/add', {'table_number': '77', 'capacity': '2'}),
+        ('post', '/movements/add', {'menu_item_id': '1', 'quantity_change': '50', 'notes': 'Initial', 'item_name': 'Pizza 2'}),
+        ('get', '/orders/new/99', None),
+        ('post', '/orders/new/99', {'customer_name': 'Test Customer'}),
+        ('post', '/orders/1/add_item', {'menu_item_id': '1', 'quantity': '3', 'notes': ''}),
+        ('post', '/orders/1/add_item', {'menu_item_id': '2', 'quantity': '1', 'notes': ''}),
+        ('post', '/orders/1/items/1/edit', {'quantity': '2', 'notes': 'Extra cheese'}),
+        ('post', '/orders/1/items/2/remove', None),
+        ('get', '/orders/1', None),
+        ('post', '/orders/1/transfer', {'table_id': '77'}),
+        ('post', '/orders/1/close', {'payment_method[]': ['efectivo'], 'amount[]': ['33.98']}),
+        ('post', '/caja/modify_money', {'amount': '-10', 'description': 'Change', 'payment_method': 'Efectivo'}),
+        ('get', '/', None),
+        ('get', '/menu/', None),
+        ('get', '/menu/audit', None),
+        ('get', '/movements/', None),
+        ('get', '/movements/?date_from=2020-01-01&date_to=2030-12-31&menu_item_id=1', None),
+        ('get', '/movements/balance?menu_item_id=1&date_from=2020-01-01&date_to=2030-12-31', None),
+        ('get', '/movements/balance?menu_item_id=1&at=2030-01-01', None),
+        ('get', '/movements/add', None),
+        ('get', '/tables/', None),
+        ('get', '/tables/add', None),
+        ('get', '/orders/', None),
+        ('get', '/orders/?status=closed&table=99&date_from=2020-01-01&date_to=2030-12-31&customer=Test', None),
+        ('get', '/orders/?status=active&before=2', None),
+        ('post', '/api/orders', {'json': {'table_id': 88, 'customer_name': 'Api'}}),
+        ('post', '/api/orders/2/items', {'json': {'items': [{'menu_item_id': 1, 'quantity': 2}, {'menu_item_id': 2, 'quantity': 1, 'notes': 'x'}]}}),
+        ('patch', '/api/orders/2/items/4', {'json': {'quantity': 3}}),
+        ('delete', '/api/orders/2/items/4', None),
+        ('get', '/api/orders/2', None),
+        ('post', '/api/orders/2/transfer', {'json': {'table_id': 99}}),
+        ('get', '/api/tables', None),
+        ('get', '/api/orders/2/timeline', None),
+        ('get', '/api/orders/2/replay?at=2030-01-01', None),
+        ('get', '/api/orders/1/replay', None),
+        ('get', '/kitchen/', None),
+        ('get', '/api/kitchen/tickets', None),
+        ('patch', '/api/kitchen/items/3', {'json': {'status': 'preparing'}}),
+        ('get', '/events/stream?channels=kitchen&after=0', None),
+        ('post', '/api/orders/2/close', {'json': {'payments': [{'payment_method': 'efectivo', 'amount': 33.98}]}}),
+        ('get', '/caja/', None),
+        ('get', '/reports/sales', None),
+        ('get', '/reports/sales?date_from=2020-01-01&date_to=2030-12-31', None),
+        ('get', '/api/reports/sales?date_from=2020-01-01&date_to=2030-12-31', None),
+        ('get', '/metrics', None),
+        ('get', '/caja/?date_from=2020-01-01&date_to=2030-12-31', None),
+        ('post', '/caja/close_day', {'date': '2020-01-01'}),
+        ('get', '/exports/', None),
+        ('get', '/exports/orders.csv?date_from=2020-01-01&date_to=2030-12-31', None),
+        ('get', '/exports/order_items.jsonl', None),
+        ('get', '/events/stream?channels=tables,stock&after=0', None),
+        ('get', '/events/stream?channels=stock', None),
+        ('get', '/menu/import', None),
+        ('post', '/menu/import', {'file': (io.BytesIO(b'name,description,category,price,stockable\nTea,,drink,2,yes\n'), 'menu.csv')}),
+        ('get', '/movements/import', None),
+        ('post', '/movements/import', {'file': (io.BytesIO(b'menu_item_id,quantity_change,notes\n1,5,a\n1,-2,b\n'), 'delivery.csv')}),
+    ]
+    for method, url, data in requests_to_make:
+        if data and 'json' in data:
+            response = getattr(client, method)(url, json=data['json'])
+        else:
+            response = getattr(client, method)(url, data=data)
+        assert response.status_code in (200, 201, 302), f"{method.upper()} {url} returned {response.status_code}"
+
+
+def test_route_queries_use_indexes(client):
+    app = client.application
+    statements = []
+
+    def start_trace(sender, **extra):
+        endpoint = request.endpoint
+        get_db_connection().set_trace_callback(lambda sql: statements.append((endpoint, sql)))
+
+    def stop_trace(sender, response, **extra):
+        get_db_connection().set_trace_callback(None)
+
+    with request_started.connected_to(start_trace, app), request_finished.connected_to(stop_trace, app):
+        exercise_routes(client)
+
+    conn = get_db_connection(os.environ['DATABASE_PATH'])
+    problems = []
+    checked = 0
+    for endpoint, sql in statements:
+        if endpoint in UNBOUNDED_ENDPOINTS:
+            continue
+        if not sql.lstrip().upper().startswith(('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')):
+            continue
+        checked += 1
+        for table in full_scans(conn, sql):
+            problems.append(f"{endpoint}: full scan of {table} in {' '.join(sql.split())}")
+    conn.close()
+
+    assert checked > 0, "No statements were captured"
+    assert not problems, "\n".join(problems)
+
+
+def test_exports_use_indexes(client):
+    # Exports stream from their own connection, outside the traced requests
+    conn = get_db_connection(os.environ['DATABASE_PATH'])
+    problems = [f"{name}: full scan of {table}"
+                for name, sql in EXPORTS.items()
+                for table in full_scans(conn, sql, ('2020-01-01', '2030-01-01'))]
+    conn.close()
+    assert not problems, "\n".join(problems)
+
+
+def test_routes_have_no_n_plus_one(client):
+    app = client.application
+    profiles = []
+
+    def start_profile(sender, **extra):
+        profile = RequestProfile(request.method, request.full_path, request.endpoint)
+        profiles.append(profile)
+        conn = get_db_connection()
+        conn.set_trace_callback(profile.trace)
+        # executemany batches are not N+1, the observer marks them
+        conn.statement_observer = profile.timed
+
+    def stop_profile(sender, response, **extra):
+        conn = get_db_connection()
+        conn.set_trace_callback(None)
+        conn.statement_observer = None
+
+    with request_started.connected_to(start_profile, app), request_finished.connected_to(stop_profile, app):
+        exercise_routes(client)
+
+    problems = []
+    for profile in profiles:
+        profile.finish(None, N_PLUS_ONE_THRESHOLD)
+        problems += [f"{profile.endpoint}: {count} x {shape}" for shape, count in profile.n_plus_one]
+    assert not problems, "\n".join(problems)
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Sales rollup tests: the hourly rollups that close_order updates one order at
+a time must equal a full rebuild_sales_rollups(), and the sales report must
+match a direct aggregate over orders, order_items and order_payments.
+
+    python -m pytest tests/integration/test_sales.py
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from utils import get_db_connection
+from orders import service
+from orders.service import add_items, close_order, create_order
+from sales import rebuild_sales_rollups
+
+PIZZA, CAFE, AGUA = 1, 2, 3
+ROLLUPS = {
+    'sales_hourly_items': 'hour, menu_item_id, menu_item_name, category, quantity, ROUND(revenue, 2)',
+    'sales_hourly_tables': 'hour, table_id, orders, ROUND(revenue, 2)',
+    'sales_hourly_payments': 'hour, payment_method, payments, ROUND(amount, 2)',
+}
+
+# (table, lines, payments) closed a quarter of an hour apart, over three hours
+ORDERS = [
+    (1, [(PIZZA, 2, ''), (CAFE, 1, '')], [('efectivo', 10), ('tarjeta', 12)]),
+    (2, [(AGUA, 3, ''), (PIZZA, 1, 'sin queso')], [('efectivo', 14.5)]),
+    (3, [(CAFE, 2, ''), (CAFE, 1, 'doble')], [('tarjeta', 6)]),
+    (1, [(PIZZA, 1, ''), (AGUA, 1, '')], [('efectivo', 5), ('tarjeta', 6.5)]),
+    (2, [(PIZZA, 3, '')], [('tarjeta', 15), ('efectivo', 15), ('transferencia', 0)]),
+    (1, [(CAFE, 4, ''), (AGUA, 2, '')], [('efectivo', 8), ('efectivo', 3)]),
+    (3, [(PIZZA, 1, ''), (CAFE, 1, ''), (AGUA, 1, '')], [('transferencia', 13.5)]),
+    (2, [(AGUA, 1, '')], [('efectivo', 1.5)]),
+    (1, [(PIZZA, 2, ''), (PIZZA, 2, 'grande')], [('tarjeta', 20), ('efectivo', 20)]),
+]
+
+
+def rollups(conn):
+    return {table: sorted(tuple(row) for row in conn.execute(f'SELECT {columns} FROM {table}'))
+            for table, columns in ROLLUPS.items()}
+
+
+@pytest.fixture
+def sales(make_app, restaurant, monkeypatch):
+    """The app after closing ORDERS one by one, through close_order"""
+    app = make_app()
+    client = app.test_client()
+    client.post('/menu/add', data={'name': 'Cafe', 'category': 'drinks', 'price': '2'})
+    client.post('/menu/add', data={'name': 'Agua', 'category': 'drinks', 'price': '1.5'})
+
+    moment = datetime(2024, 5, 1, 19, 50)
+
+    class Clock(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return moment
+
+    monkeypatch.setattr(service, 'datetime', Clock)
+    with app.app_context():
+        for table_id, lines, payments in ORDERS:
+            conn = get_db_connection(restaurant)
+            order_id = create_order(conn, table_id)
+            add_items(conn, order_id, lines)
+            close_order(conn, order_id, payments)
+            conn.commit()
+            conn.close()
+            moment += timedelta(minutes=15)
+    return client
+
+
+def test_incremental_rollups_equal_a_rebuild(sales, restaurant):
+    conn = get_db_connection(restaurant)
+    incremental = rollups(conn)
+    rebuild_sales_rollups(conn=conn)
+    rebuilt = rollups(conn)
+    conn.rollback()
+    conn.close()
+
+    assert len({hour for hour, *_ in incremental['sales_hourly_tables']}) == 3
+    assert incremental == rebuilt
+
+
+def test_sales_report_matches_the_orders(sales, restaurant):
+    report = sales.get('/api/reports/sales?date_from=2024-05-01&date_to=2024-05-01').get_json()
+
+    conn = get_db_connection(restaurant)
+    orders, quantity, revenue = conn.execute('''
+        SELECT COUNT(DISTINCT o.id), SUM(oi.quantity), ROUND(SUM(oi.quantity * oi.unit_price), 2)
+        FROM orders o JOIN order_items oi ON oi.order_id = o.id
+        WHERE o.status = 'closed'
+    ''').fetchone()
+    payments = {row['payment_method']: (row['payments'], row['amount']) for row in conn.execute('''
+        SELECT payment_method, COUNT(*) AS payments, ROUND(SUM(amount), 2) AS amount
+        FROM order_payments GROUP BY payment_method
+    ''')}
+    tables = {row['table_id']: (row['orders'], row['revenue']) for row in conn.execute('''
+        SELECT o.table_id, COUNT(DISTINCT o.id) AS orders, ROUND(SUM(oi.quantity * oi.unit_price), 2) AS revenue
+        FROM orders o JOIN order_items oi ON oi.order_id = o.id
+        WHERE o.status = 'closed'
+        GROUP BY o.table_id
+    ''')}
+    conn.close()
+
+    assert orders == len(ORDERS)
+    assert report['totals'] == {'orders': orders, 'quantity': quantity, 'revenue': revenue}
+    assert {row['payment_method']: (row['payments'], row['amount'])
+            for row in report['by_payment_method']} == payments
+    assert {row['table_id']: (row['orders'], row['revenue']) for row in report['by_table']} == tables
+    assert sum(row['revenue'] for row in report['by_hour']) == pytest.approx(revenue)
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Stock ledger stress test.
+
+Several processes, each running several threads with its own Flask test
+client, record stock movements and close orders for the same few menu items
+at once on one database file. Afterwards every item's movements must carry a
+running partial_stock equal to the sum of its quantity changes so far, and
+stock_levels must match the ledger. It runs once with each request writing
+on its own and once through the write queue.
+
+    python -m pytest tests/integration/test_stock_ledger.py
+"""
+
+import multiprocessing
+import os
+import random
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from utils import get_db_connection
+
+PROCESSES = 4
+THREADS_PER_PROCESS = 4
+ROUNDS = 15
+ITEMS = 3
+
+
+def hammer(client, table_number, rounds, seed):
+    """Interleave manual movements and closed orders; returns failed requests"""
+    rng = random.Random(seed)
+    failures = []
+
+    def check(response, what):
+        if response.status_code not in (200, 201, 302):
+            failures.append(f"{what}: {response.status_code}")
+        return response
+
+    for _ in range(rounds):
+        item = rng.randint(1, ITEMS)
+        check(client.post('/movements/add', data={'menu_item_id': str(item), 'item_name': f'Item {item}',
+                                                  'quantity_change': str(rng.choice((5, 10, -3))), 'notes': ''}),
+              'add movement')
+
+        response = check(client.post('/api/orders', json={'table_id': table_number}), 'open order')
+        if response.status_code != 201:
+            continue
+        order_id = response.get_json()['id']
+        lines = [{'menu_item_id': rng.randint(1, ITEMS), 'quantity': rng.randint(1, 3)} for _ in range(3)]
+        response = check(client.post(f'/api/orders/{order_id}/items', json={'items': lines}), 'add items')
+        if response.status_code != 200:
+            continue
+        total = response.get_json()['total']
+        check(client.post(f'/api/orders/{order_id}/close',
+                          json={'payments': [{'payment_method': 'Efectivo', 'amount': total}]}), 'close order')
+    return failures
+
+
+def run_threads(first_table, threads, rounds):
+    """One process: `threads` waiters, each on its own table"""
+    import app as app_module
+    client_app = app_module.app
+    failures = []
+
+    def waiter(table_number):
+        failures.extend(hammer(client_app.test_client(), table_number, rounds, table_number))
+
+    workers = [threading.Thread(target=waiter, args=(first_table + i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return failures
+
+
+def ledger_problems(conn):
+    problems = []
+    running = {}
+    for movement in conn.execute('SELECT * FROM movements ORDER BY id'):
+        item = movement['menu_item_id']
+        running[item] = running.get(item, 0) + movement['quantity_change']
+        if movement['partial_stock'] != running[item]:
+            problems.append(f"movement {movement['id']} of item {item}: partial_stock "
+                            f"{movement['partial_stock']}, expected {running[item]}")
+    for level in conn.execute('SELECT menu_item_id, current_stock FROM stock_levels'):
+        if level['current_stock'] != running.get(level['menu_item_id'], 0):
+            problems.append(f"stock_levels of item {level['menu_item_id']}: {level['current_stock']}, "
+                            f"ledger says {running.get(level['menu_item_id'], 0)}")
+    return problems
+
+
+@pytest.mark.parametrize('write_queue', ['0', '1'])
+def test_concurrent_stock_writes_keep_the_ledger_consistent(database, monkeypatch, write_queue):
+    # Movements through the group-commit writer or straight from each request
+    monkeypatch.setenv('WRITE_QUEUE', write_queue)
+    conn = get_db_connection(database)
+    conn.executemany('INSERT INTO menu_items (name, description, category, price, stockable) VALUES (?, ?, ?, ?, 1)',
+                     [(f'Item {i}', '', 'food', 2.5) for i in range(1, ITEMS + 1)])
+    conn.executemany("INSERT INTO restaurant_tables (table_number, capacity, status) VALUES (?, 4, 'available')",
+                     [(table,) for table in range(1, PROCESSES * THREADS_PER_PROCESS + 1)])
+    conn.commit()
+    conn.close()
+
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(PROCESSES) as pool:
+        results = [pool.apply_async(run_threads, (1 + process * THREADS_PER_PROCESS, THREADS_PER_PROCESS, ROUNDS))
+                   for process in range(PROCESSES)]
+        failures = [failure for result in results for failure in result.get(timeout=300)]
+    assert not failures, "\n".join(failures)
+
+    conn = get_db_connection(database)
+    orders = conn.execute("SELECT COUNT(*) FROM orders WHERE status = 'closed'").fetchone()[0]
+    problems = ledger_problems(conn)
+    conn.close()
+    assert orders == PROCESSES * THREADS_PER_PROCESS * ROUNDS
+    assert not problems, "\n".join(problems[:20])
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Table session tests: many waiters in several processes open the same table,
+close the same order or move orders onto the same table at once. Exactly
+one of them wins each race, the others get 409, and the tables, orders,
+cash and stock are left as if only the winner had tried.
+
+    python -m pytest tests/integration/test_table_sessions.py
+"""
+
+import multiprocessing
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from utils import get_db_connection
+
+PROCESSES = 4
+THREADS_PER_PROCESS = 4
+
+
+def race(method, url, body):
+    """One process: every thread sends the same request at once; returns the statuses"""
+    import app as app_module
+    client_app = app_module.app
+    barrier = threading.Barrier(THREADS_PER_PROCESS)
+    statuses = []
+
+    def waiter():
+        client = client_app.test_client()
+        barrier.wait()
+        statuses.append(getattr(client, method)(url, json=body).status_code)
+
+    workers = [threading.Thread(target=waiter) for _ in range(THREADS_PER_PROCESS)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return statuses
+
+
+def race_everywhere(method, url, body):
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(PROCESSES) as pool:
+        results = [pool.apply_async(race, (method, url, body)) for _ in range(PROCESSES)]
+        return sorted(status for result in results for status in result.get(timeout=120))
+
+
+def test_concurrent_opens_of_one_table(restaurant):
+    statuses = race_everywhere('post', '/api/orders', {'table_id': 1, 'customer_name': 'Race'})
+    assert statuses == [201] + [409] * (PROCESSES * THREADS_PER_PROCESS - 1)
+
+    conn = get_db_connection(restaurant)
+    orders = conn.execute('SELECT id FROM orders').fetchall()
+    table = conn.execute('SELECT * FROM restaurant_tables WHERE table_number = 1').fetchone()
+    conn.close()
+    assert len(orders) == 1
+    assert (table['status'], table['open_order_number']) == ('in use', orders[0]['id'])
+
+
+def test_concurrent_closes_of_one_order(restaurant, client):
+    client.post('/movements/add', data={'menu_item_id': '1', 'item_name': 'Pizza', 'quantity_change': '10', 'notes': ''})
+    order_id = client.post('/api/orders', json={'table_id': 1}).get_json()['id']
+    client.post(f'/api/orders/{order_id}/items', json={'items': [{'menu_item_id': 1, 'quantity': 2}]})
+
+    statuses = race_everywhere('post', f'/api/orders/{order_id}/close',
+                               {'payments': [{'payment_method': 'efectivo', 'amount': 20}]})
+    # Losers that saw the order closed before trying get 400, the ones that raced it 409
+    assert statuses.count(200) == 1
+    assert set(statuses) <= {200, 400, 409}
+
+    conn = get_db_connection(restaurant)
+    payments = conn.execute('SELECT COUNT(*) FROM order_payments WHERE order_id = ?', (order_id,)).fetchone()[0]
+    stock = conn.execute('SELECT current_stock FROM stock_levels WHERE menu_item_id = 1').fetchone()[0]
+    table = conn.execute('SELECT * FROM restaurant_tables WHERE table_number = 1').fetchone()
+    conn.close()
+    assert payments == 1
+    assert stock == 8
+    assert (table['status'], table['open_order_number']) == ('available', None)
+
+
+def test_concurrent_transfers_onto_one_table(restaurant, client):
+    first = client.post('/api/orders', json={'table_id': 1}).get_json()['id']
+    second = client.post('/api/orders', json={'table_id': 2}).get_json()['id']
+
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(2) as pool:
+        results = [pool.apply_async(race, ('post', f'/api/orders/{order_id}/transfer', {'table_id': 3}))
+                   for order_id in (first, second)]
+        statuses = sorted(status for result in results for status in result.get(timeout=120))
+    assert statuses.count(200) == 1
+    assert set(statuses) <= {200, 400, 409}
+
+    conn = get_db_connection(restaurant)
+    tables = {row['table_number']: row for row in conn.execute('SELECT * FROM restaurant_tables')}
+    moved = conn.execute('SELECT id FROM orders WHERE table_id = 3').fetchall()
+    conn.close()
+    assert len(moved) == 1
+    stayed = second if moved[0]['id'] == first else first
+    assert tables[3]['open_order_number'] == moved[0]['id']
+    # The moved order's old table is free, the other order kept its own
+    assert sum(table['status'] == 'available' for table in tables.values()) == 1
+    assert {table['open_order_number'] for table in tables.values()} == {moved[0]['id'], stayed, None}
+
+
+def test_transfer_and_floor(client):
+    order_id = client.post('/api/orders', json={'table_id': 1, 'customer_name': 'Ana'}).get_json()['id']
+    client.post(f'/api/orders/{order_id}/items', json={'items': [{'menu_item_id': 1}]})
+
+    response = client.post(f'/api/orders/{order_id}/transfer', json={'table_id': 2})
+    assert response.status_code == 200
+    assert response.get_json()['table_id'] == 2
+    assert client.post(f'/api/orders/{order_id}/transfer', json={'table_id': 2}).status_code == 400
+    assert client.post(f'/api/orders/{order_id}/transfer', json={'table_id': 9}).status_code == 404
+    assert client.post('/api/orders', json={'table_id': 2}).status_code == 409
+    assert client.post('/api/orders', json={'table_id': 9}).status_code == 404
+
+    floor = client.get('/api/tables').get_json()
+    assert [(table['table_number'], table['status'], table['open_order_number'])
+            for table in floor['tables']] == [(1, 'available', None), (2, 'in use', order_id), (3, 'available', None)]
+    assert floor['tables'][1]['opened_at'] is not None
+    assert floor['last_event_id'] > 0
+
+    kitchen = client.get('/api/kitchen/tickets').get_json()
+    assert {ticket['table'] for ticket in kitchen['tickets']} == {2}
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Write queue tests: with WRITE_QUEUE=1 concurrent writes are committed in
+batches by one writer thread, each caller gets its own result or exception,
+a failing write leaves the rest of its batch alone, and a write that cannot
+start in time is refused with 503.
+
+    python -m pytest tests/integration/test_write_queue.py
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from utils import get_db_connection
+
+THREADS = 16
+WRITES_PER_THREAD = 10
+
+
+class Refused(Exception):
+    pass
+
+
+def test_concurrent_writes_are_group_committed(make_app, restaurant):
+    from write_queue import run_write, write_queue_stats
+    app = make_app(WRITE_QUEUE=1)
+    write_queue_stats.reset()
+
+    def insert(conn, number):
+        if number % 7 == 0:
+            conn.execute("INSERT INTO manual_money_movements (date, payment_method, description, amount, "
+                         "movement_type) VALUES ('2026-01-01', 'Efectivo', 'rolled back', 1, 'x')")
+            raise Refused(number)
+        return conn.execute("INSERT INTO manual_money_movements (date, payment_method, description, amount, "
+                            "movement_type) VALUES ('2026-01-01', 'Efectivo', ?, 1, 'x')",
+                            (f'write {number}',)).lastrowid
+
+    results, refused = {}, []
+
+    def writer(first):
+        for number in range(first, first + WRITES_PER_THREAD):
+            with app.app_context():
+                try:
+                    results[number] = run_write(lambda conn: insert(conn, number))
+                except Refused:
+                    refused.append(number)
+
+    threads = [threading.Thread(target=writer, args=(i * WRITES_PER_THREAD + 1,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    conn = get_db_connection(restaurant)
+    rows = {row['id']: row['description'] for row in conn.execute('SELECT id, description FROM manual_money_movements')}
+    conn.close()
+
+    total = THREADS * WRITES_PER_THREAD
+    assert sorted(refused) == [number for number in range(1, total + 1) if number % 7 == 0]
+    # Every caller got the id of its own row, and the refused writes left nothing
+    assert {rows[row_id] for row_id in results.values()} == {f'write {number}' for number in results}
+    assert len(rows) == len(results) == total - len(refused)
+    stats = write_queue_stats.snapshot()
+    assert stats['units'] == total
+    assert stats['batches'] < total
+
+
+def test_write_that_cannot_start_in_time_gets_503(make_app, restaurant):
+    from write_queue import write_queue_stats
+    app = make_app(WRITE_QUEUE=1, WRITE_QUEUE_TIMEOUT_MS=200, SQLITE_BUSY_TIMEOUT_MS=100)
+    client = app.test_client()
+    response = client.post('/api/orders', json={'table_id': 1})
+    order_id = response.get_json()['id']
+    conn = get_db_connection(restaurant)
+
+    # Another process holding the write lock
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        write_queue_stats.reset()
+        response = client.post(f'/api/orders/{order_id}/items', json={'items': [{'menu_item_id': 1}]})
+    finally:
+        conn.rollback()
+        conn.close()
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert 'error' in response.get_json()
+    assert write_queue_stats.snapshot()['busy'] == 1
+
+    response = client.post(f'/api/orders/{order_id}/items', json={'items': [{'menu_item_id': 1}]})
+    assert response.status_code == 200
+    assert [line['name'] for line in response.get_json()['lines']] == ['Pizza']
+
+
+def test_writer_survives_a_failing_connection(make_app, monkeypatch):
+    import write_queue
+    from write_queue import run_write
+    app = make_app(WRITE_QUEUE=1, WRITE_QUEUE_TIMEOUT_MS=500)
+    connect = write_queue.get_db_connection
+    failures = ['disk I/O error']
+
+    def flaky_connection(database):
+        if failures:
+            raise sqlite3.OperationalError(failures.pop())
+        return connect(database)
+
+    monkeypatch.setattr(write_queue, 'get_db_connection', flaky_connection)
+    outcomes = []
+
+    def write():
+        with app.app_context():
+            try:
+                outcomes.append(run_write(lambda conn: conn.execute("UPDATE menu_items SET price = 12").rowcount))
+            except Exception as error:
+                outcomes.append(error)
+
+    for _ in range(2):
+        caller = threading.Thread(target=write, daemon=True)
+        caller.start()
+        caller.join(3)
+        assert not caller.is_alive(), "the caller is still waiting for the writer"
+    assert isinstance(outcomes[0], sqlite3.OperationalError)
+    assert outcomes[1] == 1
+
+
+if __name__ == "__main__":
+    import pytest
+    sys.exit(pytest.main([__file__, "-v"]))
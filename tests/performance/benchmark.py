@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Route and helper benchmark on a synthetic database.
+
+Generates (or reuses) a database with synthetic_data.py, then times every
+blueprint route through Flask's test client and the hot helpers in utils,
+stock, cash and the order service. Results go to a JSON report; pass an
+older report with --compare to see the change per route and fail on
+regressions.
+
+    python tests/performance/benchmark.py --months 6 --orders-per-day 1100 \\
+        --output report.json
+    python tests/performance/benchmark.py --database /tmp/bench.db \\
+        --compare report.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+sys.path.insert(0, os.path.dirname(__file__))
+from synthetic_data import generate_database, add_scale_arguments
+
+
+def timings_ms(function, repeat):
+    """Run function once to warm up, then `repeat` times; stats in ms"""
+    function()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'min': round(samples[0], 3),
+        'median': round(statistics.median(samples), 3),
+        'p95': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'mean': round(statistics.fmean(samples), 3),
+    }
+
+
+def sample_ids(conn):
+    """Ids the routes are called with: recent, open and mid-history rows"""
+    newest = conn.execute('SELECT MAX(id) FROM orders').fetchone()[0]
+    open_order = conn.execute("SELECT id FROM orders WHERE status = 'active' ORDER BY id DESC LIMIT 1").fetchone()
+    busy_item = conn.execute('''
+        SELECT menu_item_id FROM stock_levels ORDER BY movements_since_checkpoint DESC LIMIT 1
+    ''').fetchone()
+    free_table = conn.execute('''
+        SELECT table_number FROM restaurant_tables WHERE status = 'available' LIMIT 1
+    ''').fetchone()
+    return {
+        'newest_order': newest,
+        'middle_order': newest // 2,
+        'open_order': open_order[0] if open_order else None,
+        'stock_item': busy_item[0] if busy_item else 1,
+        'free_table': free_table[0] if free_table else 1,
+    }
+
+
+def read_routes(ids):
+    today = datetime.now().date()
+    month_ago = (today - timedelta(days=30)).isoformat()
+    quarter_ago = (today - timedelta(days=90)).isoformat()
+    routes = {
+        'index': '/',
+        'menu.menu': '/menu/',
+        'menu.menu_audit': '/menu/audit',
+        'menu.edit_menu_item': '/menu/edit/1',
+        'movements.movements': '/movements/',
+        'movements.movements[item,30d]': f"/movements/?menu_item_id={ids['stock_item']}&date_from={month_ago}",
+        'movements.stock_balance[window]': f"/movements/balance?menu_item_id={ids['stock_item']}&date_from={quarter_ago}",
+        'movements.stock_balance[at]': f"/movements/balance?menu_item_id={ids['stock_item']}&at={month_ago}",
+        'movements.add_movement': '/movements/add',
+        'tables.tables': '/tables/',
+        'orders.orders': '/orders/',
+        'orders.orders[closed,30d]': f"/orders/?status=closed&date_from={month_ago}",
+        'orders.orders[deep page]': f"/orders/?before={ids['middle_order']}",
+        'orders.order_detail': f"/orders/{ids['newest_order']}",
+        'orders.new_order': f"/orders/new/{ids['free_table']}",
+        'caja.caja': '/caja/',
+        'caja.caja[90d]': f"/caja/?date_from={quarter_ago}",
+        'api.get_order': f"/api/orders/{ids['newest_order']}",
+        'api.order_timeline': f"/api/orders/{ids['middle_order']}/timeline",
+        'api.replay_order': f"/api/orders/{ids['middle_order']}/replay?at={month_ago}",
+        'reports.sales': '/reports/sales',
+        'reports.sales[90d]': f"/reports/sales?date_from={quarter_ago}",
+        'kitchen.kitchen': '/kitchen/',
+        'api.kitchen_tickets': '/api/kitchen/tickets',
+    }
+    return routes
+
+
+def benchmark_routes(client, ids, repeat):
+    results = {}
+    for name, url in read_routes(ids).items():
+        def call(url=url):
+            response = client.get(url)
+            assert response.status_code == 200, f"GET {url} returned {response.status_code}"
+        results[name] = timings_ms(call, repeat)
+
+    # Write paths: a full order per iteration, through the form and the API
+    table = ids['free_table']
+
+    def form_order():
+        response = client.post(f'/orders/new/{table}', data={'customer_name': 'Bench'})
+        order_id = int(response.headers['Location'].rstrip('/').split('/')[-1])
+        for menu_item_id in (1, 2, 3):
+            client.post(f'/orders/{order_id}/add_item', data={'menu_item_id': menu_item_id, 'quantity': 2, 'notes': ''})
+        order = client.get(f'/api/orders/{order_id}').get_json()
+        client.post(f'/orders/{order_id}/items/{order["lines"][0]["id"]}/edit', data={'quantity': 3, 'notes': 'x'})
+        total = client.get(f'/api/orders/{order_id}').get_json()['total']
+        response = client.post(f'/orders/{order_id}/close',
+                               data={'payment_method[]': ['Efectivo', 'QR'], 'amount[]': [str(total - 1), '1']})
+        assert response.status_code == 302, response.data
+
+    def api_order():
+        order = client.post('/api/orders', json={'table_id': table}).get_json()
+        order = client.post(f"/api/orders/{order['id']}/items",
+                            json={'items': [{'menu_item_id': i, 'quantity': 2} for i in range(1, 9)]}).get_json()
+        client.patch(f"/api/orders/{order['id']}/items/{order['lines'][0]['id']}", json={'quantity': 3})
+        total = client.get(f"/api/orders/{order['id']}").get_json()['total']
+        response = client.post(f"/api/orders/{order['id']}/close",
+                               json={'payments': [{'payment_method': 'Efectivo', 'amount': total}]})
+        assert response.status_code == 200, response.data
+
+    results['workflow[form order, 3 items]'] = timings_ms(form_order, repeat)
+    results['workflow[api order, 8 items]'] = timings_ms(api_order, repeat)
+    results['movements.add_movement[post]'] = timings_ms(lambda: client.post('/movements/add', data={
+        'menu_item_id': ids['stock_item'], 'quantity_change': '5', 'notes': 'bench', 'item_name': 'bench'}), repeat)
+    results['caja.modify_money'] = timings_ms(lambda: client.post('/caja/modify_money', data={
+        'amount': '-1', 'description': 'bench', 'payment_method': 'Efectivo'}), repeat)
+    return results
+
+
+def benchmark_functions(app, database, ids, repeat):
+    from db import get_db_connection
+    from utils import get_current_stock_for_menu_item, parse_date_window
+    from stock import get_stock_at, get_stock_range, get_stock_levels, insert_movements
+    from cash import get_cash_summary
+    from menu_cache import menu_cache
+    from orders.service import replay_order
+
+    now = datetime.now()
+    month_ago = now - timedelta(days=30)
+    item = ids['stock_item']
+    conn = get_db_connection(database)
+
+    def rolled_back_movements():
+        insert_movements(conn, [(item, 'bench', -1, 'out', 'bench')] * 10)
+        conn.rollback()
+
+    functions = {
+        'utils.get_current_stock_for_menu_item': lambda: get_current_stock_for_menu_item(item),
+        'utils.parse_date_window': lambda: parse_date_window({'date_from': '2024-01-01'}, 7),
+        'stock.get_stock_levels': lambda: get_stock_levels(conn),
+        'stock.get_stock_at[now]': lambda: get_stock_at(conn, item, now),
+        'stock.get_stock_at[30d ago]': lambda: get_stock_at(conn, item, month_ago),
+        'stock.get_stock_range[30d]': lambda: get_stock_range(conn, item, month_ago, now),
+        'stock.insert_movements[10]': rolled_back_movements,
+        'cash.get_cash_summary[30d]': lambda: get_cash_summary(conn, month_ago.date().isoformat(), now.date().isoformat()),
+        'menu_cache.catalog': lambda: menu_cache.catalog(conn),
+        'orders.replay_order': lambda: replay_order(conn, ids['middle_order']),
+    }
+    results = {}
+    with app.app_context():
+        for name, function in functions.items():
+            results[name] = timings_ms(function, repeat)
+    conn.close()
+    return results
+
+
+def run(args):
+    database = args.database or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    scale = {'menu_items': args.menu_items, 'tables': args.tables, 'orders_per_day': args.orders_per_day,
+             'months': args.months, 'seed': args.seed}
+    if not (args.database and os.path.exists(args.database)):
+        print(f"Generating {database} with {scale}")
+        generate_database(database, **scale)
+    else:
+        scale = None
+    os.environ['DATABASE_PATH'] = database
+
+    import app as app_module
+    client = app_module.app.test_client()
+
+    from db import get_db_connection
+    conn = get_db_connection(database)
+    ids = sample_ids(conn)
+    row_counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                  for table in ('orders', 'order_items', 'movements', 'order_payments', 'order_item_events')}
+    conn.close()
+
+    print(f"Timing routes ({args.repeat} runs each)...")
+    routes = benchmark_routes(client, ids, args.repeat)
+    print(f"Timing helpers ({args.repeat} runs each)...")
+    functions = benchmark_functions(app_module.app, database, ids, args.repeat)
+
+    return {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'database': database,
+        'scale': scale,
+        'row_counts': row_counts,
+        'repeat': args.repeat,
+        'routes': routes,
+        'functions': functions,
+    }
+
+
+def print_report(report):
+    for section in ('routes', 'functions'):
+        print(f"\n{section.upper():<45} {'median':>9} {'p95':>9} {'min':>9}  (ms)")
+        for name, stats in report[section].items():
+            print(f"{name:<45} {stats['median']:>9.2f} {stats['p95']:>9.2f} {stats['min']:>9.2f}")
+
+
+def compare(report, baseline, threshold, noise_ms):
+    """Print the median change against a baseline; returns the regressions"""
+    regressions = []
+    print(f"\n{'COMPARISON':<45} {'baseline':>9} {'now':>9} {'change':>8}")
+    for section in ('routes', 'functions'):
+        for name, stats in report[section].items():
+            before = baseline.get(section, {}).get(name)
+            if before is None:
+                print(f"{name:<45} {'-':>9} {stats['median']:>9.2f} {'new':>8}")
+                continue
+            change = (stats['median'] - before['median']) / before['median'] if before['median'] else 0
+            regressed = change > threshold and stats['median'] - before['median'] > noise_ms
+            flag = '  REGRESSION' if regressed else ''
+            print(f"{name:<45} {before['median']:>9.2f} {stats['median']:>9.2f} {change:>+8.0%}{flag}")
+            if regressed:
+                regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark routes and helpers on a synthetic database")
+    parser.add_argument('--database', help="Reuse this database (generated there if missing)")
+    add_scale_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=20, help="Timed runs per route or helper")
+    parser.add_argument('--output', help="Write the JSON report here")
+    parser.add_argument('--compare', help="Baseline JSON report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="Median slowdown that counts as a regression (0.25 = 25%%)")
+    parser.add_argument('--noise-ms', type=float, default=0.5,
+                        help="Ignore slowdowns smaller than this many ms")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+        print(f"\nReport written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(report, baseline, args.threshold, args.noise_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Concurrent waiter load simulation.
+
+Starts the app on a local threaded WSGI server and runs N virtual waiters
+in threads. Each waiter repeatedly opens an order on its own table, adds
+items one at a time (or in one batch with --mode api), edits a line and
+closes the order with a split payment, like a real shift. At the end it
+prints throughput, p50/p95/p99 latency per route, errors (SQLITE_BUSY shows
+up as 500s) and how long writers waited for the database write lock.
+
+    python tests/performance/load_simulation.py --waiters 16 --orders 20
+    python tests/performance/load_simulation.py --waiters 32 --mode api \\
+        --database /tmp/bench.db --output load.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import requests
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+sys.path.insert(0, os.path.dirname(__file__))
+from synthetic_data import generate_database
+
+# First table number used by the virtual waiters, away from real tables
+WAITER_TABLES_START = 9000
+
+
+class Recorder:
+    """Latencies and errors per route, shared by every waiter thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+
+    def call(self, route, session, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, allow_redirects=False, timeout=60, **kwargs)
+        except requests.RequestException as error:
+            response, failure = None, type(error).__name__
+        else:
+            failure = None if response.status_code < 400 else f"HTTP {response.status_code}"
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self.latencies[route].append(elapsed)
+            if failure:
+                self.errors[route][failure] += 1
+        return response if failure is None else None
+
+
+def percentile(sorted_samples, fraction):
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * fraction))]
+
+
+def waiter(base_url, table, menu_ids, args, recorder, rng):
+    session = requests.Session()
+    for _ in range(args.orders):
+        response = recorder.call('orders.new_order', session, 'POST', f"{base_url}/orders/new/{table}",
+                                 data={'customer_name': 'Load'})
+        if response is None:
+            continue
+        order_id = int(response.headers['Location'].rstrip('/').split('/')[-1])
+
+        items = [rng.choice(menu_ids) for _ in range(args.items)]
+        if args.mode == 'api':
+            recorder.call('api.add_items', session, 'POST', f"{base_url}/api/orders/{order_id}/items",
+                          json={'items': [{'menu_item_id': item, 'quantity': rng.randint(1, 3)} for item in items]})
+        else:
+            for item in items:
+                recorder.call('orders.add_order_item', session, 'POST', f"{base_url}/orders/{order_id}/add_item",
+                              data={'menu_item_id': item, 'quantity': rng.randint(1, 3), 'notes': ''})
+                # The browser follows the redirect and renders the order again
+                recorder.call('orders.order_detail', session, 'GET', f"{base_url}/orders/{order_id}")
+        time.sleep(args.think_time)
+
+        response = recorder.call('api.get_order', session, 'GET', f"{base_url}/api/orders/{order_id}")
+        if response is None or not response.json()['lines']:
+            continue
+        order = response.json()
+        line = rng.choice(order['lines'])
+        recorder.call('orders.edit_order_item', session, 'POST',
+                      f"{base_url}/orders/{order_id}/items/{line['id']}/edit",
+                      data={'quantity': line['quantity'] + 1, 'notes': 'sin hielo'})
+        total = round(order['total'] + line['unit_price'], 2)
+
+        # Split between two payment methods
+        cash = round(total * rng.uniform(0.3, 0.7), 2)
+        recorder.call('orders.close_order', session, 'POST', f"{base_url}/orders/{order_id}/close",
+                      data={'payment_method[]': ['Efectivo', 'Transferencia'],
+                            'amount[]': [str(cash), str(round(total - cash, 2))]})
+        time.sleep(args.think_time)
+
+
+def prepare_database(args):
+    database = args.database or os.path.join(tempfile.mkdtemp(), 'load.db')
+    if not os.path.exists(database):
+        generate_database(database, months=1, orders_per_day=50, verbose=False)
+
+    from db import get_db_connection
+    conn = get_db_connection(database)
+    conn.executemany('''
+        INSERT OR IGNORE INTO restaurant_tables (table_number, capacity, status)
+        VALUES (?, 4, 'available')
+    ''', [(WAITER_TABLES_START + number,) for number in range(args.waiters)])
+    # Orders left open by an interrupted run would keep the tables busy
+    conn.execute('''
+        UPDATE orders SET status = 'closed'
+        WHERE status = 'active' AND table_id >= ?
+    ''', (WAITER_TABLES_START,))
+    menu_ids = [row['id'] for row in conn.execute('SELECT id FROM menu_items')]
+    conn.commit()
+    conn.close()
+    return database, menu_ids
+
+
+def run(args):
+    database, menu_ids = prepare_database(args)
+    os.environ['DATABASE_PATH'] = database
+
+    import app as app_module
+    from db import lock_waits
+
+    # One access log line per request would drown the report
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', args.port, app_module.app, threaded=True)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    recorder = Recorder()
+    lock_waits.reset()
+    threads = [threading.Thread(target=waiter, args=(base_url, WAITER_TABLES_START + number, menu_ids, args,
+                                                     recorder, random.Random(args.seed + number)))
+               for number in range(args.waiters)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    routes = {}
+    for route, samples in sorted(recorder.latencies.items()):
+        samples.sort()
+        routes[route] = {
+            'requests': len(samples),
+            'errors': sum(recorder.errors[route].values()),
+            'p50_ms': round(percentile(samples, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(samples, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(samples, 0.99) * 1000, 2),
+            'max_ms': round(samples[-1] * 1000, 2),
+        }
+    total_requests = sum(route['requests'] for route in routes.values())
+    waits = lock_waits.snapshot()
+    return {
+        'database': database,
+        'mode': args.mode,
+        'waiters': args.waiters,
+        'orders_per_waiter': args.orders,
+        'items_per_order': args.items,
+        'elapsed_seconds': round(elapsed, 2),
+        'requests_per_second': round(total_requests / elapsed, 1),
+        'orders_per_second': round(routes.get('orders.close_order', {}).get('requests', 0) / elapsed, 2),
+        'routes': routes,
+        'errors': {route: dict(counts) for route, counts in recorder.errors.items() if counts},
+        'lock_wait': {
+            'write_transactions': waits['count'],
+            'total_seconds': round(waits['total_seconds'], 3),
+            'mean_ms': round(waits['total_seconds'] / waits['count'] * 1000, 3) if waits['count'] else 0,
+            'max_ms': round(waits['max_seconds'] * 1000, 2),
+        },
+    }
+
+
+def print_report(report):
+    print(f"\n{report['waiters']} waiters x {report['orders_per_waiter']} orders ({report['mode']} mode) "
+          f"in {report['elapsed_seconds']}s: {report['requests_per_second']} req/s, "
+          f"{report['orders_per_second']} orders/s")
+    print(f"\n{'ROUTE':<28} {'reqs':>6} {'errors':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+    for route, stats in report['routes'].items():
+        print(f"{route:<28} {stats['requests']:>6} {stats['errors']:>7} {stats['p50_ms']:>8.2f} "
+              f"{stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['max_ms']:>8.2f}")
+    for route, counts in report['errors'].items():
+        print(f"  {route}: {counts}")
+    waits = report['lock_wait']
+    print(f"\nWrite lock: {waits['write_transactions']} write transactions, {waits['total_seconds']}s waiting in "
+          f"total, mean {waits['mean_ms']} ms, max {waits['max_ms']} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent waiters against a local server")
+    parser.add_argument('--waiters', type=int, default=8, help="Concurrent virtual waiters (threads)")
+    parser.add_argument('--orders', type=int, default=10, help="Orders each waiter opens and closes")
+    parser.add_argument('--items', type=int, default=6, help="Items added to each order")
+    parser.add_argument('--mode', choices=('form', 'api'), default='form',
+                        help="form: one POST per item plus page render; api: one batched call")
+    parser.add_argument('--think-time', type=float, default=0.0, help="Seconds a waiter pauses between steps")
+    parser.add_argument('--database', help="Database to load (a small synthetic one is generated if missing)")
+    parser.add_argument('--port', type=int, default=0, help="Server port (0 picks a free one)")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help="Write the JSON report here")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+        print(f"\nReport written to {args.output}")
+    if report['errors']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Synthetic database generator for benchmarks.
+
+Builds a database through the real migrations and fills it with months of
+realistic history: menu, tables, orders with lines and edits, split
+payments, stock movements with checkpoints, manual cash movements and menu
+audit rows. Everything is written with executemany, one day per
+transaction, so large scales stay fast.
+
+    python tests/performance/synthetic_data.py --output /tmp/bench.db \\
+        --menu-items 80 --tables 25 --orders-per-day 1100 --months 6
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'app'))
+from db import get_db_connection, get_pool
+from migrations import apply_migrations
+from stock import rebuild_stock_levels
+from cash import rebuild_cash_summary
+from sales import rebuild_sales_rollups
+
+
+CATEGORIES = {
+    'Comida': ['Pizza', 'Milanesa', 'Empanada', 'Hamburguesa', 'Ensalada', 'Lomito', 'Ravioles', 'Tarta'],
+    'Bebida': ['Cerveza', 'Gaseosa', 'Agua', 'Vino', 'Limonada', 'Fernet', 'Café'],
+    'Postre': ['Flan', 'Helado', 'Tiramisú', 'Brownie'],
+}
+PAYMENT_METHODS = ['Efectivo', 'Transferencia', 'Tarjeta', 'QR']
+CUSTOMERS = ['Ana', 'Juan', 'María', 'Pedro', 'Lucía', 'Martín', 'Sofía', 'Diego', '', '']
+
+
+def generate_menu(conn, rng, menu_items):
+    rows = []
+    names = [(category, name) for category, items in CATEGORIES.items() for name in items]
+    for index in range(menu_items):
+        category, base = names[index % len(names)]
+        name = base if index < len(names) else f"{base} {index // len(names) + 1}"
+        # Drinks and desserts are counted in stock, dishes are not
+        stockable = 1 if category != 'Comida' or rng.random() < 0.2 else 0
+        rows.append((index + 1, name, f"{name} de la casa", category, round(rng.uniform(2, 30), 2), stockable))
+    conn.executemany('''
+        INSERT INTO menu_items (id, name, description, category, price, stockable)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.executemany('''
+        INSERT INTO menu_audit (menu_item_id, action, old_values, new_values, timestamp, user_info)
+        VALUES (?, 'CREATE', NULL, ?, ?, 'system')
+    ''', [(row[0], f"name: {row[1]}, price: ${row[4]}", datetime(2020, 1, 1)) for row in rows])
+    return [{'id': row[0], 'name': row[1], 'price': row[4], 'stockable': row[5]} for row in rows]
+
+
+def generate_tables(conn, tables):
+    conn.executemany('''
+        INSERT INTO restaurant_tables (table_number, capacity, status)
+        VALUES (?, ?, 'available')
+    ''', [(number, 2 + 2 * (number % 3)) for number in range(1, tables + 1)])
+
+
+def generate_day(conn, rng, day, menu, scale, counters, stock, open_tables):
+    """Write one day of orders, movements and cash; returns rows written"""
+    stockable = [item for item in menu if item['stockable']]
+    orders, order_items, events, payments, movements = [], [], [], [], []
+    today = datetime.now().date()
+    opening_stock = dict(stock)
+
+    # Morning delivery restocks every stockable item that is running low
+    delivery = datetime.combine(day, datetime.min.time()) + timedelta(hours=9)
+    for item in stockable:
+        if stock[item['id']] < 200:
+            quantity = rng.randint(200, 400)
+            stock[item['id']] += quantity
+            movements.append((item['id'], item['name'], quantity, 'Entrada', 'Reposición', delivery))
+
+    orders_today = max(1, int(rng.gauss(scale['orders_per_day'], scale['orders_per_day'] * 0.15)))
+    for _ in range(orders_today):
+        counters['order'] += 1
+        order_id = counters['order']
+        table_id = rng.randint(1, scale['tables'])
+        created_at = datetime.combine(day, datetime.min.time()) + timedelta(
+            hours=rng.uniform(11.5, 23.5))
+        closed_at = created_at + timedelta(minutes=rng.randint(20, 150))
+        still_open = day == today and table_id not in open_tables and rng.random() < 0.3
+
+        lines = []
+        for _ in range(rng.randint(1, 7)):
+            counters['line'] += 1
+            item = rng.choice(menu)
+            quantity = rng.randint(1, 4)
+            added_at = created_at + timedelta(minutes=rng.randint(0, 15))
+            lines.append([counters['line'], item, quantity, ''])
+            events.append((order_id, counters['line'], 'added', item['id'], item['name'], item['price'],
+                           quantity, '', added_at))
+        # A few lines get edited and some removed, like on a real night
+        for line in lines:
+            if rng.random() < 0.1:
+                line[2] += 1
+                line[3] = 'sin hielo'
+                events.append((order_id, line[0], 'edited', None, None, None, line[2], line[3],
+                               created_at + timedelta(minutes=20)))
+        if len(lines) > 1 and rng.random() < 0.05:
+            removed = lines.pop()
+            events.append((order_id, removed[0], 'removed', None, None, None, None, None,
+                           created_at + timedelta(minutes=25)))
+
+        customer = rng.choice(CUSTOMERS)
+        orders.append((order_id, table_id, customer, 'active' if still_open else 'closed', created_at,
+                       None if still_open else closed_at))
+        kitchen_status = 'pending' if still_open else 'served'
+        order_items.extend((line_id, order_id, item['id'], item['name'], quantity, item['price'], notes,
+                            kitchen_status)
+                           for line_id, item, quantity, notes in lines)
+        if still_open:
+            open_tables[table_id] = (order_id, customer)
+            continue
+
+        total = round(sum(item['price'] * quantity for _, item, quantity, _ in lines), 2)
+        if rng.random() < 0.25:
+            split = round(total * rng.uniform(0.2, 0.8), 2)
+            payments.append((order_id, rng.choice(PAYMENT_METHODS), split, closed_at))
+            payments.append((order_id, rng.choice(PAYMENT_METHODS), round(total - split, 2), closed_at))
+        else:
+            payments.append((order_id, rng.choice(PAYMENT_METHODS), total, closed_at))
+
+        for _, item, quantity, _ in lines:
+            if item['stockable']:
+                stock[item['id']] -= quantity
+                movements.append((item['id'], item['name'], -quantity, 'out',
+                                  f"Auto: Order #{order_id} closed - {item['name']} x{quantity}",
+                                  closed_at))
+
+    manual = [(rng.choice(PAYMENT_METHODS[:2]), 'Caja chica', round(-rng.uniform(5, 80), 2),
+               datetime.combine(day, datetime.min.time()) + timedelta(hours=rng.uniform(10, 22)), 'Egreso Manual')
+              for _ in range(rng.randint(0, 4))]
+
+    conn.executemany('''
+        INSERT INTO orders (id, table_id, customer_name, status, created_at, closed_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', orders)
+    conn.executemany('''
+        INSERT INTO order_items (id, order_id, menu_item_id, menu_item_name, quantity, unit_price, notes,
+                                 kitchen_status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', order_items)
+    conn.executemany('''
+        INSERT INTO order_item_events (order_id, order_item_id, event, menu_item_id, menu_item_name,
+                                       unit_price, quantity, notes, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', events)
+    conn.executemany('''
+        INSERT INTO order_payments (order_id, payment_method, amount, created_at)
+        VALUES (?, ?, ?, ?)
+    ''', payments)
+    # Movements go in date order, like the app writes them, with the running
+    # stock of each item as partial_stock
+    movements.sort(key=lambda movement: movement[5])
+    running_stock = opening_stock
+    rows = []
+    for movement in movements:
+        running_stock[movement[0]] += movement[2]
+        rows.append(movement + (running_stock[movement[0]],))
+    conn.executemany('''
+        INSERT INTO movements (menu_item_id, menu_item_name, quantity_change, movement_type, notes, date, partial_stock)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.executemany('''
+        INSERT INTO manual_money_movements (payment_method, description, amount, date, movement_type)
+        VALUES (?, ?, ?, ?, ?)
+    ''', manual)
+    return len(orders) + len(order_items) + len(events) + len(payments) + len(movements) + len(manual)
+
+
+def generate_database(path, menu_items=60, tables=20, orders_per_day=150, months=6, seed=42, verbose=True):
+    """Create a synthetic database at `path`; returns a dict of row counts"""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    rng = random.Random(seed)
+    scale = {'menu_items': menu_items, 'tables': tables, 'orders_per_day': orders_per_day, 'months': months}
+    started = time.perf_counter()
+
+    conn = get_db_connection(path)
+    apply_migrations(conn)
+    menu = generate_menu(conn, rng, menu_items)
+    generate_tables(conn, tables)
+    conn.commit()
+
+    counters = {'order': 0, 'line': 0}
+    stock = {item['id']: 0 for item in menu if item['stockable']}
+    open_tables = {}
+    today = datetime.now().date()
+    first_day = today - timedelta(days=30 * months)
+    day = first_day
+    while day <= today:
+        generate_day(conn, rng, day, menu, scale, counters, stock, open_tables)
+        conn.commit()
+        if verbose and day.day == 1:
+            print(f"  {day.isoformat()}: {counters['order']} orders", flush=True)
+        day += timedelta(days=1)
+
+    for table_id, (order_id, customer) in open_tables.items():
+        conn.execute('''
+            UPDATE restaurant_tables SET status = 'in use', customer_name = ?, open_order_number = ?
+            WHERE table_number = ?
+        ''', (customer, order_id, table_id))
+    conn.commit()
+
+    rebuild_stock_levels(conn=conn)
+    rebuild_cash_summary(conn=conn)
+    rebuild_sales_rollups(conn=conn)
+    conn.execute("INSERT INTO change_counters (domain, version) VALUES ('menu', 1)")
+    conn.commit()
+    conn.execute('ANALYZE')
+
+    counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+              for table in ('menu_items', 'orders', 'order_items', 'order_item_events', 'order_payments',
+                            'movements', 'stock_checkpoints', 'manual_money_movements')}
+    conn.close()
+    get_pool(path).close_all()
+
+    if verbose:
+        print(f"Generated {path} in {time.perf_counter() - started:.1f}s: {counts}")
+    return counts
+
+
+def add_scale_arguments(parser):
+    parser.add_argument('--menu-items', type=int, default=60)
+    parser.add_argument('--tables', type=int, default=20)
+    parser.add_argument('--orders-per-day', type=int, default=150)
+    parser.add_argument('--months', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=42)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic restaurant database")
+    parser.add_argument('--output', required=True, help="Database file to create (overwritten)")
+    add_scale_arguments(parser)
+    args = parser.parse_args()
+    generate_database(args.output, args.menu_items, args.tables, args.orders_per_day, args.months, args.seed)
+
+
+if __name__ == "__main__":
+    main()